@@ -5,7 +5,7 @@ from dataclasses import dataclass, field
 from dotenv import load_dotenv
 
 load_dotenv()
-loggerlogger = logging.getLogger(__name__)
+logger = logging.getLogger(__name__)
 
 def _json_env(name: str, default):
     """Parse JSON from env; return default if missing or invalid."""
@@ -34,11 +34,39 @@ class Config:
     VARIABLES: list[str] = field(default_factory=lambda: _json_env("VARIABLES", ["temp_2m","wind_speed_10m","precipitation"]))
     HORIZONS_HOURS: list[int] = field(default_factory=lambda: _json_env("HORIZONS_HOURS", [1,3,6,12,24,48,72]))
 
+    # Observation features: lags (hours before valid_time) and trailing rolling-mean windows
+    FEATURE_LAGS_HOURS: list[int] = field(default_factory=lambda: _json_env("FEATURE_LAGS_HOURS", [1,3,6]))
+    FEATURE_ROLLING_HOURS: list[int] = field(default_factory=lambda: _json_env("FEATURE_ROLLING_HOURS", [3,6,24]))
+
+    # Processes for the (variable, horizon) training grid; 0 = one per core, 1 = sequential
+    TRAIN_WORKERS: int = int(os.getenv("TRAIN_WORKERS", "0"))
+    # LightGBM warm start: continue the previous booster on newly labelled rows, with a full retrain
+    # every N days (0 = always full) or when its error on the new rows exceeds the backtest RMSE by DRIFT_TOLERANCE
+    FULL_RETRAIN_EVERY_DAYS: int = int(os.getenv("FULL_RETRAIN_EVERY_DAYS", "7"))
+    DRIFT_TOLERANCE: float = float(os.getenv("DRIFT_TOLERANCE", "0.25"))
+
+    # Meteostat: initial lookback for locations without stored observations, and cap on gap backfill
+    OBS_BACKFILL_DAYS: int = int(os.getenv("OBS_BACKFILL_DAYS", "7"))
+    OBS_MAX_BACKFILL_DAYS: int = int(os.getenv("OBS_MAX_BACKFILL_DAYS", "30"))
+
     LOCAL_TIMEZONE: str = os.getenv("LOCAL_TIMEZONE", "Africa/Johannesburg")
 
     REQUESTS_CONCURRENCY: int = int(os.getenv("REQUESTS_CONCURRENCY", "4"))
+    # Per-provider worker limits, e.g. {"met_no": 2}; providers not listed use REQUESTS_CONCURRENCY
+    PROVIDER_CONCURRENCY: dict[str, int] = field(default_factory=lambda: _json_env("PROVIDER_CONCURRENCY", {}))
+    # Locations per Open-Meteo request (comma-separated latitude/longitude lists)
+    OPEN_METEO_BATCH_SIZE: int = int(os.getenv("OPEN_METEO_BATCH_SIZE", "50"))
+    # Re-resolve weather.gov gridpoints after this many days
+    NWS_GRIDPOINT_TTL_DAYS: int = int(os.getenv("NWS_GRIDPOINT_TTL_DAYS", "30"))
+    # Free-tier daily budgets (quota units) and units charged per request for metered providers
+    PROVIDER_DAILY_QUOTAS: dict[str, int] = field(default_factory=lambda: _json_env("PROVIDER_DAILY_QUOTAS", {"openweather": 1000, "visual_crossing": 1000}))
+    PROVIDER_CALL_COST: dict[str, int] = field(default_factory=lambda: _json_env("PROVIDER_CALL_COST", {"openweather": 1, "visual_crossing": 15}))
     REQUESTS_TIMEOUT: int = int(os.getenv("REQUESTS_TIMEOUT", "30"))
     REQUESTS_CACHE_TTL_SECONDS: int = int(os.getenv("REQUESTS_CACHE_TTL_SECONDS", "600"))
+    HTTP_CACHE_DIR: str = os.getenv("HTTP_CACHE_DIR", os.path.join(".cache", "http"))
+    HTTP_CACHE_MAX_BYTES: int = int(os.getenv("HTTP_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+    # Memory-mapped forecast cubes (one per variable); synced from forecasts.created_at before feature builds
+    FORECAST_CUBE_DIR: str = os.getenv("FORECAST_CUBE_DIR", os.path.join(".cache", "cube"))
 
 CFG = Config()
 
@@ -59,6 +87,22 @@ UNIT_MAP = {
 
 SOURCES = ["open_meteo", "met_no", "openweather", "visual_crossing", "weather_gov", "our_model"]
 
+# Smallint codes stored in the fact tables; must match the `sources`/`variables` seeds in schema.sql
+SOURCE_IDS = {
+    "open_meteo": 1,
+    "met_no": 2,
+    "openweather": 3,
+    "visual_crossing": 4,
+    "weather_gov": 5,
+    "our_model": 6,
+    "meteostat": 7,
+}
+VARIABLE_IDS = {
+    "temp_2m": 1,
+    "wind_speed_10m": 2,
+    "precipitation": 3,
+}
+
 def clamp_float(x: float, min_v: float = -1e6, max_v: float = 1e6) -> float:
     """Clamp a float value to a safe range to avoid extreme outliers."""
     return float(min(max(x, min_v), max_v))
@@ -0,0 +1,94 @@
+-- Convert pre-existing unpartitioned forecasts/observations tables to monthly range partitions.
+-- Run once with psql from the repo root:
+--   psql -v ON_ERROR_STOP=1 "$DATABASE_URL" -f src/db/migrations/001_partition_by_time.sql
+-- Safe to re-run: tables that are already partitioned are left alone.
+BEGIN;
+
+-- 1. Move unpartitioned tables (and their indexes) out of the way
+DO $$
+DECLARE
+  t TEXT;
+  idx TEXT;
+BEGIN
+  FOREACH t IN ARRAY ARRAY['forecasts', 'observations'] LOOP
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass(t)) = 'r' THEN
+      EXECUTE format('ALTER TABLE %I RENAME TO %I', t, t || '_unpartitioned');
+      FOR idx IN SELECT indexname FROM pg_indexes
+                 WHERE schemaname = current_schema() AND tablename = t || '_unpartitioned' LOOP
+        EXECUTE format('ALTER INDEX %I RENAME TO %I', idx, left('legacy_' || idx, 63));
+      END LOOP;
+    END IF;
+  END LOOP;
+END $$;
+
+-- 2. Create the partitioned tables, partitions and indexes
+\ir ../schema.sql
+
+-- 3. Copy legacy rows into partitions covering their full time range, then drop the old tables.
+-- The hourly schema.sql run may already have backfilled the dimension ids on the legacy tables and
+-- dropped their text columns, so ids are copied as stored; the text columns (when still present)
+-- only fill ids that are NULL.
+DO $$
+DECLARE
+  lo TIMESTAMPTZ;
+  hi TIMESTAMPTZ;
+BEGIN
+  IF to_regclass('forecasts_unpartitioned') IS NOT NULL THEN
+    SELECT min(valid_time), max(valid_time) INTO lo, hi FROM forecasts_unpartitioned;
+    IF lo IS NOT NULL THEN
+      PERFORM ensure_monthly_partitions('forecasts', lo, hi);
+    END IF;
+    ALTER TABLE forecasts_unpartitioned ADD COLUMN IF NOT EXISTS location_id INT,
+                                        ADD COLUMN IF NOT EXISTS source_id SMALLINT,
+                                        ADD COLUMN IF NOT EXISTS variable_id SMALLINT;
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_schema = current_schema() AND table_name = 'forecasts_unpartitioned'
+                 AND column_name = 'source') THEN
+      INSERT INTO locations (name, lat, lon)
+      SELECT DISTINCT lat || ',' || lon, lat, lon FROM forecasts_unpartitioned WHERE location_id IS NULL
+      ON CONFLICT (lat, lon) DO NOTHING;
+      UPDATE forecasts_unpartitioned f SET location_id = l.id, source_id = s.id, variable_id = v.id
+      FROM locations l, sources s, variables v
+      WHERE (f.location_id IS NULL OR f.source_id IS NULL OR f.variable_id IS NULL)
+        AND l.lat = f.lat AND l.lon = f.lon AND s.name = f.source AND v.name = f.variable;
+    END IF;
+    INSERT INTO forecasts (source_id, location_id, variable_id, issue_time, valid_time, horizon_hours, value, created_at)
+    SELECT f.source_id, f.location_id, f.variable_id, f.issue_time, f.valid_time, f.horizon_hours, f.value, f.created_at
+    FROM forecasts_unpartitioned f
+    WHERE f.location_id IS NOT NULL AND f.source_id IS NOT NULL AND f.variable_id IS NOT NULL
+    ON CONFLICT DO NOTHING;
+    DROP TABLE forecasts_unpartitioned;
+  END IF;
+
+  IF to_regclass('observations_unpartitioned') IS NOT NULL THEN
+    SELECT min(obs_time), max(obs_time) INTO lo, hi FROM observations_unpartitioned;
+    IF lo IS NOT NULL THEN
+      PERFORM ensure_monthly_partitions('observations', lo, hi);
+    END IF;
+    ALTER TABLE observations_unpartitioned ADD COLUMN IF NOT EXISTS location_id INT,
+                                           ADD COLUMN IF NOT EXISTS source_id SMALLINT,
+                                           ADD COLUMN IF NOT EXISTS variable_id SMALLINT;
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_schema = current_schema() AND table_name = 'observations_unpartitioned'
+                 AND column_name = 'source') THEN
+      INSERT INTO locations (name, lat, lon)
+      SELECT DISTINCT lat || ',' || lon, lat, lon FROM observations_unpartitioned WHERE location_id IS NULL
+      ON CONFLICT (lat, lon) DO NOTHING;
+      UPDATE observations_unpartitioned o SET location_id = l.id, source_id = s.id, variable_id = v.id
+      FROM locations l, sources s, variables v
+      WHERE (o.location_id IS NULL OR o.source_id IS NULL OR o.variable_id IS NULL)
+        AND l.lat = o.lat AND l.lon = o.lon AND s.name = o.source AND v.name = o.variable;
+    END IF;
+    INSERT INTO observations (station_id, source_id, location_id, variable_id, obs_time, value, created_at)
+    SELECT o.station_id, o.source_id, o.location_id, o.variable_id, o.obs_time, o.value, o.created_at
+    FROM observations_unpartitioned o
+    WHERE o.location_id IS NOT NULL AND o.source_id IS NOT NULL AND o.variable_id IS NOT NULL
+    ON CONFLICT DO NOTHING;
+    DROP TABLE observations_unpartitioned;
+  END IF;
+END $$;
+
+ANALYZE forecasts;
+ANALYZE observations;
+
+COMMIT;
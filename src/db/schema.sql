@@ -1,37 +1,80 @@
--- Forecasts from each vendor
-CREATE TABLE IF NOT EXISTS forecasts (
-  id BIGSERIAL PRIMARY KEY,
-  source TEXT NOT NULL,              -- 'open_meteo','met_no','openweather','visual_crossing','weather_gov','our_model'
+-- Dimensions: stable integer location ids and smallint source/variable codes used as join keys.
+-- Codes mirror SOURCE_IDS / VARIABLE_IDS in src/config.py.
+CREATE TABLE IF NOT EXISTS locations (
+  id SERIAL PRIMARY KEY,             -- INT, matching the location_id columns of the fact tables
+  name TEXT NOT NULL,
   lat DOUBLE PRECISION NOT NULL,
   lon DOUBLE PRECISION NOT NULL,
-  variable TEXT NOT NULL,            -- 'temp_2m','wind_speed_10m','precipitation'
+  created_at TIMESTAMPTZ DEFAULT now()
+);
+
+DO $$
+BEGIN
+  -- locations.id was BIGSERIAL before the fact tables referenced it as INT
+  IF (SELECT data_type FROM information_schema.columns
+      WHERE table_schema = current_schema() AND table_name = 'locations' AND column_name = 'id') = 'bigint' THEN
+    ALTER TABLE locations ALTER COLUMN id TYPE INT;
+    ALTER SEQUENCE IF EXISTS locations_id_seq AS INT;
+  END IF;
+  IF to_regclass('locations_lat_lon_key') IS NULL THEN
+    -- earlier seeding runs appended duplicates; keep the first id per coordinate
+    DELETE FROM locations a USING locations b
+    WHERE a.lat = b.lat AND a.lon = b.lon AND a.id > b.id;
+    CREATE UNIQUE INDEX locations_lat_lon_key ON locations (lat, lon);
+  END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS sources (
+  id SMALLINT PRIMARY KEY,
+  name TEXT NOT NULL UNIQUE
+);
+INSERT INTO sources (id, name) VALUES
+  (1, 'open_meteo'), (2, 'met_no'), (3, 'openweather'), (4, 'visual_crossing'),
+  (5, 'weather_gov'), (6, 'our_model'), (7, 'meteostat')
+ON CONFLICT DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS variables (
+  id SMALLINT PRIMARY KEY,
+  name TEXT NOT NULL UNIQUE,
+  unit TEXT NOT NULL
+);
+INSERT INTO variables (id, name, unit) VALUES
+  (1, 'temp_2m', 'C'), (2, 'wind_speed_10m', 'm/s'), (3, 'precipitation', 'mm')
+ON CONFLICT DO NOTHING;
+
+-- Forecasts from each vendor (monthly range partitions on valid_time).
+-- Names, coordinates and units live on the dimension tables; values are in variables.unit.
+CREATE TABLE IF NOT EXISTS forecasts (
+  id BIGSERIAL,
+  source_id SMALLINT NOT NULL,       -- sources.id
+  location_id INT NOT NULL,          -- locations.id
+  variable_id SMALLINT NOT NULL,     -- variables.id
   issue_time TIMESTAMPTZ NOT NULL,   -- when forecast was issued
   valid_time TIMESTAMPTZ NOT NULL,   -- target time
   horizon_hours INT NOT NULL,
   value DOUBLE PRECISION NOT NULL,
-  unit TEXT NOT NULL,                -- 'C','m/s','mm'
-  created_at TIMESTAMPTZ DEFAULT now()
-);
+  created_at TIMESTAMPTZ DEFAULT now(),
+  PRIMARY KEY (id, valid_time)
+) PARTITION BY RANGE (valid_time);
 
--- Observed ground truth
+-- Observed ground truth (monthly range partitions on obs_time)
 CREATE TABLE IF NOT EXISTS observations (
-  id BIGSERIAL PRIMARY KEY,
+  id BIGSERIAL,
   station_id TEXT,
-  lat DOUBLE PRECISION NOT NULL,
-  lon DOUBLE PRECISION NOT NULL,
-  variable TEXT NOT NULL,
+  source_id SMALLINT NOT NULL,       -- e.g. meteostat
+  location_id INT NOT NULL,
+  variable_id SMALLINT NOT NULL,
   obs_time TIMESTAMPTZ NOT NULL,
   value DOUBLE PRECISION NOT NULL,
-  unit TEXT NOT NULL,
-  source TEXT NOT NULL,              -- 'meteostat','weather_gov', etc.
-  created_at TIMESTAMPTZ DEFAULT now()
-);
+  created_at TIMESTAMPTZ DEFAULT now(),
+  PRIMARY KEY (id, obs_time)
+) PARTITION BY RANGE (obs_time);
 
--- Error metrics per source/horizon/variable/time
+-- Error metrics per source/horizon/variable/time (legacy; superseded by error_stats)
 CREATE TABLE IF NOT EXISTS errors (
   id BIGSERIAL PRIMARY KEY,
-  source TEXT NOT NULL,
-  variable TEXT NOT NULL,
+  source_id SMALLINT NOT NULL,
+  variable_id SMALLINT NOT NULL,
   valid_time TIMESTAMPTZ NOT NULL,
   horizon_hours INT NOT NULL,
   mae DOUBLE PRECISION,
@@ -41,6 +84,239 @@ CREATE TABLE IF NOT EXISTS errors (
   created_at TIMESTAMPTZ DEFAULT now()
 );
 
+-- Forecast error sufficient statistics per (source, variable, horizon, location, valid hour).
+-- Sums merge exactly, so any window's MAE/RMSE/bias/MAPE is sum-then-divide (monthly partitions on valid_time).
+CREATE TABLE IF NOT EXISTS error_stats (
+  source_id SMALLINT NOT NULL,
+  variable_id SMALLINT NOT NULL,
+  horizon_hours INT NOT NULL,
+  location_id INT NOT NULL,
+  valid_time TIMESTAMPTZ NOT NULL,
+  n INT NOT NULL,
+  sum_err DOUBLE PRECISION NOT NULL,      -- forecast - observed
+  sum_abs_err DOUBLE PRECISION NOT NULL,
+  sum_sq_err DOUBLE PRECISION NOT NULL,
+  sum_ape DOUBLE PRECISION NOT NULL,      -- |err| / (|observed| + 1e-6)
+  updated_at TIMESTAMPTZ DEFAULT now(),
+  PRIMARY KEY (source_id, variable_id, horizon_hours, location_id, valid_time)
+) PARTITION BY RANGE (valid_time);
+
+-- Daily rollup of error_stats (UTC days); leaderboards and the dashboard read this
+CREATE TABLE IF NOT EXISTS error_stats_daily (
+  source_id SMALLINT NOT NULL,
+  variable_id SMALLINT NOT NULL,
+  horizon_hours INT NOT NULL,
+  location_id INT NOT NULL,
+  day DATE NOT NULL,
+  n BIGINT NOT NULL,
+  sum_err DOUBLE PRECISION NOT NULL,
+  sum_abs_err DOUBLE PRECISION NOT NULL,
+  sum_sq_err DOUBLE PRECISION NOT NULL,
+  sum_ape DOUBLE PRECISION NOT NULL,
+  PRIMARY KEY (source_id, variable_id, horizon_hours, location_id, day)
+);
+
+-- Feature definitions: version hash -> ordered feature names (src/model/feature_store.py)
+CREATE TABLE IF NOT EXISTS feature_sets (
+  version TEXT PRIMARY KEY,
+  columns TEXT[] NOT NULL,
+  definition JSONB NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT now()
+);
+
+-- Materialised features shared by train and predict (monthly partitions on valid_time)
+CREATE TABLE IF NOT EXISTS feature_store (
+  feature_version TEXT NOT NULL,
+  variable_id SMALLINT NOT NULL,
+  horizon_hours INT NOT NULL,
+  location_id INT NOT NULL,
+  valid_time TIMESTAMPTZ NOT NULL,
+  features REAL[] NOT NULL,          -- ordered as feature_sets.columns
+  y REAL,                            -- observed target (±1h), NULL until observed
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  labelled_at TIMESTAMPTZ,           -- when y first got a value; later rebuilds keep it
+  PRIMARY KEY (feature_version, variable_id, horizon_hours, location_id, valid_time)
+) PARTITION BY RANGE (valid_time);
+
+-- labelled_at on stores created before it existed: rows already labelled count from their last rebuild
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                 WHERE table_schema = current_schema() AND table_name = 'feature_store' AND column_name = 'labelled_at') THEN
+    ALTER TABLE feature_store ADD COLUMN labelled_at TIMESTAMPTZ;
+    UPDATE feature_store SET labelled_at = updated_at WHERE y IS NOT NULL;
+  END IF;
+END $$;
+
+-- Dimension keys on tables created before they existed
+ALTER TABLE forecasts ADD COLUMN IF NOT EXISTS location_id INT;
+ALTER TABLE forecasts ADD COLUMN IF NOT EXISTS source_id SMALLINT;
+ALTER TABLE forecasts ADD COLUMN IF NOT EXISTS variable_id SMALLINT;
+ALTER TABLE observations ADD COLUMN IF NOT EXISTS location_id INT;
+ALTER TABLE observations ADD COLUMN IF NOT EXISTS source_id SMALLINT;
+ALTER TABLE observations ADD COLUMN IF NOT EXISTS variable_id SMALLINT;
+ALTER TABLE errors ADD COLUMN IF NOT EXISTS source_id SMALLINT;
+ALTER TABLE errors ADD COLUMN IF NOT EXISTS variable_id SMALLINT;
+
+-- Create missing monthly partitions of a range-partitioned table covering [from_ts, to_ts].
+-- No-op for tables that are still unpartitioned (see src/db/migrations/001_partition_by_time.sql).
+CREATE OR REPLACE FUNCTION ensure_monthly_partitions(parent TEXT, from_ts TIMESTAMPTZ, to_ts TIMESTAMPTZ)
+RETURNS void LANGUAGE plpgsql AS $$
+DECLARE
+  m DATE := date_trunc('month', from_ts AT TIME ZONE 'UTC')::date;
+BEGIN
+  IF (SELECT relkind FROM pg_class WHERE oid = to_regclass(parent)) IS DISTINCT FROM 'p' THEN
+    RETURN;
+  END IF;
+  WHILE m <= (to_ts AT TIME ZONE 'UTC')::date LOOP
+    EXECUTE format(
+      'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+      parent || '_' || to_char(m, 'YYYYMM'), parent,
+      m::timestamp AT TIME ZONE 'UTC', (m + interval '1 month')::timestamp AT TIME ZONE 'UTC'
+    );
+    m := (m + interval '1 month')::date;
+  END LOOP;
+END $$;
+
+-- Keep a year of history and the forecast window ahead partitioned (runs with every bootstrap)
+SELECT ensure_monthly_partitions('forecasts', now() - interval '12 months', now() + interval '3 months');
+SELECT ensure_monthly_partitions('observations', now() - interval '12 months', now() + interval '3 months');
+SELECT ensure_monthly_partitions('error_stats', now() - interval '12 months', now() + interval '3 months');
+SELECT ensure_monthly_partitions('feature_store', now() - interval '12 months', now() + interval '3 months');
+
+-- Natural keys on the dimension ids: jobs upsert on these, so re-running ETL/predict/verify is idempotent.
+-- Runs once per table: on tables that still carry the text source/variable/lat/lon columns, removes
+-- duplicates (newest row kept) and backfills the ids from them; then makes the ids NOT NULL and
+-- replaces the earlier text-keyed unique index.
+DO $$
+BEGIN
+  IF to_regclass('forecasts_dim_key') IS NULL THEN
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_schema = current_schema() AND table_name = 'forecasts' AND column_name = 'source') THEN
+      DELETE FROM forecasts a USING forecasts b
+      WHERE a.source = b.source AND a.lat = b.lat AND a.lon = b.lon AND a.variable = b.variable
+        AND a.issue_time = b.issue_time AND a.valid_time = b.valid_time
+        AND a.horizon_hours = b.horizon_hours AND a.id < b.id;
+      INSERT INTO locations (name, lat, lon)
+      SELECT DISTINCT lat || ',' || lon, lat, lon FROM forecasts
+      ON CONFLICT (lat, lon) DO NOTHING;
+      UPDATE forecasts f SET location_id = l.id, source_id = s.id, variable_id = v.id
+      FROM locations l, sources s, variables v
+      WHERE f.location_id IS NULL AND l.lat = f.lat AND l.lon = f.lon AND s.name = f.source AND v.name = f.variable;
+    END IF;
+    ALTER TABLE forecasts ALTER COLUMN location_id SET NOT NULL,
+                          ALTER COLUMN source_id SET NOT NULL,
+                          ALTER COLUMN variable_id SET NOT NULL;
+    CREATE UNIQUE INDEX forecasts_dim_key
+      ON forecasts (source_id, location_id, variable_id, issue_time, valid_time, horizon_hours);
+    DROP INDEX IF EXISTS forecasts_natural_key;
+  END IF;
+
+  IF to_regclass('observations_dim_key') IS NULL THEN
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_schema = current_schema() AND table_name = 'observations' AND column_name = 'source') THEN
+      DELETE FROM observations a USING observations b
+      WHERE a.source = b.source AND a.lat = b.lat AND a.lon = b.lon AND a.variable = b.variable
+        AND a.obs_time = b.obs_time AND a.id < b.id;
+      INSERT INTO locations (name, lat, lon)
+      SELECT DISTINCT lat || ',' || lon, lat, lon FROM observations
+      ON CONFLICT (lat, lon) DO NOTHING;
+      UPDATE observations o SET location_id = l.id, source_id = s.id, variable_id = v.id
+      FROM locations l, sources s, variables v
+      WHERE o.location_id IS NULL AND l.lat = o.lat AND l.lon = o.lon AND s.name = o.source AND v.name = o.variable;
+    END IF;
+    ALTER TABLE observations ALTER COLUMN location_id SET NOT NULL,
+                             ALTER COLUMN source_id SET NOT NULL,
+                             ALTER COLUMN variable_id SET NOT NULL;
+    CREATE UNIQUE INDEX observations_dim_key
+      ON observations (source_id, location_id, variable_id, obs_time);
+    DROP INDEX IF EXISTS observations_natural_key;
+  END IF;
+
+  IF to_regclass('errors_dim_key') IS NULL THEN
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_schema = current_schema() AND table_name = 'errors' AND column_name = 'source') THEN
+      DELETE FROM errors a USING errors b
+      WHERE a.source = b.source AND a.variable = b.variable
+        AND a.valid_time = b.valid_time AND a.horizon_hours = b.horizon_hours AND a.id < b.id;
+      UPDATE errors e SET source_id = s.id, variable_id = v.id
+      FROM sources s, variables v
+      WHERE e.source_id IS NULL AND s.name = e.source AND v.name = e.variable;
+    END IF;
+    ALTER TABLE errors ALTER COLUMN source_id SET NOT NULL,
+                       ALTER COLUMN variable_id SET NOT NULL;
+    CREATE UNIQUE INDEX errors_dim_key
+      ON errors (source_id, variable_id, valid_time, horizon_hours);
+    DROP INDEX IF EXISTS errors_natural_key;
+  END IF;
+END $$;
+
+-- The text copies of the dimension keys are backfilled into the ids above and no longer read or written
+ALTER TABLE forecasts DROP COLUMN IF EXISTS source, DROP COLUMN IF EXISTS lat, DROP COLUMN IF EXISTS lon,
+                      DROP COLUMN IF EXISTS variable, DROP COLUMN IF EXISTS unit;
+ALTER TABLE observations DROP COLUMN IF EXISTS source, DROP COLUMN IF EXISTS lat, DROP COLUMN IF EXISTS lon,
+                         DROP COLUMN IF EXISTS variable, DROP COLUMN IF EXISTS unit;
+ALTER TABLE errors DROP COLUMN IF EXISTS source, DROP COLUMN IF EXISTS variable;
+
+-- Covering indexes for the real access paths (integer keys), BRIN for time-range scans
+DROP INDEX IF EXISTS forecasts_var_src_h_time;
+DROP INDEX IF EXISTS forecasts_src_loc_var_time;
+DROP INDEX IF EXISTS observations_var_loc_time;
+DROP INDEX IF EXISTS errors_var_src_h_time;
+-- vendor matrix / error join: variable + source + horizon over a time range
+CREATE INDEX IF NOT EXISTS forecasts_vid_sid_h_time
+  ON forecasts (variable_id, source_id, horizon_hours, valid_time) INCLUDE (location_id, value);
+-- per-location lookups (/predict, forecast-observation join)
+CREATE INDEX IF NOT EXISTS forecasts_sid_loc_vid_time
+  ON forecasts (source_id, location_id, variable_id, valid_time) INCLUDE (horizon_hours, value);
+CREATE INDEX IF NOT EXISTS forecasts_valid_time_brin ON forecasts USING brin (valid_time);
+CREATE INDEX IF NOT EXISTS observations_vid_loc_time
+  ON observations (variable_id, location_id, obs_time) INCLUDE (value);
+CREATE INDEX IF NOT EXISTS observations_obs_time_brin ON observations USING brin (obs_time);
+-- arrival-order scans for incremental verification and feature refresh
+CREATE INDEX IF NOT EXISTS observations_created_at_brin ON observations USING brin (created_at);
+CREATE INDEX IF NOT EXISTS forecasts_created_at_brin ON forecasts USING brin (created_at);
+CREATE INDEX IF NOT EXISTS errors_vid_sid_h_time
+  ON errors (variable_id, source_id, horizon_hours, valid_time) INCLUDE (mae, rmse, mape, n);
+CREATE INDEX IF NOT EXISTS errors_valid_time_brin ON errors USING brin (valid_time);
+CREATE INDEX IF NOT EXISTS error_stats_valid_time_brin ON error_stats USING brin (valid_time);
+CREATE INDEX IF NOT EXISTS error_stats_daily_day ON error_stats_daily (day);
+-- hourly predict: rows rebuilt since the last run
+CREATE INDEX IF NOT EXISTS feature_store_updated
+  ON feature_store (feature_version, variable_id, horizon_hours, updated_at);
+-- warm-start training: rows labelled since the previous model
+CREATE INDEX IF NOT EXISTS feature_store_labelled
+  ON feature_store (feature_version, variable_id, horizon_hours, labelled_at);
+
+-- weather.gov /points lookups: location -> forecast grid cell (changes very rarely)
+CREATE TABLE IF NOT EXISTS nws_gridpoints (
+  lat DOUBLE PRECISION NOT NULL,
+  lon DOUBLE PRECISION NOT NULL,
+  grid_id TEXT NOT NULL,             -- forecast office, e.g. 'OKX'
+  grid_x INT NOT NULL,
+  grid_y INT NOT NULL,
+  resolved_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (lat, lon)
+);
+
+-- Daily budget consumption for metered providers (quota units per UTC day)
+CREATE TABLE IF NOT EXISTS provider_usage (
+  source TEXT NOT NULL,
+  day DATE NOT NULL,
+  units INT NOT NULL DEFAULT 0,
+  exhausted BOOLEAN NOT NULL DEFAULT FALSE,  -- provider answered 429 today
+  PRIMARY KEY (source, day)
+);
+-- Index into the location list where the next quota-limited run starts (src/etl/quota.py)
+ALTER TABLE provider_usage ADD COLUMN IF NOT EXISTS rotation_cursor INT NOT NULL DEFAULT 0;
+
+-- High-water marks for incremental jobs, e.g. last observations.created_at verified by compute_errors
+CREATE TABLE IF NOT EXISTS etl_watermarks (
+  name TEXT PRIMARY KEY,
+  value TIMESTAMPTZ NOT NULL,
+  updated_at TIMESTAMPTZ DEFAULT now()
+);
+
 -- Lightweight model registry pointer (canonical is DagsHub/MLflow)
 CREATE TABLE IF NOT EXISTS models (
   id BIGSERIAL PRIMARY KEY,
@@ -49,3 +325,11 @@ CREATE TABLE IF NOT EXISTS models (
   created_at TIMESTAMPTZ DEFAULT now(),
   is_champion BOOLEAN DEFAULT FALSE
 );
+-- Per (variable, horizon) lineage for warm-started retraining
+ALTER TABLE models ADD COLUMN IF NOT EXISTS variable TEXT;
+ALTER TABLE models ADD COLUMN IF NOT EXISTS horizon_hours INT;
+ALTER TABLE models ADD COLUMN IF NOT EXISTS algo TEXT;
+ALTER TABLE models ADD COLUMN IF NOT EXISTS trained_until TIMESTAMPTZ;   -- feature_store.labelled_at watermark the model has seen
+ALTER TABLE models ADD COLUMN IF NOT EXISTS full_retrain_at TIMESTAMPTZ; -- last from-scratch fit in its lineage
+ALTER TABLE models ADD COLUMN IF NOT EXISTS backtest_rmse DOUBLE PRECISION;
+CREATE INDEX IF NOT EXISTS models_variable_horizon ON models (variable, horizon_hours, id DESC);
@@ -0,0 +1,56 @@
+"""
+Columnar provider adapter layer.
+A provider only declares how to pull its time axis and variable arrays out of the JSON payload
+(returning {variable: VariableSeries}); forecast_frame() assembles the long-format `forecasts`
+frame column-wise, without building one Python object per (valid_time, variable).
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Mapping, Optional
+import numpy as np
+import pandas as pd
+from src.utils.time_utils import floor_hour, to_utc_index, horizon_hours_array
+from src.utils.unit_utils import normalize_array
+
+FORECAST_COLUMNS = ["source", "lat", "lon", "variable", "issue_time", "valid_time", "horizon_hours", "value", "unit"]
+
+@dataclass(frozen=True)
+class VariableSeries:
+    times: pd.DatetimeIndex
+    values: np.ndarray  # canonical (SI) units
+    unit: str
+
+def variable_series(variable: str, times, values, src_unit: Optional[str]) -> VariableSeries:
+    """Normalize one provider column (time axis + raw values in src_unit) to a VariableSeries."""
+    times = times if isinstance(times, pd.DatetimeIndex) else to_utc_index(times)
+    vals, unit = normalize_array(variable, values, src_unit)
+    return VariableSeries(times, vals, unit)
+
+def forecast_frame(source: str, lat: float, lon: float, issue: datetime,
+                   series: Mapping[str, VariableSeries]) -> pd.DataFrame:
+    """
+    Assemble the long-format forecasts frame for one location; rows with a NaN value or time are dropped.
+    issue is floored to the hour so a re-run within the same hour upserts onto the same natural key.
+    """
+    issue = floor_hour(issue)
+    series = {var: s for var, s in series.items() if len(s.values)}
+    if not series:
+        return pd.DataFrame(columns=FORECAST_COLUMNS)
+    lengths = [len(s.values) for s in series.values()]
+    first, *rest = series.values()
+    valid = first.times.append([s.times for s in rest]) if rest else first.times
+    values = np.concatenate([s.values for s in series.values()])
+    keep = ~np.isnan(values) & ~valid.isna()  # missing value or missing timestamp
+    valid = valid[keep]
+    df = pd.DataFrame({
+        "source": source,
+        "lat": lat,
+        "lon": lon,
+        "variable": np.repeat(list(series.keys()), lengths)[keep],
+        "issue_time": pd.Timestamp(issue),
+        "valid_time": valid,
+        "horizon_hours": horizon_hours_array(issue, valid),
+        "value": values[keep],
+        "unit": np.repeat([s.unit for s in series.values()], lengths)[keep],
+    })
+    return df[FORECAST_COLUMNS]
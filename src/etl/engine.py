@@ -0,0 +1,116 @@
+"""
+Concurrent forecast ingestion.
+Fans out (provider × location) fetches over one bounded worker pool per provider and
+streams parsed frames to the DB writer as they complete.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Callable
+import pandas as pd
+from src.config import CFG
+from src.utils.db_utils import upsert_dataframe
+from src.utils.dim_utils import attach_dimension_ids, resolve_location_ids
+from src.utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+FetchFn = Callable[[float, float, list[str]], pd.DataFrame]
+BatchFetchFn = Callable[[list[dict], list[str]], pd.DataFrame]
+
+# Flush buffered frames to the DB once this many rows are pending
+WRITE_BATCH_ROWS = 20_000
+
+@dataclass(frozen=True)
+class Provider:
+    name: str
+    fetch: FetchFn
+    # Providers that accept several locations per request fetch chunks of up to batch_size
+    fetch_batch: BatchFetchFn | None = None
+    batch_size: int = 1
+    # Optional per-run location filter, e.g. the daily quota scheduler for metered providers
+    select: Callable[[list[dict]], list[dict]] | None = None
+    # Optional grouping of the selected locations into fetch_batch tasks, replacing batch_size chunking
+    # (e.g. weather.gov groups by grid cell so cells are deduplicated across the whole run)
+    group: Callable[[list[dict]], list[list[dict]]] | None = None
+
+def provider_concurrency(name: str) -> int:
+    """Worker limit for a provider: PROVIDER_CONCURRENCY override, else REQUESTS_CONCURRENCY."""
+    return max(1, int(CFG.PROVIDER_CONCURRENCY.get(name, CFG.REQUESTS_CONCURRENCY)))
+
+def _label(locs: list[dict]) -> str:
+    names = [loc.get("name", f"{loc['lat']},{loc['lon']}") for loc in locs]
+    return names[0] if len(names) == 1 else f"{len(names)} locations ({names[0]}..{names[-1]})"
+
+def _batched(provider: Provider) -> bool:
+    return provider.fetch_batch is not None and (provider.group is not None or provider.batch_size > 1)
+
+def _tasks(provider: Provider, locations: list[dict]) -> list[list[dict]]:
+    if provider.fetch_batch is not None and provider.group is not None:
+        return provider.group(locations)
+    if not _batched(provider):
+        return [[loc] for loc in locations]
+    n = provider.batch_size
+    return [locations[i:i + n] for i in range(0, len(locations), n)]
+
+def _fetch(provider: Provider, locs: list[dict], variables: list[str]) -> pd.DataFrame:
+    logger.info("Fetching %s for %s", provider.name, _label(locs))
+    if _batched(provider):
+        return provider.fetch_batch(locs, variables)
+    return provider.fetch(locs[0]["lat"], locs[0]["lon"], variables)
+
+def _flush(frames: list[pd.DataFrame], table: str, location_ids: dict[tuple[float, float], int]) -> int:
+    if not frames:
+        return 0
+    df = pd.concat(frames, ignore_index=True)
+    try:
+        return upsert_dataframe(attach_dimension_ids(df, location_ids), table)
+    except Exception as e:
+        # one bad batch must not abort the providers still in flight
+        sources = sorted(df["source"].unique()) if "source" in df.columns else []
+        logger.warning("Writing %d rows (%s) to %s failed: %s; skipping batch", len(df), ", ".join(sources), table, e)
+        return 0
+
+def run_ingest(providers: list[Provider], locations: list[dict] | None = None,
+               variables: list[str] | None = None, table: str = "forecasts") -> int:
+    """Fetch every (provider, location or location chunk) concurrently and write frames as they finish."""
+    locations = CFG.TARGET_LOCATIONS if locations is None else locations
+    variables = CFG.VARIABLES if variables is None else variables
+    location_ids = resolve_location_ids(locations)
+    pools = {
+        p.name: ThreadPoolExecutor(max_workers=provider_concurrency(p.name), thread_name_prefix=f"ingest-{p.name}")
+        for p in providers
+    }
+    futures = {}
+    written = 0
+    try:
+        for p in providers:
+            try:
+                chosen = p.select(locations) if p.select is not None else locations
+                tasks = _tasks(p, chosen)
+            except Exception as e:
+                logger.warning("%s location selection failed: %s; skipping provider", p.name, e)
+                continue
+            for locs in tasks:
+                futures[pools[p.name].submit(_fetch, p, locs, variables)] = (p.name, locs)
+
+        pending, pending_rows = [], 0
+        for fut in as_completed(futures):
+            name, locs = futures[fut]
+            try:
+                df = fut.result()
+            except Exception as e:
+                logger.warning("%s fetch failed for %s: %s; skipping", name, _label(locs), e)
+                continue
+            if df is None or df.empty:
+                continue
+            pending.append(df)
+            pending_rows += len(df)
+            if pending_rows >= WRITE_BATCH_ROWS:
+                written += _flush(pending, table, location_ids)
+                pending, pending_rows = [], 0
+        written += _flush(pending, table, location_ids)
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True, cancel_futures=True)
+    logger.info("Ingested %d rows from %d provider(s) x %d location(s)", written, len(providers), len(locations))
+    return written
@@ -5,13 +5,32 @@ Docs: https://api.met.no/weatherapi/locationforecast/2.0/documentation
 import pandas as pd
 from src.config import CFG, MET_NO_URL
 from src.utils.http_utils import get_json
-from src.utils.time_utils import now_utc, to_utc, horizon_hours
-from src.utils.unit_utils import normalize_value
-from src.utils.db_utils import insert_dataframe
+from src.utils.time_utils import now_utc, to_utc_index
 from src.utils.logging_utils import get_logger
+from src.etl.adapters import VariableSeries, forecast_frame, variable_series
+from src.etl.engine import Provider, run_ingest
 
 logger = get_logger(__name__)
 
+# variable -> (data block, details field, unit)
+FIELDS = {
+    "temp_2m": ("instant", "air_temperature", "C"),
+    "wind_speed_10m": ("instant", "wind_speed", "m/s"),
+    "precipitation": ("next_1_hours", "precipitation_amount", "mm"),
+}
+
+def extract_met_no(data: dict, variables: list[str]) -> dict[str, VariableSeries]:
+    timeseries = data.get("properties", {}).get("timeseries", [])
+    times = to_utc_index([ts["time"] for ts in timeseries])
+    out = {}
+    for var in variables:
+        if var not in FIELDS:
+            continue
+        block, field, unit = FIELDS[var]
+        vals = [ts.get("data", {}).get(block, {}).get("details", {}).get(field) for ts in timeseries]
+        out[var] = variable_series(var, times, vals, unit)
+    return out
+
 def fetch_met_no(lat: float, lon: float, variables: list[str]) -> pd.DataFrame:
     headers = {
         "User-Agent": CFG.MET_NO_USER_AGENT,
@@ -22,43 +41,10 @@ def fetch_met_no(lat: float, lon: float, variables: list[str]) -> pd.DataFrame:
     except Exception as e:
         logger.warning("MET Norway fetch failed at %.3f,%.3f: %s; skipping", lat, lon, e)
         return pd.DataFrame()
-    issue = now_utc()
-    timeseries = data.get("properties", {}).get("timeseries", [])
-    rows = []
-    for ts in timeseries:
-        vt = to_utc(ts["time"])
-        d = ts.get("data", {})
-        inst = d.get("instant", {}).get("details", {})
-        next1 = d.get("next_1_hours", {})
-        precip = None
-        if next1:
-            p = next1.get("details", {}).get("precipitation_amount")
-            if p is not None:
-                precip = float(p)
-
-        for var in variables:
-            if var == "temp_2m" and "air_temperature" in inst:
-                v, u = normalize_value("temp_2m", float(inst["air_temperature"]), "C")
-            elif var == "wind_speed_10m" and "wind_speed" in inst:
-                v, u = normalize_value("wind_speed_10m", float(inst["wind_speed"]), "m/s")
-            elif var == "precipitation" and precip is not None:
-                v, u = normalize_value("precipitation", precip, "mm")
-            else:
-                continue
-            rows.append({
-                "source": "met_no",
-                "lat": lat, "lon": lon,
-                "variable": var, "issue_time": issue, "valid_time": vt,
-                "horizon_hours": horizon_hours(issue, vt), "value": v, "unit": u
-            })
-    return pd.DataFrame(rows)
+    return forecast_frame("met_no", lat, lon, now_utc(), extract_met_no(data, variables))
 
 def main():
-    frames = []
-    for loc in CFG.TARGET_LOCATIONS:
-        frames.append(fetch_met_no(loc["lat"], loc["lon"], CFG.VARIABLES))
-    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
-    insert_dataframe(df, "forecasts")
+    run_ingest([Provider("met_no", fetch_met_no)])
 
 if __name__ == "__main__":
     main()
@@ -1,28 +1,70 @@
 """
 Meteostat hourly observations via Point(lat, lon) for each configured location.
+Incremental: only timestamps newer than the latest stored obs_time per (location, variable) are fetched and inserted.
 Docs: https://pypi.org/project/meteostat/
 """
 
 import pandas as pd
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timedelta
 from meteostat import Point, Hourly
 
-from src.config import CFG
-from src.utils.db_utils import insert_dataframe
+from src.config import CFG, SOURCE_IDS
+from src.utils.db_utils import fetch_df, upsert_dataframe
+from src.utils.dim_utils import attach_dimension_ids, resolve_location_ids
 from src.utils.logging_utils import get_logger
-from src.utils.unit_utils import normalize_value
+from src.utils.unit_utils import normalize_array
 
 logger = get_logger(__name__)
 
+# Meteostat hourly column -> (variable, unit); wind speed is reported in km/h
+COLUMNS = {
+    "temp": ("temp_2m", "C"),
+    "wspd": ("wind_speed_10m", "km/h"),
+    "prcp": ("precipitation", "mm"),
+}
+
+Watermarks = dict[tuple[float, float, str], pd.Timestamp]
+
+def get_watermarks() -> Watermarks:
+    """Latest stored obs_time per (lat, lon, variable) for Meteostat rows."""
+    sql = """
+    SELECT l.lat, l.lon, v.name AS variable, o.last_obs
+    FROM (
+      SELECT location_id, variable_id, max(obs_time) AS last_obs
+      FROM observations
+      WHERE source_id = :source_id
+      GROUP BY location_id, variable_id
+    ) o
+    JOIN locations l ON l.id = o.location_id
+    JOIN variables v ON v.id = o.variable_id
+    """
+    df = fetch_df(sql, {"source_id": SOURCE_IDS["meteostat"]})
+    if df.empty:
+        return {}
+    last = pd.to_datetime(df["last_obs"], utc=True)
+    return {(float(la), float(lo), v): t for la, lo, v, t in zip(df["lat"], df["lon"], df["variable"], last)}
 
-def fetch_obs(lat: float, lon: float) -> pd.DataFrame:
+def fetch_obs(lat: float, lon: float, watermarks: Watermarks | None = None) -> pd.DataFrame:
     """
-    Fetch the last 7 days of hourly observations near the given lat/lon.
+    Fetch hourly observations near lat/lon newer than each variable's watermark.
+    Without a watermark the last OBS_BACKFILL_DAYS are fetched; gaps are capped at OBS_MAX_BACKFILL_DAYS.
     Meteostat expects naive datetimes for start/end. We'll convert to UTC after fetch.
     """
+    watermarks = watermarks or {}
+    variables = [var for var, _ in COLUMNS.values() if var in CFG.VARIABLES]
+    marks = {var: watermarks.get((float(lat), float(lon), var)) for var in variables}
+
     # Use naive datetimes (no tzinfo) as required by meteostat
     end = datetime.utcnow().replace(minute=0, second=0, microsecond=0)   # naive
-    start = end - timedelta(days=7)                                      # naive
+    floor = end - timedelta(days=CFG.OBS_MAX_BACKFILL_DAYS)
+    starts = [
+        (m.tz_convert("UTC").tz_localize(None).to_pydatetime() + timedelta(hours=1)) if m is not None
+        else end - timedelta(days=CFG.OBS_BACKFILL_DAYS)
+        for m in marks.values()
+    ]
+    start = max(min(starts), floor) if starts else end
+    if start > end:
+        return pd.DataFrame()
 
     p = Point(lat, lon)
 
@@ -34,68 +76,45 @@ def fetch_obs(lat: float, lon: float) -> pd.DataFrame:
         return pd.DataFrame()
 
     if df is None or df.empty:
-        logger.info("No hourly observations returned near %.3f,%.3f in the last 7 days", lat, lon)
+        logger.info("No hourly observations returned near %.3f,%.3f since %s", lat, lon, start)
         return pd.DataFrame()
 
-    rows = []
-    # Standardize timestamps to UTC-aware datetimes for DB consistency
-    # If the index is naive, we set tzinfo=UTC; if tz-aware, convert to UTC.
-    for ts, row in df.iterrows():
-        # ts may be a pandas Timestamp; handle both naive and tz-aware
-        ts_py = ts.to_pydatetime()
-        if ts_py.tzinfo is None:
-            obs_time = ts_py.replace(tzinfo=timezone.utc)
-        else:
-            obs_time = ts_py.astimezone(timezone.utc)
-
-        # Temperature (°C) → temp_2m
-        if "temp_2m" in CFG.VARIABLES and "temp" in row and pd.notna(row["temp"]):
-            v, u = normalize_value("temp_2m", float(row["temp"]), "C")
-            rows.append({
-                "station_id": None,  # unknown/nearest selected by Meteostat Point
-                "lat": lat, "lon": lon,
-                "variable": "temp_2m",
-                "obs_time": obs_time,
-                "value": v, "unit": u,
-                "source": "meteostat",
-            })
-
-        # Wind speed (typically km/h from Meteostat) → wind_speed_10m (normalized to m/s)
-        if "wind_speed_10m" in CFG.VARIABLES and "wspd" in row and pd.notna(row["wspd"]):
-            v, u = normalize_value("wind_speed_10m", float(row["wspd"]), "km/h")
-            rows.append({
-                "station_id": None,
-                "lat": lat, "lon": lon,
-                "variable": "wind_speed_10m",
-                "obs_time": obs_time,
-                "value": v, "unit": u,
-                "source": "meteostat",
-            })
-
-        # Precipitation (mm) → precipitation
-        if "precipitation" in CFG.VARIABLES and "prcp" in row and pd.notna(row["prcp"]):
-            v, u = normalize_value("precipitation", float(row["prcp"] or 0.0), "mm")
-            rows.append({
-                "station_id": None,
-                "lat": lat, "lon": lon,
-                "variable": "precipitation",
-                "obs_time": obs_time,
-                "value": v, "unit": u,
-                "source": "meteostat",
-            })
-
-    return pd.DataFrame(rows)
+    # Standardize timestamps to UTC-aware for DB consistency (naive index is taken as UTC)
+    idx = pd.DatetimeIndex(df.index)
+    obs_time = idx.tz_localize("UTC") if idx.tz is None else idx.tz_convert("UTC")
+
+    frames = []
+    for col, (var, unit) in COLUMNS.items():
+        if var not in variables or col not in df.columns:
+            continue
+        values, u = normalize_array(var, df[col].to_numpy(), unit)
+        keep = ~pd.isna(values)
+        if marks[var] is not None:
+            keep &= obs_time > marks[var]
+        if not keep.any():
+            continue
+        frames.append(pd.DataFrame({
+            "station_id": None,  # unknown/nearest selected by Meteostat Point
+            "lat": lat, "lon": lon,
+            "variable": var,
+            "obs_time": obs_time[keep],
+            "value": values[keep], "unit": u,
+            "source": "meteostat",
+        }))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
 
 
 def main():
+    watermarks = get_watermarks()
     frames = []
     for loc in CFG.TARGET_LOCATIONS:
         logger.info("Meteostat observations: %s", loc["name"])
-        frames.append(fetch_obs(loc["lat"], loc["lon"]))
+        frames.append(fetch_obs(loc["lat"], loc["lon"], watermarks))
 
     df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
-    inserted = insert_dataframe(df, "observations")
-    logger.info("Inserted %d observation rows", inserted)
+    df = attach_dimension_ids(df, resolve_location_ids(CFG.TARGET_LOCATIONS))
+    upserted = upsert_dataframe(df, "observations")
+    logger.info("Upserted %d observation rows", upserted)
 
 
 if __name__ == "__main__":
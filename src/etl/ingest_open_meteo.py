@@ -3,66 +3,69 @@ Open-Meteo hourly forecasts (no key). Variables: temperature_2m (C), wind_speed_
 Docs: https://open-meteo.com/
 """
 import pandas as pd
-from datetime import datetime
 from src.config import CFG, OPEN_METEO_URL
 from src.utils.http_utils import get_json
-from src.utils.time_utils import now_utc, to_utc, horizon_hours
-from src.utils.unit_utils import normalize_value
-from src.utils.db_utils import insert_dataframe
+from src.utils.time_utils import now_utc, to_utc_index
 from src.utils.logging_utils import get_logger
+from src.etl.adapters import VariableSeries, forecast_frame, variable_series
+from src.etl.engine import Provider, run_ingest
 
 logger = get_logger(__name__)
 
-def fetch_open_meteo(lat: float, lon: float, variables: list[str]) -> pd.DataFrame:
-    params = {
+# variable -> (Open-Meteo hourly field, unit as requested below)
+FIELDS = {
+    "temp_2m": ("temperature_2m", "C"),
+    "wind_speed_10m": ("wind_speed_10m", "m/s"),
+    "precipitation": ("precipitation", "mm"),
+}
+
+def extract_open_meteo(data: dict, variables: list[str]) -> dict[str, VariableSeries]:
+    hourly = data.get("hourly", {})
+    times = to_utc_index(hourly.get("time", []))
+    out = {}
+    for var in variables:
+        field, unit = FIELDS.get(var, (None, None))
+        if field in hourly:
+            out[var] = variable_series(var, times, hourly[field], unit)
+    return out
+
+def _params(lat: str, lon: str, variables: list[str]) -> dict:
+    return {
         "latitude": lat,
         "longitude": lon,
-        "hourly": ",".join([
-            "temperature_2m" if "temp_2m" in variables else "",
-            "wind_speed_10m" if "wind_speed_10m" in variables else "",
-            "precipitation" if "precipitation" in variables else "",
-        ]).strip(","),
+        "hourly": ",".join(FIELDS[v][0] for v in variables if v in FIELDS),
         "windspeed_unit": "ms",
         "precipitation_unit": "mm",
         "timezone": "UTC",
     }
-    data = get_json(OPEN_METEO_URL, params=params)
+
+def fetch_open_meteo(lat: float, lon: float, variables: list[str]) -> pd.DataFrame:
+    data = get_json(OPEN_METEO_URL, params=_params(lat, lon, variables))
+    return forecast_frame("open_meteo", lat, lon, now_utc(), extract_open_meteo(data, variables))
+
+def fetch_open_meteo_batch(locations: list[dict], variables: list[str]) -> pd.DataFrame:
+    """
+    One request for several locations via comma-separated latitude/longitude lists.
+    Open-Meteo answers with a list of results in request order (a single object for one location).
+    """
+    lats = ",".join(str(loc["lat"]) for loc in locations)
+    lons = ",".join(str(loc["lon"]) for loc in locations)
+    data = get_json(OPEN_METEO_URL, params=_params(lats, lons, variables))
+    results = data if isinstance(data, list) else [data]
+    if len(results) != len(locations):
+        raise RuntimeError(f"Open-Meteo returned {len(results)} results for {len(locations)} locations")
     issue = now_utc()
-    hourly = data.get("hourly", {})
-    times = [to_utc(t) for t in hourly.get("time", [])]
-    rows = []
+    # Keep our configured coordinates; the response echoes grid-snapped ones
+    frames = [
+        forecast_frame("open_meteo", loc["lat"], loc["lon"], issue, extract_open_meteo(res, variables))
+        for loc, res in zip(locations, results)
+    ]
+    return pd.concat(frames, ignore_index=True)
 
-    for i, vt in enumerate(times):
-        for var in variables:
-            if var == "temp_2m" and "temperature_2m" in hourly:
-                value = hourly["temperature_2m"][i]
-                v, u = normalize_value("temp_2m", float(value), "C")
-            elif var == "wind_speed_10m" and "wind_speed_10m" in hourly:
-                value = hourly["wind_speed_10m"][i]
-                v, u = normalize_value("wind_speed_10m", float(value), "m/s")
-            elif var == "precipitation" and "precipitation" in hourly:
-                value = hourly["precipitation"][i]
-                v, u = normalize_value("precipitation", float(value), "mm")
-            else:
-                continue
-            rows.append({
-                "source": "open_meteo",
-                "lat": lat, "lon": lon,
-                "variable": var,
-                "issue_time": issue,
-                "valid_time": vt,
-                "horizon_hours": horizon_hours(issue, vt),
-                "value": v, "unit": u,
-            })
-    return pd.DataFrame(rows)
+PROVIDER = Provider("open_meteo", fetch_open_meteo, fetch_batch=fetch_open_meteo_batch, batch_size=CFG.OPEN_METEO_BATCH_SIZE)
 
 def main():
-    frames = []
-    for loc in CFG.TARGET_LOCATIONS:
-        logger.info("Fetching Open-Meteo for %s", loc["name"])
-        frames.append(fetch_open_meteo(loc["lat"], loc["lon"], CFG.VARIABLES))
-    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
-    insert_dataframe(df, "forecasts")
+    run_ingest([PROVIDER])
 
 if __name__ == "__main__":
     main()
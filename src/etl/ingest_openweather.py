@@ -2,16 +2,35 @@
 OpenWeather One Call 3.0 (first 1,000 calls/day free).
 Docs: https://openweathermap.org/price
 """
+from functools import partial
+import numpy as np
 import pandas as pd
 from src.config import CFG, OPENWEATHER_URL
-from src.utils.http_utils import get_json
-from src.utils.time_utils import now_utc, to_utc, horizon_hours
-from src.utils.unit_utils import normalize_value
-from src.utils.db_utils import insert_dataframe
+from src.utils.http_utils import RateLimited, fetch_json
+from src.utils.time_utils import now_utc, to_utc_index
 from src.utils.logging_utils import get_logger
+from src.etl.adapters import VariableSeries, forecast_frame, variable_series
+from src.etl.engine import Provider, run_ingest
+from src.etl.quota import is_exhausted, mark_exhausted, plan_locations, record_usage
 
 logger = get_logger(__name__)
 
+def _accum_1h(hours: list[dict], kind: str) -> np.ndarray:
+    return np.array([h[kind].get("1h", 0.0) if isinstance(h.get(kind), dict) else 0.0 for h in hours], dtype="float64")
+
+def extract_openweather(data: dict, variables: list[str]) -> dict[str, VariableSeries]:
+    hours = data.get("hourly", [])
+    times = to_utc_index([h.get("dt") for h in hours])
+    out = {}
+    if "temp_2m" in variables:
+        out["temp_2m"] = variable_series("temp_2m", times, [h.get("temp") for h in hours], "C")
+    if "wind_speed_10m" in variables:
+        out["wind_speed_10m"] = variable_series("wind_speed_10m", times, [h.get("wind_speed") for h in hours], "m/s")
+    if "precipitation" in variables:
+        # rain + snow liquid equivalent; absent blocks mean no precipitation
+        out["precipitation"] = variable_series("precipitation", times, _accum_1h(hours, "rain") + _accum_1h(hours, "snow"), "mm")
+    return out
+
 def fetch_openweather(lat: float, lon: float, variables: list[str]) -> pd.DataFrame:
     if not CFG.OPENWEATHER_API_KEY:
         logger.warning("OPENWEATHER_API_KEY missing; skipping")
@@ -22,40 +41,22 @@ def fetch_openweather(lat: float, lon: float, variables: list[str]) -> pd.DataFr
         "units": "metric",
         "exclude": "minutely,daily,alerts,current",
     }
-    data = get_json(OPENWEATHER_URL, params=params)
-    issue = now_utc()
-    rows = []
-    for h in data.get("hourly", []):
-        vt = to_utc(h.get("dt"))
-        for var in variables:
-            if var == "temp_2m" and "temp" in h:
-                v, u = normalize_value("temp_2m", float(h["temp"]), "C")
-            elif var == "wind_speed_10m" and "wind_speed" in h:
-                v, u = normalize_value("wind_speed_10m", float(h["wind_speed"]), "m/s")
-            elif var == "precipitation":
-                precip = 0.0
-                if isinstance(h.get("rain"), dict) and "1h" in h["rain"]:
-                    precip += float(h["rain"]["1h"])
-                if isinstance(h.get("snow"), dict) and "1h" in h["snow"]:
-                    precip += float(h["snow"]["1h"])
-                v, u = normalize_value("precipitation", precip, "mm")
-            else:
-                continue
-            rows.append({
-                "source": "openweather",
-                "lat": lat, "lon": lon, "variable": var,
-                "issue_time": issue, "valid_time": vt,
-                "horizon_hours": horizon_hours(issue, vt),
-                "value": v, "unit": u,
-            })
-    return pd.DataFrame(rows)
+    if is_exhausted("openweather"):
+        return pd.DataFrame()
+    try:
+        data, cached = fetch_json(OPENWEATHER_URL, params=params, retry_429=False)
+    except RateLimited:
+        mark_exhausted("openweather")
+        return pd.DataFrame()
+    if not cached:
+        record_usage("openweather")
+    return forecast_frame("openweather", lat, lon, now_utc(), extract_openweather(data, variables))
+
+# Metered: locations per run are chosen by the daily quota scheduler
+PROVIDER = Provider("openweather", fetch_openweather, select=partial(plan_locations, "openweather"))
 
 def main():
-    frames = []
-    for loc in CFG.TARGET_LOCATIONS:
-        frames.append(fetch_openweather(loc["lat"], loc["lon"], CFG.VARIABLES))
-    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
-    insert_dataframe(df, "forecasts")
+    run_ingest([PROVIDER])
 
 if __name__ == "__main__":
     main()
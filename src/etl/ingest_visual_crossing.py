@@ -2,62 +2,70 @@
 Visual Crossing Timeline API (free daily records cap).
 Doc: https://www.visualcrossing.com/resources/blog/how-do-i-get-free-weather-api-access/
 """
+from functools import partial
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
 from src.config import CFG, VISUAL_CROSSING_URL
-from src.utils.http_utils import get_json
-from src.utils.time_utils import now_utc, to_utc, horizon_hours
-from src.utils.unit_utils import normalize_value
-from src.utils.db_utils import insert_dataframe
+from src.utils.http_utils import RateLimited, fetch_json
+from src.utils.time_utils import now_utc, to_utc_index
 from src.utils.logging_utils import get_logger
+from src.etl.adapters import VariableSeries, forecast_frame, variable_series
+from src.etl.engine import Provider, run_ingest
+from src.etl.quota import is_exhausted, mark_exhausted, plan_locations, record_usage
 
 logger = get_logger(__name__)
 
+# variable -> (hour field, unit under unitGroup=metric)
+FIELDS = {
+    "temp_2m": ("temp", "C"),
+    "wind_speed_10m": ("wspd", "km/h"),
+    "precipitation": ("precip", "mm"),
+}
+
+def extract_visual_crossing(data: dict, variables: list[str]) -> dict[str, VariableSeries]:
+    hours = [hr for day in data.get("days", []) for hr in day.get("hours", [])]
+    # datetimeEpoch is UTC epoch seconds, independent of the location's local 'datetime'
+    times = to_utc_index([hr.get("datetimeEpoch") for hr in hours])
+    out = {}
+    for var in variables:
+        if var not in FIELDS:
+            continue
+        field, unit = FIELDS[var]
+        vals = [hr.get(field) for hr in hours]
+        if var == "precipitation":
+            vals = np.nan_to_num(np.asarray(vals, dtype="float64"), nan=0.0)
+        out[var] = variable_series(var, times, vals, unit)
+    return out
+
 def fetch_visual_crossing(lat: float, lon: float, variables: list[str]) -> pd.DataFrame:
     if not CFG.VISUAL_CROSSING_API_KEY:
         logger.warning("VISUAL_CROSSING_API_KEY missing; skipping")
         return pd.DataFrame()
     loc_str = f"{lat},{lon}"
-    # Next 5 days hourly to respect free limits
     url = f"{VISUAL_CROSSING_URL}/{loc_str}"
     params = {
         "unitGroup": "metric",  # temp C, wind km/h, precip mm
         "include": "hours",
         "contentType": "json",
         "key": CFG.VISUAL_CROSSING_API_KEY,
-        "elements": "datetime,temp,wspd,precip",
+        "elements": "datetime,datetimeEpoch,temp,wspd,precip",
     }
-    data = get_json(url, params=params)
-    issue = now_utc()
-    rows = []
-    for day in data.get("days", []):
-        for hr in day.get("hours", []):
-            # VC returns local time; specify timezone offset available in 'tzoffset'? Use ISO form if present.
-            vt = to_utc(hr.get("datetimeEpoch"))
-            for var in variables:
-                if var == "temp_2m" and "temp" in hr:
-                    v, u = normalize_value("temp_2m", float(hr["temp"]), "C")
-                elif var == "wind_speed_10m" and "wspd" in hr:
-                    v, u = normalize_value("wind_speed_10m", float(hr["wspd"]), "km/h")
-                elif var == "precipitation" and "precip" in hr:
-                    v, u = normalize_value("precipitation", float(hr["precip"] or 0.0), "mm")
-                else:
-                    continue
-                rows.append({
-                    "source": "visual_crossing",
-                                       "lat": lat, "lon": lon, "variable": var,
-                    "issue_time": issue, "valid_time": vt,
-                    "horizon_hours": horizon_hours(issue, vt),
-                    "value": v, "unit": u,
-                })
-    return pd.DataFrame(rows)
+    if is_exhausted("visual_crossing"):
+        return pd.DataFrame()
+    try:
+        data, cached = fetch_json(url, params=params, retry_429=False)
+    except RateLimited:
+        mark_exhausted("visual_crossing")
+        return pd.DataFrame()
+    if not cached:
+        record_usage("visual_crossing")
+    return forecast_frame("visual_crossing", lat, lon, now_utc(), extract_visual_crossing(data, variables))
+
+# Metered: locations per run are chosen by the daily quota scheduler
+PROVIDER = Provider("visual_crossing", fetch_visual_crossing, select=partial(plan_locations, "visual_crossing"))
 
 def main():
-    frames = []
-    for loc in CFG.TARGET_LOCATIONS:
-        frames.append(fetch_visual_crossing(loc["lat"], loc["lon"], CFG.VARIABLES))
-    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
-    insert_dataframe(df, "forecasts")
+    run_ingest([PROVIDER])
 
 if __name__ == "__main__":
     main()
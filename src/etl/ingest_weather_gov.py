@@ -3,99 +3,185 @@ US NWS weather.gov gridpoints (only for US locations).
 Docs: https://www.weather.gov/documentation/services-web-api
 Gridpoints: https://github.com/weather-gov/api/blob/master/gridpoints.md
 """
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
+import requests
+from sqlalchemy import text
 from src.config import CFG, WEATHER_GOV_POINTS_URL, WEATHER_GOV_GRID_URL
+from src.utils.db_utils import db_conn, fetch_df
 from src.utils.http_utils import get_json
-from src.utils.time_utils import now_utc, to_utc, horizon_hours
-from src.utils.unit_utils import normalize_value
-from src.utils.db_utils import insert_dataframe
+from src.utils.time_utils import now_utc, to_utc_index
 from src.utils.logging_utils import get_logger
+from src.etl.adapters import VariableSeries, forecast_frame, variable_series
+from src.etl.engine import Provider, provider_concurrency, run_ingest
 
 logger = get_logger(__name__)
 
+# variable -> (gridpoint layer, unit assumed when the layer has no recognised uom)
+FIELDS = {
+    "temp_2m": ("temperature", "C"),
+    "wind_speed_10m": ("windSpeed", "km/h"),
+    "precipitation": ("quantitativePrecipitation", "mm"),
+}
+WMO_UNITS = {"wmoUnit:degC": "C", "wmoUnit:km_h-1": "km/h", "wmoUnit:m_s-1": "m/s", "wmoUnit:mm": "mm"}
+_DURATION = re.compile(r"^P(?:(\d+)D)?(?:T(?:(\d+)H)?)?")
+
 def is_us(lat: float, lon: float) -> bool:
     # Rough bounding box for continental US
     return 18 <= lat <= 72 and -170 <= lon <= -50
 
-def fetch_weather_gov(lat: float, lon: float, variables: list[str]) -> pd.DataFrame:
-    if not is_us(lat, lon):
-        return pd.DataFrame()
-    headers = {"User-Agent": CFG.NWS_USER_AGENT, "Accept": "application/geo+json"}
-    meta = get_json(WEATHER_GOV_POINTS_URL.format(lat=lat, lon=lon), headers=headers)
+def _duration_hours(dur: str) -> int:
+    """ISO-8601 period like 'PT6H' or 'P1DT12H' -> whole hours (minimum 1)."""
+    m = _DURATION.match(dur)
+    if not m:
+        return 1
+    return max(int(m.group(1) or 0) * 24 + int(m.group(2) or 0), 1)
+
+def extract_weather_gov(grid: dict, variables: list[str]) -> dict[str, VariableSeries]:
+    props = grid.get("properties", {})
+    out = {}
+    for var in variables:
+        if var not in FIELDS:
+            continue
+        layer, default_unit = FIELDS[var]
+        f = props.get(layer, {})
+        vals = f.get("values", []) or []
+        unit = WMO_UNITS.get(f.get("uom", ""), default_unit)
+        # "validTime" like "2025-12-13T18:00:00+00:00/PT1H" -> (start, duration)
+        starts = to_utc_index([v["validTime"].split("/")[0] for v in vals])
+        values = np.array([v["value"] for v in vals], dtype="float64")
+        if var == "precipitation":
+            # QPF covers multi-hour periods: apportion evenly onto the hourly grid
+            hours = np.array([_duration_hours(v["validTime"].split("/")[1]) for v in vals], dtype="int64")
+            values = np.repeat(np.nan_to_num(values, nan=0.0) / np.maximum(hours, 1), hours)
+            offsets = np.concatenate([np.arange(h) for h in hours]) if len(hours) else np.array([], dtype="int64")
+            starts = starts.repeat(hours) + pd.to_timedelta(offsets, unit="h")
+        out[var] = variable_series(var, starts, values, unit)
+    return out
+
+GridCell = tuple[str, int, int]  # (gridId, gridX, gridY)
+
+def _headers() -> dict:
+    return {"User-Agent": CFG.NWS_USER_AGENT, "Accept": "application/geo+json"}
+
+def load_gridpoints(locations: list[dict]) -> dict[tuple[float, float], GridCell]:
+    """Cached (lat, lon) -> grid cell mappings younger than NWS_GRIDPOINT_TTL_DAYS."""
+    sql = """
+    SELECT lat, lon, grid_id, grid_x, grid_y
+    FROM nws_gridpoints
+    WHERE resolved_at >= now() - (interval '1 day' * :ttl)
+    """
+    df = fetch_df(sql, {"ttl": int(CFG.NWS_GRIDPOINT_TTL_DAYS)})
+    wanted = {(float(loc["lat"]), float(loc["lon"])) for loc in locations}
+    return {
+        (r.lat, r.lon): (r.grid_id, int(r.grid_x), int(r.grid_y))
+        for r in df.itertuples(index=False) if (r.lat, r.lon) in wanted
+    }
+
+def resolve_gridpoint(lat: float, lon: float) -> GridCell | None:
+    """Look up the grid cell via /points and persist it."""
+    meta = get_json(WEATHER_GOV_POINTS_URL.format(lat=lat, lon=lon), headers=_headers())
     props = meta.get("properties", {})
     office = props.get("gridId")
-    gridX = props.get("gridX")
-    gridY = props.get("gridY")
     if not office:
-        return pd.DataFrame()
-    grid = get_json(WEATHER_GOV_GRID_URL.format(office=office, gridX=gridX, gridY=gridY), headers=headers, params={"units":"si"})
+        return None
+    cell = (office, int(props.get("gridX")), int(props.get("gridY")))
+    with db_conn() as conn:
+        conn.execute(text("""
+            INSERT INTO nws_gridpoints (lat, lon, grid_id, grid_x, grid_y, resolved_at)
+            VALUES (:lat, :lon, :g, :x, :y, now())
+            ON CONFLICT (lat, lon) DO UPDATE
+            SET grid_id=EXCLUDED.grid_id, grid_x=EXCLUDED.grid_x, grid_y=EXCLUDED.grid_y, resolved_at=now()
+        """), {"lat": lat, "lon": lon, "g": cell[0], "x": cell[1], "y": cell[2]})
+    return cell
+
+def invalidate_gridpoints(locations: list[dict] | None = None) -> None:
+    """Drop cached mappings for the given locations (all when None) so the next run re-resolves them."""
+    with db_conn() as conn:
+        if locations is None:
+            conn.execute(text("DELETE FROM nws_gridpoints"))
+            return
+        for loc in locations:
+            conn.execute(text("DELETE FROM nws_gridpoints WHERE lat=:lat AND lon=:lon"),
+                         {"lat": float(loc["lat"]), "lon": float(loc["lon"])})
+
+def _moved(cell: GridCell, grid: dict) -> bool:
+    """True when the gridpoint response (e.g. after a redirect) belongs to a different cell than requested."""
+    props = grid.get("properties", {})
+    if not props.get("gridId"):
+        return False
+    return (props["gridId"], int(props.get("gridX", -1)), int(props.get("gridY", -1))) != cell
+
+def _fetch_cell(cell: GridCell, locs: list[dict], variables: list[str]) -> pd.DataFrame:
+    office, gridX, gridY = cell
+    try:
+        grid = get_json(WEATHER_GOV_GRID_URL.format(office=office, gridX=gridX, gridY=gridY), headers=_headers(), params={"units":"si"})
+    except requests.HTTPError as e:
+        # 404: the office/grid mapping is gone; re-resolve on the next run. Timeouts and 5xx keep the mapping.
+        if e.response is not None and e.response.status_code == 404:
+            invalidate_gridpoints(locs)
+        raise
+    if _moved(cell, grid):
+        invalidate_gridpoints(locs)
+    # Parse once, emit a frame per location sharing this cell
+    series = extract_weather_gov(grid, variables)
     issue = now_utc()
-    rows = []
+    return pd.concat([forecast_frame("weather_gov", loc["lat"], loc["lon"], issue, series) for loc in locs], ignore_index=True)
 
-    def extract_series(field: str):
-        f = grid.get("properties", {}).get(field, {})
-        vals = f.get("values", []) or []
-        unit = f.get("uom", "")
-        return vals, unit
-
-    temp_vals, _ = extract_series("temperature")
-    wind_vals, _ = extract_series("windSpeed")
-    qpf_vals, _ = extract_series("quantitativePrecipitation")  # mm over period if SI
-
-    # Convert NWS "validTime" like "2025-12-13T18:00:00+00:00/PT1H" to (start, duration)
-    def parse_valid(vt: str):
-        t, dur = vt.split("/")
-        return to_utc(t), dur
-
-    # Build dict by start time to approximate hourly grid
-    tmap = {}
-    for v in temp_vals:
-        t, _ = parse_valid(v["validTime"])
-        tmap.setdefault(t, {})["temp_2m"] = float(v["value"]) if v["value"] is not None else None
-    for v in wind_vals:
-        t, _ = parse_valid(v["validTime"])
-        tmap.setdefault(t, {})["wind_speed_10m"] = float(v["value"]) if v["value"] is not None else None
-    for v in qpf_vals:
-        t, dur = parse_valid(v["validTime"])
-        val = float(v["value"]) if v["value"] is not None else 0.0
-        # If duration is PT1H, take directly; if longer (e.g., PT6H), apportion evenly per hour
-        hours = 1
-        if dur.startswith("PT") and dur.endswith("H"):
-            hours = int(dur[2:-1])
-        per_hour = val / hours if hours > 0 else val
-        for h in range(hours):
-            tt = to_utc(t)  # assuming continuous blocks
-            tmap.setdefault(tt, {})["precipitation"] = per_hour
-
-    for vt, vals in tmap.items():
-        for var in variables:
-            if var not in vals or vals[var] is None:
+def _cells(locations: list[dict]) -> dict[GridCell, list[dict]]:
+    """Group US locations by grid cell, resolving (and persisting) mappings that are missing or expired."""
+    us = [loc for loc in locations if is_us(loc["lat"], loc["lon"])]
+    if not us:
+        return {}
+    known = load_gridpoints(us)
+    cells: dict[GridCell, list[dict]] = {}
+    for loc in us:
+        key = (float(loc["lat"]), float(loc["lon"]))
+        cell = known.get(key)
+        if cell is None:
+            try:
+                cell = resolve_gridpoint(*key)
+            except Exception as e:
+                logger.warning("weather.gov points lookup failed at %.3f,%.3f: %s; skipping", key[0], key[1], e)
                 continue
-            if var == "temp_2m":
-                v, u = normalize_value("temp_2m", vals[var], "C")
-            elif var == "wind_speed_10m":
-                # NWS SI often returns km/h; normalize from km/h -> m/s if needed. Here assume m/s (conservative)
-                try:
-                    v, u = normalize_value("wind_speed_10m", vals[var], "m/s")
-                except Exception:
-                    v, u = normalize_value("wind_speed_10m", vals[var], "km/h")
-            else:
-                v, u = normalize_value("precipitation", vals[var], "mm")
-            rows.append({
-                "source": "weather_gov",
-                "lat": lat, "lon": lon, "variable": var,
-                "issue_time": issue, "valid_time": vt,
-                "horizon_hours": horizon_hours(issue, vt),
-                "value": v, "unit": u,
-            })
-    return pd.DataFrame(rows)
+        if cell is not None:
+            cells.setdefault(cell, []).append(loc)
+    logger.info("weather.gov: %d location(s) in %d grid cell(s)", len(us), len(cells))
+    return cells
+
+def group_by_cell(locations: list[dict]) -> list[list[dict]]:
+    """One fetch task per grid cell, deduplicated across every location of the run."""
+    return [[dict(loc, grid_cell=cell) for loc in locs] for cell, locs in _cells(locations).items()]
+
+def fetch_weather_gov_batch(locations: list[dict], variables: list[str]) -> pd.DataFrame:
+    if locations and all("grid_cell" in loc for loc in locations):
+        cells: dict[GridCell, list[dict]] = {}
+        for loc in locations:
+            cells.setdefault(loc["grid_cell"], []).append(loc)
+    else:
+        cells = _cells(locations)
+    if not cells:
+        return pd.DataFrame()
 
-def main():
     frames = []
-    for loc in CFG.TARGET_LOCATIONS:
-        frames.append(fetch_weather_gov(loc["lat"], loc["lon"], CFG.VARIABLES))
-    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
-    insert_dataframe(df, "forecasts")
+    with ThreadPoolExecutor(max_workers=provider_concurrency("weather_gov")) as pool:
+        futures = {pool.submit(_fetch_cell, cell, locs, variables): cell for cell, locs in cells.items()}
+        for fut in as_completed(futures):
+            try:
+                frames.append(fut.result())
+            except Exception as e:
+                logger.warning("weather.gov gridpoint %s failed: %s; skipping", futures[fut], e)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def fetch_weather_gov(lat: float, lon: float, variables: list[str]) -> pd.DataFrame:
+    return fetch_weather_gov_batch([{"lat": lat, "lon": lon}], variables)
+
+PROVIDER = Provider("weather_gov", fetch_weather_gov, fetch_batch=fetch_weather_gov_batch, group=group_by_cell)
+
+def main():
+    run_ingest([PROVIDER])
 
 if __name__ == "__main__":
     main()
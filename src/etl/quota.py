@@ -0,0 +1,105 @@
+"""
+Daily quota scheduling for metered providers (OpenWeather One Call, Visual Crossing).
+Consumption is tracked per UTC day in `provider_usage`; each hourly run gets an even share of
+the remaining budget and rotates through locations so all of them are covered over the day.
+The rotation cursor (where the next run's window starts) is stored on the provider's latest usage row,
+so coverage stays round-robin even when the per-run allowance changes between runs.
+"""
+import math
+import threading
+from datetime import datetime
+from sqlalchemy import text
+from src.config import CFG
+from src.utils.db_utils import db_conn
+from src.utils.time_utils import now_utc
+from src.utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+# Providers that hit 429 during this process; checked before every call
+_exhausted: set[str] = set()
+_lock = threading.Lock()
+
+def daily_quota(source: str) -> int | None:
+    q = CFG.PROVIDER_DAILY_QUOTAS.get(source)
+    return int(q) if q is not None else None
+
+def call_cost(source: str) -> int:
+    return max(1, int(CFG.PROVIDER_CALL_COST.get(source, 1)))
+
+def usage_today(source: str, now: datetime | None = None) -> tuple[int, bool]:
+    """(units consumed, exhausted flag) for the current UTC day."""
+    day = (now or now_utc()).date()
+    with db_conn() as conn:
+        row = conn.execute(
+            text("SELECT units, exhausted FROM provider_usage WHERE source=:s AND day=:d"), {"s": source, "d": day}
+        ).fetchone()
+    return (int(row[0]), bool(row[1])) if row else (0, False)
+
+def record_usage(source: str, units: int | None = None) -> None:
+    units = call_cost(source) if units is None else units
+    with db_conn() as conn:
+        conn.execute(text("""
+            INSERT INTO provider_usage (source, day, units) VALUES (:s, :d, :u)
+            ON CONFLICT (source, day) DO UPDATE SET units = provider_usage.units + EXCLUDED.units
+        """), {"s": source, "d": now_utc().date(), "u": int(units)})
+
+def rotation_cursor(source: str) -> int:
+    """Index into the location list where the next run's window starts (0 before the first rotation)."""
+    with db_conn() as conn:
+        row = conn.execute(
+            text("SELECT rotation_cursor FROM provider_usage WHERE source=:s ORDER BY day DESC LIMIT 1"), {"s": source}
+        ).fetchone()
+    return int(row[0]) if row else 0
+
+def set_rotation_cursor(source: str, cursor: int, now: datetime | None = None) -> None:
+    with db_conn() as conn:
+        conn.execute(text("""
+            INSERT INTO provider_usage (source, day, rotation_cursor) VALUES (:s, :d, :c)
+            ON CONFLICT (source, day) DO UPDATE SET rotation_cursor = EXCLUDED.rotation_cursor
+        """), {"s": source, "d": (now or now_utc()).date(), "c": int(cursor)})
+
+def mark_exhausted(source: str) -> None:
+    """Provider answered 429: stop calling it for the rest of the UTC day."""
+    with _lock:
+        if source in _exhausted:
+            return
+        _exhausted.add(source)
+    logger.warning("%s quota exhausted for today; deferring remaining calls", source)
+    with db_conn() as conn:
+        conn.execute(text("""
+            INSERT INTO provider_usage (source, day, exhausted) VALUES (:s, :d, TRUE)
+            ON CONFLICT (source, day) DO UPDATE SET exhausted = TRUE
+        """), {"s": source, "d": now_utc().date()})
+
+def is_exhausted(source: str) -> bool:
+    return source in _exhausted
+
+def plan_locations(source: str, locations: list[dict], now: datetime | None = None) -> list[dict]:
+    """
+    Locations to fetch for `source` in this run.
+    Spreads the remaining daily budget evenly over the hourly runs left today (ceil, so the
+    budget is used fully by the last run) and rotates the chosen window through the location list,
+    continuing from the stored cursor.
+    """
+    quota = daily_quota(source)
+    if quota is None or not locations:
+        return locations
+    now = now or now_utc()
+    used, exhausted = usage_today(source, now)
+    if exhausted:
+        _exhausted.add(source)
+        logger.info("%s: quota exhausted earlier today; skipping run", source)
+        return []
+    remaining_calls = max(quota - used, 0) // call_cost(source)
+    runs_left = 24 - now.hour
+    allowance = min(math.ceil(remaining_calls / runs_left), len(locations))
+    if allowance < len(locations):
+        # Continue where the previous run stopped so every location is reached before any repeats
+        start = rotation_cursor(source) % len(locations)
+        chosen = (locations[start:] + locations[:start])[:allowance]
+        set_rotation_cursor(source, (start + allowance) % len(locations), now)
+        logger.info("%s: %d/%d quota units used; fetching %d of %d locations this run",
+                    source, used, quota, allowance, len(locations))
+        return chosen
+    return locations
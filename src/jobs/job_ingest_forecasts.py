@@ -1,15 +1,20 @@
-from src.etl.ingest_open_meteo import main as om
-from src.etl.ingest_met_no import main as met
-from src.etl.ingest_openweather import main as ow
-from src.etl.ingest_visual_crossing import main as vc
-from src.etl.ingest_weather_gov import main as nws
+from src.etl.engine import Provider, run_ingest
+from src.etl.ingest_open_meteo import PROVIDER as OPEN_METEO
+from src.etl.ingest_met_no import fetch_met_no
+from src.etl.ingest_openweather import PROVIDER as OPENWEATHER
+from src.etl.ingest_visual_crossing import PROVIDER as VISUAL_CROSSING
+from src.etl.ingest_weather_gov import PROVIDER as WEATHER_GOV
+
+PROVIDERS = [
+    OPEN_METEO,
+    Provider("met_no", fetch_met_no),
+    OPENWEATHER,
+    VISUAL_CROSSING,
+    WEATHER_GOV,
+]
 
 def main():
-    om()
-    met()
-    ow()
-    vc()
-    nws()
+    run_ingest(PROVIDERS)
 
 if __name__ == "__main__":
     main()
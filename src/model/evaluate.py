@@ -1,55 +1,85 @@
 """
-Rolling-origin evaluation: split by weeks, simulate train/validate.
+Rolling-origin backtest.
+Rows are sorted by valid_time once into a float32 matrix (Prepared); folds are (train_end, valid_end)
+row offsets into it: train on [0, train_end), validate on [train_end, valid_end). Slices are views,
+so no fold copies the data, and every fold refits the model, so fold metrics are out-of-sample.
 """
-import pandas as pd
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 import numpy as np
-from datetime import timedelta
+import pandas as pd
 from sklearn.metrics import mean_absolute_error, mean_squared_error
 
-def weekly_folds(df: pd.DataFrame, time_col="valid_time", weeks_back=6):
-    df = df.sort_values(time_col)
-    if df.empty:
+@dataclass
+class Prepared:
+    X: np.ndarray        # (n, k) float32, rows sorted by valid_time
+    y: np.ndarray        # (n,) float32
+    t: np.ndarray        # (n,) datetime64[ns], UTC
+    features: list[str]
+
+    def frame(self, stop: int | None = None, start: int = 0) -> pd.DataFrame:
+        # Named view over the cached matrix so fitted models keep their feature names
+        return pd.DataFrame(self.X[start:stop], columns=self.features, copy=False)
+
+def prepare(Xy: pd.DataFrame, features: list[str], time_col="valid_time", target="y") -> Prepared:
+    """Sort once and convert to the matrices every fold and model shares."""
+    t = pd.to_datetime(Xy[time_col], utc=True).dt.tz_localize(None).to_numpy()
+    order = np.argsort(t, kind="stable")
+    return Prepared(
+        X=Xy[features].to_numpy(dtype=np.float32)[order],
+        y=Xy[target].to_numpy(dtype=np.float32)[order],
+        t=t[order],
+        features=list(features),
+    )
+
+def rolling_folds(t: np.ndarray, weeks_back=6, step=pd.Timedelta(weeks=1)) -> list[tuple[int, int]]:
+    """
+    Expanding-window folds over the last `weeks_back` weeks of the sorted times `t`, one week of
+    validation each. Less than a week of history falls back to a time-based 80/20 split.
+    """
+    if len(t) == 0:
         return []
-    min_t, max_t = df[time_col].min(), df[time_col].max()
-    step = pd.Timedelta(weeks=1)
+    step = step.to_timedelta64()
+    end = t[-1] + np.timedelta64(1, "ns")
     folds = []
-    start = min_t
-    while start + step < max_t and len(folds) < weeks_back:
-        train_end = start + step
-        valid_end = train_end + step
-        tr = df[(df[time_col] < train_end)]
-        va = df[(df[time_col] >= train_end) & (df[time_col] < valid_end)]
-        if not tr.empty and not va.empty:
-            folds.append((tr, va))
-        start += step
+    for k in range(weeks_back, 0, -1):
+        origin = end - k * step
+        a = int(np.searchsorted(t, origin, "left"))
+        b = int(np.searchsorted(t, origin + step, "left"))
+        if a > 0 and b > a:
+            folds.append((a, b))
+    if not folds:
+        split = int(0.8 * len(t))
+        if 0 < split < len(t):
+            folds.append((split, len(t)))
     return folds
 
+def _fit_predict(prep: Prepared, make_model, fold: tuple[int, int], n_jobs: int) -> np.ndarray:
+    a, b = fold
+    model = make_model(n_jobs).fit(prep.frame(a), prep.y[:a])
+    return np.asarray(model.predict(prep.frame(b, a)))
 
-import numpy as np
-from sklearn.metrics import mean_squared_error, mean_absolute_error
+def backtest(prep: Prepared, folds: list[tuple[int, int]], make_model, n_jobs: int | None = None):
+    """
+    Refit `make_model(n_jobs)` on every fold (in parallel threads sharing `prep`) and score it on
+    the fold's validation week. Returns (per-fold metrics, pooled RMSE, pooled MAE).
+    """
+    cores = n_jobs or os.cpu_count() or 1
+    threads = max(1, min(len(folds), cores))
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        preds = list(pool.map(lambda f: _fit_predict(prep, make_model, f, max(1, cores // threads)), folds))
 
-def evaluate_model(model, folds, features, target="y"):
     metrics = []
-    y_all, p_all = [], []
-
-    for i, (tr, va) in enumerate(folds, 1):
-        Xv = va[features]               # keep DataFrame to preserve feature names
-        yv = va[target].to_numpy()
-        pred = model.predict(Xv)
-
-        mae = mean_absolute_error(yv, pred)
-        rmse = mean_squared_error(yv, pred) ** 0.5
-
-        metrics.append({"fold": i, "mae": mae, "rmse": rmse, "n": len(va)})
-        y_all.append(yv)
-        p_all.append(pred)
-
-    dfm = pd.DataFrame(metrics)
+    for i, ((a, b), pred) in enumerate(zip(folds, preds), 1):
+        yv = prep.y[a:b]
+        metrics.append({"fold": i, "mae": mean_absolute_error(yv, pred),
+                        "rmse": mean_squared_error(yv, pred) ** 0.5, "n": b - a})
+    dfm = pd.DataFrame(metrics, columns=["fold", "mae", "rmse", "n"])
 
     # Overall metrics across all validation rows
-    y_all = np.concatenate(y_all) if y_all else np.array([])
-    p_all = np.concatenate(p_all) if p_all else np.array([])
-
-    rmse_overall = mean_squared_error(y_all, p_all) ** 0.5 if y_all.size else float("nan")
-    mae_overall  = mean_absolute_error(y_all, p_all)       if y_all.size else float("nan")
-    return dfm, rmse_overall, mae_overall
+    if not folds:
+        return dfm, float("nan"), float("nan")
+    y_all = np.concatenate([prep.y[a:b] for a, b in folds])
+    p_all = np.concatenate(preds)
+    return dfm, mean_squared_error(y_all, p_all) ** 0.5, mean_absolute_error(y_all, p_all)
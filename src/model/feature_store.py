@@ -0,0 +1,244 @@
+"""
+Materialised feature store shared by train and predict.
+Rows live in `feature_store`, keyed by (feature_version, variable_id, horizon_hours, location_id, valid_time),
+with the feature vector as a REAL[] in the column order registered in `feature_sets`.
+feature_version hashes the feature definition, so changing vendors, lags, windows or vendor
+selection starts a new version instead of mixing incompatible vectors.
+refresh() is incremental: only valid times touched by forecasts/observations that arrived since
+the last refresh (created_at watermarks) are rebuilt.
+"""
+import hashlib
+import json
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from src.config import CFG, SOURCE_IDS, VARIABLE_IDS
+from src.model.evaluate import Prepared
+from src.model.features import VENDORS, VENDOR_SELECTION, iter_features_all, obs_feature_columns
+from src.utils.db_utils import PG_EPOCH_US, db_conn, get_watermark, iter_df, set_watermark, upsert_binary
+from src.utils.logging_utils import get_logger
+from src.utils.time_utils import now_utc
+
+logger = get_logger(__name__)
+
+# Bump when feature code changes in a way the definition below does not capture
+FEATURE_SCHEMA_REV = 1
+# Re-scan this much before each watermark: rows committed late can carry an earlier created_at
+WATERMARK_OVERLAP = timedelta(hours=1)
+
+def feature_columns() -> list[str]:
+    lags = [f"obs_lag_{l}h" for l in CFG.FEATURE_LAGS_HOURS] + [f"obs_mean_{w}h" for w in CFG.FEATURE_ROLLING_HOURS]
+    return list(VENDORS) + obs_feature_columns(lags) + ["hour", "dow"]
+
+def feature_definition() -> dict:
+    return {
+        "rev": FEATURE_SCHEMA_REV,
+        "columns": feature_columns(),
+        "vendor_selection": VENDOR_SELECTION,
+        "horizon_tolerance_hours": 1,
+    }
+
+def feature_version() -> str:
+    raw = json.dumps(feature_definition(), sort_keys=True).encode()
+    return hashlib.sha256(raw).hexdigest()[:12]
+
+def _register(version: str) -> None:
+    with db_conn() as conn:
+        conn.execute(text("""
+            INSERT INTO feature_sets (version, columns, definition)
+            VALUES (:v, :c, CAST(:d AS JSONB))
+            ON CONFLICT (version) DO NOTHING
+        """), {"v": version, "c": feature_columns(), "d": json.dumps(feature_definition())})
+
+STORE_COLUMNS = ["feature_version", "variable_id", "horizon_hours", "location_id", "valid_time", "features", "y",
+                 "updated_at", "labelled_at"]
+# A rebuild keeps the first labelling time, so labelled_at only moves when y goes from NULL to a value
+STORE_MERGE = {"labelled_at": "COALESCE(feature_store.labelled_at, EXCLUDED.labelled_at)"}
+FLOAT4_OID = 700  # element type of REAL[] in the binary array encoding
+
+def _binary_rows(version: str, variable_id: int, horizon: int, location_id: np.ndarray, valid_us: np.ndarray,
+                 m: np.ndarray, y: np.ndarray, updated_us: int) -> list[np.ndarray]:
+    """
+    feature_store rows as COPY BINARY tuples (STORE_COLUMNS order). Every row has the same width, so
+    they are filled column-wise as numpy records; feature NaNs are stored as REAL NaN (not NULL) to
+    keep it that way, and rows with a NULL y go in a second block (NULL labelled_at too).
+    """
+    k = m.shape[1]
+    ver = version.encode()
+    blocks = []
+    for has_y in (True, False):
+        sel = ~np.isnan(y) if has_y else np.isnan(y)
+        if not sel.any():
+            continue
+        r = np.zeros(int(sel.sum()), dtype=[
+            ("nfields", ">i2"),
+            ("ver_len", ">i4"), ("ver", f"S{len(ver)}"),
+            ("vid_len", ">i4"), ("vid", ">i2"),
+            ("h_len", ">i4"), ("h", ">i4"),
+            ("loc_len", ">i4"), ("loc", ">i4"),
+            ("t_len", ">i4"), ("t", ">i8"),
+            ("f_len", ">i4"), ("ndim", ">i4"), ("has_null", ">i4"), ("elem_oid", ">i4"), ("dim", ">i4"), ("lbound", ">i4"),
+            ("f", [("len", ">i4"), ("v", ">f4")], (k,)),
+            ("y_len", ">i4"), *([("y", ">f4")] if has_y else []),
+            ("u_len", ">i4"), ("u", ">i8"),
+            ("l_len", ">i4"), *([("l", ">i8")] if has_y else []),
+        ])
+        r["nfields"] = len(STORE_COLUMNS)
+        r["ver_len"], r["ver"] = len(ver), ver
+        r["vid_len"], r["vid"] = 2, variable_id
+        r["h_len"], r["h"] = 4, horizon
+        r["loc_len"], r["loc"] = 4, location_id[sel]
+        r["t_len"], r["t"] = 8, valid_us[sel]
+        r["f_len"] = 20 + 8 * k
+        r["ndim"], r["has_null"], r["elem_oid"], r["dim"], r["lbound"] = 1, 0, FLOAT4_OID, k, 1
+        r["f"]["len"] = 4
+        r["f"]["v"] = m[sel]
+        if has_y:
+            r["y_len"], r["y"] = 4, y[sel]
+        else:
+            r["y_len"] = -1
+        r["u_len"], r["u"] = 8, updated_us
+        if has_y:
+            r["l_len"], r["l"] = 8, updated_us
+        else:
+            r["l_len"] = -1
+        blocks.append(r)
+    return blocks
+
+def _store(Xy: pd.DataFrame, variable: str, horizon: int, version: str) -> int:
+    if Xy.empty:
+        return 0
+    m = Xy.reindex(columns=feature_columns()).to_numpy(dtype=np.float32)
+    valid = pd.to_datetime(Xy["valid_time"], utc=True).dt.tz_localize(None).to_numpy().astype("datetime64[us]")
+    blocks = _binary_rows(
+        version, VARIABLE_IDS[variable], int(horizon),
+        Xy["location_id"].to_numpy(dtype=np.int32),
+        valid.astype(np.int64) - PG_EPOCH_US,
+        m,
+        Xy["y"].to_numpy(dtype=np.float32),
+        pd.Timestamp(now_utc()).value // 1000 - PG_EPOCH_US,
+    )
+    return upsert_binary(blocks, STORE_COLUMNS, "feature_store", merge=STORE_MERGE)
+
+def _dirty_since(version: str):
+    """
+    Earliest valid_time whose features may have changed since the last refresh, or None if nothing
+    arrived. A new observation at t changes the target at t-1h..t+1h and lags/means up to the longest window after t;
+    rebuilding everything from t-1h covers both.
+    """
+    fw = get_watermark(f"feature_store.{version}.forecasts")
+    ow = get_watermark(f"feature_store.{version}.observations")
+    with db_conn() as conn:
+        f_min = conn.execute(text("SELECT min(valid_time) FROM forecasts WHERE created_at > :w AND source_id = ANY(:sids)"),
+                             {"w": fw - WATERMARK_OVERLAP, "sids": [SOURCE_IDS[s] for s in VENDORS]}).scalar()
+        o_min = conn.execute(text("SELECT min(obs_time) FROM observations WHERE created_at > :w"),
+                             {"w": ow - WATERMARK_OVERLAP}).scalar()
+    candidates = [t for t in (f_min, o_min - timedelta(hours=1) if o_min is not None else None) if t is not None]
+    return min(candidates) if candidates else None
+
+def refresh(variables: list[str] | None = None, horizons: list[int] | None = None) -> int:
+    """Bring the current feature version up to date; returns rows upserted."""
+    variables = CFG.VARIABLES if variables is None else variables
+    horizons = CFG.HORIZONS_HOURS if horizons is None else horizons
+    version = feature_version()
+    _register(version)
+    with db_conn() as conn:
+        f_until = conn.execute(text("SELECT max(created_at) FROM forecasts")).scalar()
+        o_until = conn.execute(text("SELECT max(created_at) FROM observations")).scalar()
+    if f_until is None:
+        logger.info("No forecasts yet; feature store left empty")
+        return 0
+
+    full = get_watermark(f"feature_store.{version}.forecasts") is None \
+        or get_watermark(f"feature_store.{version}.observations") is None
+    if full:
+        since = None
+        logger.info("Building feature store version %s from full history", version)
+    else:
+        since = _dirty_since(version)
+        if since is None:
+            logger.info("Feature store version %s is up to date", version)
+            return 0
+        logger.info("Refreshing feature store version %s from valid_time %s", version, since)
+
+    rows = 0
+    for var in variables:
+        for h, Xy in iter_features_all(var, horizons, since=since):
+            rows += _store(Xy, var, h, version)
+    set_watermark(f"feature_store.{version}.forecasts", f_until)
+    if o_until is not None:
+        set_watermark(f"feature_store.{version}.observations", o_until)
+    logger.info("Feature store version %s: upserted %d rows", version, rows)
+    return rows
+
+def load_features(variable: str, horizon: int, updated_since=None, version: str | None = None,
+                  labelled_since=None) -> pd.DataFrame:
+    """
+    Feature matrix for one (variable, horizon) in the layout build_features returns:
+    location_id, lat, lon, valid_time, <feature columns>, y. Vendors with no values at all are dropped
+    from full loads; `updated_since` restricts it to rows (re)built after that time and
+    `labelled_since` to rows whose target first arrived after it. Both keep every column, since a
+    vendor missing from a recent slice says nothing about the models' inputs.
+    """
+    version = version or feature_version()
+    cols = feature_columns()
+    sql = """
+    SELECT fs.location_id, l.lat, l.lon, fs.valid_time, fs.features, fs.y
+    FROM feature_store fs
+    JOIN locations l ON l.id = fs.location_id
+    WHERE fs.feature_version = :v AND fs.variable_id = :vid AND fs.horizon_hours = :h
+    """ + ("    AND fs.updated_at > :u\n" if updated_since is not None else "") \
+        + ("    AND fs.labelled_at > :l\n" if labelled_since is not None else "")
+    params = {"v": version, "vid": VARIABLE_IDS[variable], "h": int(horizon), "u": updated_since, "l": labelled_since}
+    frames = []
+    for chunk in iter_df(sql, params, dtypes={"location_id": "int32"}):
+        m = np.array(chunk.pop("features").tolist(), dtype=np.float32).reshape(len(chunk), len(cols))
+        feats = pd.DataFrame(m, columns=cols, index=chunk.index)
+        frames.append(pd.concat([chunk.drop(columns="y"), feats, chunk[["y"]]], axis=1))
+    if not frames:
+        return pd.DataFrame()
+    Xy = pd.concat(frames, ignore_index=True)
+    Xy["valid_time"] = pd.to_datetime(Xy["valid_time"], utc=True)
+    if updated_since is not None or labelled_since is not None:
+        return Xy
+    empty_vendors = [c for c in VENDORS if Xy[c].isna().all()]
+    return Xy.drop(columns=empty_vendors)
+
+def load_prepared(variable: str, horizon: int, version: str | None = None) -> Prepared | None:
+    """
+    Labelled rows with at least one vendor value as the training matrix, or None if there are none.
+    Streamed from the store in valid_time order straight into float32 chunks, so no pandas frame
+    of the whole history (nor the re-sorted copy prepare() makes) is held; vendors with no values
+    are dropped from the feature list, as load_features does.
+    """
+    version = version or feature_version()
+    cols = feature_columns()
+    vendor_idx = [i for i, c in enumerate(cols) if c in VENDORS]
+    sql = """
+    SELECT valid_time, features, y
+    FROM feature_store
+    WHERE feature_version = :v AND variable_id = :vid AND horizon_hours = :h AND y IS NOT NULL
+    ORDER BY valid_time
+    """
+    params = {"v": version, "vid": VARIABLE_IDS[variable], "h": int(horizon)}
+    xs, ys, ts = [], [], []
+    for chunk in iter_df(sql, params, dtypes={"y": "float32"}):
+        m = np.array(chunk["features"].tolist(), dtype=np.float32).reshape(len(chunk), len(cols))
+        keep = ~np.isnan(m[:, vendor_idx]).all(axis=1)
+        if not keep.any():
+            continue
+        xs.append(m[keep])
+        ys.append(chunk["y"].to_numpy()[keep])
+        ts.append(pd.to_datetime(chunk["valid_time"], utc=True).dt.tz_localize(None).to_numpy()[keep])
+        del chunk, m
+    if not xs:
+        return None
+    X = np.concatenate(xs)
+    del xs
+    present = ~np.isnan(X).all(axis=0)
+    used = [i for i, c in enumerate(cols) if c not in VENDORS or present[i]]
+    if len(used) < len(cols):
+        X = X[:, used]
+    return Prepared(X=X, y=np.concatenate(ys), t=np.concatenate(ts).astype("datetime64[ns]"),
+                    features=[cols[i] for i in used])
@@ -1,34 +1,130 @@
 """
 Build feature matrix for our model:
 - Vendor forecasts for same valid_time (one column per vendor per variable)
-- Lagged observations (1h, 3h, 6h) per variable
+- Lagged observations (FEATURE_LAGS_HOURS) and trailing rolling means (FEATURE_ROLLING_HOURS) per variable
 - Calendar features (hour of day, day of week)
+iter_features_all() produces every horizon of a variable from a single read of each table, one horizon at a time.
+Vendor matrices are sliced from the local forecast cube (synced from the forecasts table first);
+the SQL pivot remains the fallback when the cube cannot serve the request.
 """
+import re
+from datetime import datetime, timedelta
+from itertools import chain
+from typing import Iterator
+import numpy as np
 import pandas as pd
-from src.utils.db_utils import fetch_df
+from src.config import CFG, VARIABLE_IDS, SOURCE_IDS
+from src.utils.db_utils import fetch_df, fetch_df_chunked, iter_df
+from src.utils.forecast_cube import sync as sync_cube
 from src.utils.logging_utils import get_logger
 
 logger = get_logger(__name__)
 
-def get_vendor_matrix(variable: str, horizon: int) -> pd.DataFrame:
-    sql = """
-    SELECT lat, lon, valid_time, source, value, horizon_hours
-    FROM forecasts
-    WHERE variable = :variable
-    AND source IN ('open_meteo','met_no','openweather','visual_crossing','weather_gov')
+VENDORS = ("open_meteo", "met_no", "openweather", "visual_crossing", "weather_gov")
+
+SOURCE_NAMES = {SOURCE_IDS[s]: s for s in VENDORS}
+
+# Compact per-chunk dtypes for streamed reads
+OBS_DTYPES = {"location_id": "int32", "value": "float32"}
+
+# "closest": one forecast per (horizon, location, valid_time, source) -- the issue whose lead time is
+# nearest the horizon, latest issue on ties; "mean": average every issue within the ±1h tolerance
+VENDOR_SELECTION = "closest"
+
+def _cube_vendor_frames(variable: str, horizons: list[int], since: datetime | None = None) -> Iterator[tuple[int, pd.DataFrame]] | None:
+    """Per-horizon vendor frames from the forecast cube (same closest-lead cells), or None if it can't serve them."""
+    try:
+        cube = sync_cube(variable)
+    except Exception as e:  # the cube is a derived cache; the SQL pivot gives the same answer
+        logger.warning("Forecast cube for %s unavailable (%s); pivoting forecasts in SQL", variable, e)
+        return None
+    if not cube.exists or not {int(h) for h in horizons} <= set(cube.axes["horizons"]):
+        return None
+    frames = ((int(h), cube.vendor_frame(int(h), start=since, sources=list(VENDORS))) for h in horizons)
+    return ((h, vf) for h, vf in frames if not vf.empty)
+
+def iter_vendor_matrices(variable: str, horizons: list[int], selection: str = VENDOR_SELECTION,
+                         since: datetime | None = None) -> Iterator[tuple[int, pd.DataFrame]]:
+    """
+    Vendor matrices one horizon at a time as (horizon, frame): rows within ±1h of the horizon, one
+    column per vendor (location_id, valid_time, <vendor>...), vendors without values dropped.
+    `since` limits it to valid_time >= since. "closest" is sliced from the forecast cube when
+    available; otherwise one SQL query pivots every horizon and is streamed in horizon order, so only
+    the current horizon's rows are held.
+    """
+    if selection not in ("closest", "mean"):
+        raise ValueError(f"Unknown vendor selection: {selection}")
+    if selection == "closest":
+        frames = _cube_vendor_frames(variable, horizons, since)
+        if frames is not None:
+            yield from frames
+            return
+    agg = "max" if selection == "closest" else "avg"
+    pivots = ",\n           ".join(
+        f"{agg}(value) FILTER (WHERE source_id = {sid}) AS {name}" for sid, name in SOURCE_NAMES.items()
+    )
+    candidates = """
+      FROM forecasts f
+      JOIN unnest(CAST(:horizons AS INT[])) AS h(h) ON abs(f.horizon_hours - h.h) <= 1
+      WHERE f.variable_id = :variable_id
+      AND f.source_id = ANY(:source_ids)
+    """ + ("      AND f.valid_time >= :since\n" if since is not None else "")
+    if selection == "closest":
+        # DISTINCT ON leaves exactly one row per key, so the pivot only sees pre-deduplicated rows
+        rows = f"""
+      SELECT DISTINCT ON (h.h, f.location_id, f.valid_time, f.source_id)
+             h.h AS horizon, f.location_id, f.valid_time, f.source_id, f.value
+      {candidates}
+      ORDER BY h.h, f.location_id, f.valid_time, f.source_id, abs(f.horizon_hours - h.h), f.issue_time DESC
+        """
+    else:
+        rows = f"""
+      SELECT h.h AS horizon, f.location_id, f.valid_time, f.source_id, f.value
+      {candidates}
+        """
+    sql = f"""
+    WITH c AS ({rows})
+    SELECT horizon, location_id, valid_time,
+           {pivots}
+    FROM c
+    GROUP BY horizon, location_id, valid_time
+    ORDER BY horizon
+    """
+    params = {"variable_id": VARIABLE_IDS[variable], "source_ids": list(SOURCE_NAMES), "horizons": [int(h) for h in horizons],
+              "since": since}
+    dtypes = {"horizon": "int16", "location_id": "int32", **{name: "float32" for name in VENDORS}}
+
+    def done(parts: list[pd.DataFrame]) -> pd.DataFrame:
+        # Vendors with no rows at all carry no signal; drop them like pivot_table would
+        return pd.concat(parts, ignore_index=True).dropna(axis=1, how="all")
+
+    current, parts = None, []
+    for chunk in iter_df(sql, params, dtypes=dtypes):
+        for h, part in chunk.groupby("horizon", sort=False):
+            if current is not None and h != current:
+                yield int(current), done(parts)
+                parts = []
+            current = h
+            parts.append(part.drop(columns="horizon"))
+    if parts:
+        yield int(current), done(parts)
+
+def get_vendor_matrices(variable: str, horizons: list[int], selection: str = VENDOR_SELECTION,
+                        since: datetime | None = None) -> pd.DataFrame:
+    """
+    iter_vendor_matrices collected into one frame: horizon, location_id, valid_time, <vendor>...
     """
-    df = fetch_df(sql, {"variable": variable})
+    frames = [vf.assign(horizon=np.int16(h)) for h, vf in iter_vendor_matrices(variable, horizons, selection, since)]
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    return df[["horizon", "location_id", "valid_time"] + [c for c in VENDORS if c in df.columns]]
+
+def get_vendor_matrix(variable: str, horizon: int) -> pd.DataFrame:
+    df = get_vendor_matrices(variable, [horizon])
     if df.empty:
         return df
-# Try tolerant horizon filter first
-    dff = df[ (df["horizon_hours"] - horizon).abs() <= 1 ]
-    if dff.empty:
-        logger.warning("No vendor rows for %s H+%d within ±1h; falling back to unfiltered", variable, horizon)
-        dff = df
-
-    return dff.pivot_table(
-        index=["lat","lon","valid_time"], columns="source", values="value"
-    ).reset_index()
+    return df.drop(columns="horizon").dropna(axis=1, how="all")
 
 # def get_vendor_matrix(variable: str, horizon: int) -> pd.DataFrame:
 #     sql = """
@@ -47,26 +143,73 @@ def get_vendor_matrix(variable: str, horizon: int) -> pd.DataFrame:
 #         values="value",
 #     ).reset_index()
 
-def get_obs_lags(variable: str, lags=(1,3,6)) -> pd.DataFrame:
+def _utc_us(values) -> pd.Series:
+    """UTC timestamps in one unit (us, as read_sql returns them): merge keys must match exactly."""
+    return pd.to_datetime(values, utc=True).dt.as_unit("us")
+
+def get_observations(variable: str, since: datetime | None = None) -> pd.DataFrame:
+    """
+    Observations for a variable as location_id, valid_time, value (read once, shared by lags and target).
+    Lags need each location's full series, so this is read whole, typed per chunk.
+    """
     sql = """
-    SELECT lat, lon, obs_time, value
+    SELECT location_id, obs_time, value
     FROM observations
-    WHERE variable = :variable
+    WHERE variable_id = :variable_id
+    """ + ("    AND obs_time >= :since\n" if since is not None else "")
+    df = fetch_df_chunked(sql, {"variable_id": VARIABLE_IDS[variable], "since": since}, dtypes=OBS_DTYPES).rename(columns={"obs_time":"valid_time"})
+    if df.empty: return df
+    df["valid_time"] = _utc_us(df["valid_time"])
+    return df
+
+def _trailing_mean(grid: np.ndarray, window: int) -> np.ndarray:
+    """Mean of the `window` hours before each slot (t-window .. t-1), ignoring gaps; NaN if all missing."""
+    ok = ~np.isnan(grid)
+    csum = np.concatenate(([0.0], np.cumsum(np.where(ok, grid, 0.0), dtype=np.float64)))
+    ccnt = np.concatenate(([0], np.cumsum(ok)))
+    t = np.arange(len(grid))
+    lo = np.maximum(t - window, 0)
+    total, count = csum[t] - csum[lo], ccnt[t] - ccnt[lo]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, total / count, np.nan).astype(np.float32)
+
+def get_obs_lags(variable: str, lags=None, obs: pd.DataFrame | None = None, windows=None) -> pd.DataFrame:
+    """
+    Lagged observations (obs_lag_{l}h) and trailing rolling means (obs_mean_{w}h) per location.
+    Each location's observations are placed on a regular hourly grid, so a lag is an array shift
+    and a rolling mean a cumulative-sum difference; one row per grid hour is returned.
     """
-    df = fetch_df(sql, {"variable": variable}).rename(columns={"obs_time":"valid_time"})
+    lags = CFG.FEATURE_LAGS_HOURS if lags is None else lags
+    windows = CFG.FEATURE_ROLLING_HOURS if windows is None else windows
+    df = get_observations(variable) if obs is None else obs
     if df.empty: return df
-    out = df.copy()
-    out = out.sort_values(["lat","lon","valid_time"])
-    frames = [out]
-    for l in lags:
-        lagged = out.copy()
-        lagged["valid_time"] = lagged["valid_time"] + pd.to_timedelta(l, unit="h")
-        lagged = lagged.rename(columns={"value": f"obs_lag_{l}h"})
-        frames.append(lagged[["lat","lon","valid_time",f"obs_lag_{l}h"]])
-    base = frames[0][["lat","lon","valid_time"]].drop_duplicates()
-    for fr in frames[1:]:
-        base = base.merge(fr, on=["lat","lon","valid_time"], how="left")
-    return base
+    hours = df["valid_time"].dt.tz_convert("UTC").dt.tz_localize(None).to_numpy().astype("datetime64[h]").astype(np.int64)
+    frames = []
+    for loc, idx in df.groupby("location_id").indices.items():
+        h = hours[idx]
+        t0 = h.min()
+        grid = np.full(h.max() - t0 + 1, np.nan, dtype=np.float32)
+        grid[h - t0] = df["value"].to_numpy()[idx]  # duplicates within an hour: last one wins
+        cols = {
+            "location_id": np.full(len(grid), loc, dtype=np.int32),
+            "valid_time": pd.to_datetime((t0 + np.arange(len(grid))).astype("datetime64[h]"), utc=True),
+        }
+        for l in lags:
+            shifted = np.full(len(grid), np.nan, dtype=np.float32)
+            if l < len(grid):
+                shifted[l:] = grid[:len(grid) - l]
+            cols[f"obs_lag_{l}h"] = shifted
+        for w in windows:
+            cols[f"obs_mean_{w}h"] = _trailing_mean(grid, int(w))
+        frames.append(pd.DataFrame(cols))
+    return pd.concat(frames, ignore_index=True)
+
+def obs_feature_columns(columns) -> list[str]:
+    """Observation feature columns in a stable order: lags, then rolling means, each by hours."""
+    def key(c):
+        m = re.search(r"^obs_(lag|mean)_(\d+)h?$", c)
+        return (m.group(1) == "mean", int(m.group(2)))
+    return sorted((c for c in columns if re.match(r"^obs_(lag|mean)_\d+h?$", c)), key=key)
 
 def calendar_features(df_index: pd.DataFrame) -> pd.DataFrame:
     df = df_index.copy()
@@ -74,58 +217,67 @@ def calendar_features(df_index: pd.DataFrame) -> pd.DataFrame:
     df["dow"] = pd.to_datetime(df["valid_time"]).dt.dayofweek
     return df
 
-def build_features(variable: str, horizon: int) -> pd.DataFrame:
-    vend = get_vendor_matrix(variable, horizon)
-    if vend.empty: return vend
-    lags = get_obs_lags(variable)
-    X = vend.merge(lags, on=["lat","lon","valid_time"], how="left")
-    cal = calendar_features(X[["valid_time"]].drop_duplicates()).rename(columns={"valid_time":"valid_time"})
+def _assemble(vend: pd.DataFrame, lags: pd.DataFrame, ydf: pd.DataFrame, locs: pd.DataFrame) -> pd.DataFrame:
+    """Join one horizon's vendor matrix with lags, calendar features, the ±1h target and coordinates."""
+    X = vend.merge(lags, on=["location_id","valid_time"], how="left") if not lags.empty else vend
+    cal = calendar_features(X[["valid_time"]].drop_duplicates())
     X = X.merge(cal, on="valid_time", how="left")
-    
-    # attach target from observations with ±1h tolerance using merge_asof (memory‑safe)
-    ysql = """
-    SELECT lat, lon, obs_time AS obs_time, value AS y
-    FROM observations
-    WHERE variable = :variable
-    """
-    ydf = fetch_df(ysql, {"variable": variable})
-    if ydf.empty:
-        return pd.DataFrame()
-
-    # ensure proper dtypes & sorting for merge_asof
-    # Ensure same dtype/timezone and sort by keys (required for merge_asof with by=)
-
-    X["lat"] = X["lat"].astype(float)
-    X["lon"] = X["lon"].astype(float)
-    ydf["lat"] = ydf["lat"].astype(float)
-    ydf["lon"] = ydf["lon"].astype(float)
     X = X[X["valid_time"].notna()]
-    ydf = ydf[ydf["obs_time"].notna()]
-    
-    X = X.copy()
-    X["valid_time"] = pd.to_datetime(X["valid_time"], utc=True)
-    X = X.sort_values(["lat", "lon", "valid_time"], kind="mergesort")
-
-    ydf = ydf.copy()
-    ydf["obs_time"] = pd.to_datetime(ydf["obs_time"], utc=True)
-    ydf = ydf.rename(columns={"obs_time": "valid_time"})
-    ydf = ydf.sort_values(["lat", "lon", "valid_time"], kind="mergesort")
-
-    # Ensure proper sorting for merge_asof
-    X["valid_time"] = pd.to_datetime(X["valid_time"], utc=True)
-    ydf["valid_time"] = pd.to_datetime(ydf["valid_time"], utc=True)
-
-    X = X.sort_values(["valid_time", "lat", "lon"], kind="mergesort")
-    ydf = ydf.sort_values(["valid_time", "lat", "lon"], kind="mergesort")
+    if ydf.empty:
+        return X.assign(y=np.nan).merge(locs, on="location_id", how="left")
 
+    # attach target from observations with ±1h tolerance using merge_asof (memory‑safe);
+    # merge_asof needs both sides sorted on the `on` key
+    X = X.sort_values(["valid_time", "location_id"], kind="mergesort")
     Xy = pd.merge_asof(
         X, ydf,
         on="valid_time",
-        by=["lat", "lon"],
+        by="location_id",
         direction="nearest",
         tolerance=pd.Timedelta(hours=1)
     )
-    return Xy
+    # Coordinates, as in load_features' layout
+    return Xy.merge(locs, on="location_id", how="left")
+
+def obs_lookback() -> timedelta:
+    """How far before a valid_time its observation features reach (longest lag/window plus target tolerance)."""
+    return timedelta(hours=max([0, *CFG.FEATURE_LAGS_HOURS, *CFG.FEATURE_ROLLING_HOURS]) + 1)
+
+def iter_features_all(variable: str, horizons: list[int], since: datetime | None = None) -> Iterator[tuple[int, pd.DataFrame]]:
+    """
+    Feature matrices for all horizons of a variable in one pass, yielded as (horizon, Xy) as each
+    horizon's vendor rows arrive: forecasts, observations and locations are each read once.
+    Horizons without vendor rows within ±1h are left out. With `since`, only valid_time >= since
+    is built (observations are read from since - obs_lookback()).
+    """
+    vendors = iter_vendor_matrices(variable, horizons, since=since)
+    first = next(vendors, None)
+    if first is None:
+        return
+    obs = get_observations(variable, since=since - obs_lookback() if since is not None else None)
+    if obs.empty and since is None:
+        return
+    lags = get_obs_lags(variable, obs=obs) if not obs.empty else obs
+    if not lags.empty:
+        lags["valid_time"] = _utc_us(lags["valid_time"])
+    ydf = obs.rename(columns={"value": "y"}).sort_values(["valid_time", "location_id"], kind="mergesort") if not obs.empty else obs
+    locs = fetch_df("SELECT id AS location_id, lat, lon FROM locations").astype({"location_id": "int32"})
+
+    seen = set()
+    for h, vend in chain([first], vendors):
+        vend["valid_time"] = _utc_us(vend["valid_time"])
+        seen.add(h)
+        yield h, _assemble(vend, lags, ydf, locs)
+    for h in horizons:
+        if int(h) not in seen:
+            logger.warning("No vendor rows for %s H+%d within ±1h", variable, h)
+
+def build_features_all(variable: str, horizons: list[int], since: datetime | None = None) -> dict[int, pd.DataFrame]:
+    """iter_features_all collected into {horizon: Xy}."""
+    return dict(iter_features_all(variable, horizons, since=since))
+
+def build_features(variable: str, horizon: int) -> pd.DataFrame:
+    return build_features_all(variable, [horizon]).get(int(horizon), pd.DataFrame())
 
     # # attach target from observations (aligned to valid_time)
     # ysql = """
@@ -0,0 +1,65 @@
+"""
+Native LightGBM training data.
+The prepared float32 matrix is binned once into a lightgbm.Dataset per (variable, horizon) fit and
+shared by every backtest fold and the final fit; BoosterRegressor trains on leading-row subsets of
+it, which is all a rolling-origin fold needs. Bin boundaries come only from rows before the first
+fold origin, so no fold's bins are informed by its validation week.
+"""
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from src.model.evaluate import Prepared
+
+# feature_pre_filter off so one binned Dataset can serve any leaf parameters
+DATASET_PARAMS = {"max_bin": 255, "feature_pre_filter": False, "verbosity": -1}
+# bagging_fraction only takes effect with bagging_freq > 0 (re-sample every iteration)
+PARAMS = {"objective": "regression", "learning_rate": 0.05, "max_depth": -1, "bagging_fraction": 0.8,
+          "bagging_freq": 1, "verbosity": -1}
+NUM_BOOST_ROUND = 300
+
+def binned_dataset(prep: Prepared, bin_rows: int) -> lgb.Dataset:
+    """
+    Constructed Dataset over all rows of `prep`, with bin boundaries taken from the first
+    `bin_rows` rows only (the rows before the first fold origin).
+    """
+    ref = lgb.Dataset(prep.X[:bin_rows], label=prep.y[:bin_rows], feature_name=prep.features,
+                      params=DATASET_PARAMS).construct()
+    return lgb.Dataset(prep.X, label=prep.y, feature_name=prep.features, params=DATASET_PARAMS,
+                       reference=ref, free_raw_data=True).construct()
+
+class BoosterRegressor:
+    """
+    sklearn-style regressor over a native booster (NaNs are handled by LightGBM's missing-value splits).
+    With `dataset`, fit(X, y) trains on the first len(y) rows of that binned Dataset rather than re-binning X,
+    so X must be a leading slice of the rows the Dataset was built from.
+    """
+    def __init__(self, num_boost_round: int = NUM_BOOST_ROUND, n_jobs: int | None = None,
+                 dataset: lgb.Dataset | None = None, init_model: lgb.Booster | None = None):
+        self.num_boost_round = num_boost_round
+        self.n_jobs = n_jobs
+        self.dataset = dataset
+        self.init_model = init_model
+
+    def fit(self, X: pd.DataFrame, y):
+        if self.dataset is not None:
+            n = len(y)
+            ds = self.dataset if n == self.dataset.num_data() else self.dataset.subset(np.arange(n))
+        else:
+            ds = lgb.Dataset(X.to_numpy(dtype=np.float32), label=np.asarray(y, dtype=np.float32),
+                             feature_name=list(X.columns), params=DATASET_PARAMS)
+        params = dict(PARAMS, num_threads=self.n_jobs) if self.n_jobs else PARAMS
+        self.booster_ = lgb.train(params, ds, num_boost_round=self.num_boost_round, init_model=self.init_model)
+        self.feature_names_in_ = np.asarray(X.columns, dtype=object)
+        return self
+
+    def predict(self, X) -> np.ndarray:
+        if isinstance(X, pd.DataFrame):
+            X = X[list(self.feature_names_in_)].to_numpy(dtype=np.float32)
+        return self.booster_.predict(X)
+
+    def __getstate__(self):
+        # The binned Dataset and the warm-start booster are training-only
+        state = self.__dict__.copy()
+        state["dataset"] = None
+        state["init_model"] = None
+        return state
@@ -5,19 +5,19 @@ For simplicity, use the latest run as champion fallback.
 
 import os
 import gc
-import re
 import mlflow
 import pandas as pd
 from sqlalchemy import text
-from datetime import datetime, timezone
 
 from sklearn import set_config
 set_config(transform_output="pandas")  # keep sklearn transformer outputs as DataFrames
 
-from src.config import CFG
-from src.model.features import build_features
-from src.utils.db_utils import db_conn, insert_dataframe
+from src.config import CFG, SOURCE_IDS, VARIABLE_IDS
+from src.model.features import VENDORS, obs_feature_columns
+from src.model import feature_store
+from src.utils.db_utils import db_conn, get_watermark, set_watermark, upsert_dataframe
 from src.utils.logging_utils import get_logger
+from src.utils.time_utils import floor_hour, now_utc
 
 logger = get_logger(__name__)
 
@@ -42,37 +42,40 @@ def mlflow_setup():
         tracking_uri = f"https://dagshub.com/{CFG.DAGSHUB_USERNAME}/{CFG.PUBLIC_REPO_NAME}.mlflow"
         mlflow.set_tracking_uri(tracking_uri)
 
-def _sort_lag_cols(cols):
-    # Sort lags like 'obs_lag_1h', 'obs_lag_3h', 'obs_lag_6h' by numeric value
-    def lag_key(c):
-        m = re.search(r"^obs_lag_(\d+)h?$", c)
-        return int(m.group(1)) if m else 10**9
-    return sorted(cols, key=lag_key)
-
 # Stream predictions in batches to avoid large in-memory accumulation
 BATCH_SIZE = 50_000  # adjust to your CI memory budget
 
-def _predict_and_insert_stream(model, Xy: pd.DataFrame, var: str, h: int):
-    # Build features EXACTLY like training
-    vendor_cols = [c for c in ("open_meteo", "met_no", "openweather", "visual_crossing", "weather_gov") if c in Xy.columns]
-    if not vendor_cols:
-        return
-
-    lag_cols = _sort_lag_cols([c for c in Xy.columns if c.startswith("obs_lag_")])
-    feat_cols = vendor_cols + lag_cols + ["hour", "dow"]
+def _model_features(model) -> list[str] | None:
+    """Input columns from the model's logged signature, or None when it has none."""
+    schema = model.metadata.get_input_schema()
+    return schema.input_names() if schema is not None else None
 
+def _predict_and_insert_stream(model, Xy: pd.DataFrame, var: str, h: int):
     # Ensure calendar features exist
     if "hour" not in Xy.columns or Xy["hour"].isna().any():
         Xy["hour"] = pd.to_datetime(Xy["valid_time"]).dt.hour
     if "dow" not in Xy.columns or Xy["dow"].isna().any():
         Xy["dow"] = pd.to_datetime(Xy["valid_time"]).dt.dayofweek
 
-    # Keep rows with at least one vendor signal (imputer handles lag NaNs)
-    mask_has_vendor = pd.notna(Xy[vendor_cols]).any(axis=1)
-    X = Xy.loc[mask_has_vendor, ["lat", "lon", "valid_time"] + feat_cols]
+    # Build features EXACTLY like training: the champion's input schema decides the columns, and
+    # a vendor with no values in this slice stays in as NaN rather than failing the schema check
+    feat_cols = _model_features(model)
+    if feat_cols is None:
+        feat_cols = [c for c in VENDORS if c in Xy.columns] + obs_feature_columns(Xy.columns) + ["hour", "dow"]
+    vendor_cols = [c for c in feat_cols if c in VENDORS]
+    if not vendor_cols:
+        return
+    X = Xy.reindex(columns=["location_id", "valid_time"] + feat_cols)
+    X[feat_cols] = X[feat_cols].astype("float32")  # training matrices (and signatures) are float32
+
+    # Keep rows with at least one vendor signal (the model handles lag NaNs)
+    X = X[X[vendor_cols].notna().any(axis=1)]
     if X.empty:
         return
 
+    # Hourly issue time keeps re-runs idempotent on the forecasts natural key
+    issue = floor_hour(now_utc())
+
     # Process in batches and insert to DB per batch
     n = len(X)
     for start in range(0, n, BATCH_SIZE):
@@ -81,18 +84,16 @@ def _predict_and_insert_stream(model, Xy: pd.DataFrame, var: str, h: int):
         yhat = model.predict(Xb[feat_cols])
 
         out = pd.DataFrame({
-            "source": "our_model",
-            "lat": Xb["lat"].values,
-            "lon": Xb["lon"].values,
-            "variable": var,
-            "issue_time": datetime.now(timezone.utc),
+            "source_id": SOURCE_IDS["our_model"],
+            "location_id": Xb["location_id"].values,
+            "variable_id": VARIABLE_IDS[var],
+            "issue_time": issue,
             "valid_time": Xb["valid_time"].values,
             "horizon_hours": h,
             "value": yhat.astype(float),
-            "unit": {"temp_2m": "C", "wind_speed_10m": "m/s", "precipitation": "mm"}[var],
         })
 
-        insert_dataframe(out, "forecasts")
+        upsert_dataframe(out, "forecasts")
         del Xb, yhat, out
         gc.collect()
 
@@ -106,12 +107,19 @@ def main():
     model = mlflow.pyfunc.load_model(f"models:/{champion_name}/Production")
     logger.info(f"Loaded champion model: {champion_name}")
 
+    # Score only feature rows (re)built since the previous prediction run
+    started = now_utc()
+    feature_store.refresh()
+    version = feature_store.feature_version()
+    mark = f"predict.{version}"
+    since = get_watermark(mark)
     for var in CFG.VARIABLES:
         for h in CFG.HORIZONS_HOURS:
-            Xy = build_features(var, h)
+            Xy = feature_store.load_features(var, h, updated_since=since, version=version)
             if Xy is None or Xy.empty:
                 continue
             _predict_and_insert_stream(model, Xy, var, h)
+    set_watermark(mark, started)
 
 if __name__ == "__main__":
     main()
@@ -2,172 +2,201 @@
 Train per-variable, per-horizon models.
 - Baseline: linear regression on vendor features (+lags)
 - Ensemble: LightGBM if available; fallback to LinearRegression
+- LightGBM trains on a native Dataset binned once per fit and shared by all folds (lgb_data)
+- Rolling-origin backtest refits both per fold; the served model is then fit on all rows
+- Between full retrains, LightGBM is warm-started from the previous booster on newly labelled rows
 - Log to DagsHub (MLflow)
+- (variable, horizon) grid trained in parallel processes (TRAIN_WORKERS); LightGBM threads split across them
+- Registry stage transitions and the DB `models` insert happen in the parent, one at a time
 """
 import os
+import multiprocessing
 import mlflow
 import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from sklearn.pipeline import Pipeline
 from sklearn.impute import SimpleImputer
 from mlflow import sklearn as ml_sklearn
 from sklearn.linear_model import LinearRegression
-from lightgbm import LGBMRegressor
+import numpy as np
 import pandas as pd
+from sklearn.metrics import mean_absolute_error, mean_squared_error
 from sqlalchemy import text
 from src.utils.db_utils import db_conn
 from src.config import CFG
-from src.model.features import build_features
-from src.model.evaluate import weekly_folds, evaluate_model
+from src.model.features import VENDORS, obs_feature_columns
+from src.model import feature_store
+from src.model.evaluate import backtest, prepare, rolling_folds
+from src.model.lgb_data import BoosterRegressor, binned_dataset
 from src.utils.logging_utils import get_logger
+from src.utils.time_utils import now_utc
 from mlflow.tracking import MlflowClient
 from sklearn import set_config
 set_config(transform_output="pandas")
 
 logger = get_logger(__name__)
 
-def _setup_mlflow():
+# Trees added per warm-started run; the periodic full retrain resets the ensemble size
+WARM_START_TREES = 30
+
+def _setup_mlflow(experiment_id: str | None = None) -> str | None:
+    """
+    Point MLflow at DagsHub and select the experiment, returning its id. Given an id (training
+    workers), the experiment is only looked up, so concurrent workers never race to create it.
+    """
     if not (CFG.DAGSHUB_USERNAME and CFG.DAGSHUB_TOKEN and CFG.PUBLIC_REPO_NAME):
         logger.warning("DagsHub credentials missing; MLflow will use local filesystem.")
-        return
+        return None
     os.environ["MLFLOW_TRACKING_USERNAME"] = CFG.DAGSHUB_USERNAME
     os.environ["MLFLOW_TRACKING_PASSWORD"] = CFG.DAGSHUB_TOKEN
     tracking_uri = f"https://dagshub.com/{CFG.DAGSHUB_USERNAME}/{CFG.PUBLIC_REPO_NAME}.mlflow"
     mlflow.set_tracking_uri(tracking_uri)
-    mlflow.set_experiment("weather-ensemble")
+    if experiment_id is not None:
+        mlflow.set_experiment(experiment_id=experiment_id)
+        return experiment_id
+    return mlflow.set_experiment("weather-ensemble").experiment_id
 
-def train_one(variable: str, horizon: int):
-    Xy = build_features(variable, horizon)
-    if Xy is None or Xy.empty:
-        logger.warning("No data for %s H+%d", variable, horizon)
-        return None
-        
-    # --- feature column selection ---
-    vendor_cols = [c for c in ("open_meteo","met_no","openweather","visual_crossing","weather_gov") if c in Xy.columns]
-    lag_cols = [c for c in Xy.columns if c.startswith("obs_lag_")]
-    feat = vendor_cols + lag_cols + ["hour","dow"]
+def _baseline(n_jobs: int | None = None) -> Pipeline:
+    return Pipeline([
+        ("imp", SimpleImputer(strategy="median")),
+        ("lr", LinearRegression()),
+    ])
 
-    import re
+def _previous_model(variable: str, horizon: int):
+    """Latest LightGBM model row for (variable, horizon) that warm starting can continue from."""
+    with db_conn() as conn:
+        return conn.execute(text("""
+            SELECT mlflow_run_id, trained_until, full_retrain_at, backtest_rmse
+            FROM models
+            WHERE variable = :v AND horizon_hours = :h AND algo = 'lightgbm'
+              AND trained_until IS NOT NULL AND full_retrain_at IS NOT NULL AND backtest_rmse IS NOT NULL
+            ORDER BY id DESC LIMIT 1
+        """), {"v": variable, "h": int(horizon)}).fetchone()
 
-    def _sort_lag_cols(cols):
-        def lag_key(c):
-            m = re.search(r"^obs_lag_(\d+)h?$", c)
-            return int(m.group(1)) if m else 10**9
-        return sorted(cols, key=lag_key)
+def _full_retrain_reason(prev) -> str | None:
+    """Why this run must train from scratch, or None when the previous booster can be continued."""
+    if CFG.FULL_RETRAIN_EVERY_DAYS <= 0:
+        return "warm start disabled"
+    if prev is None:
+        return "no previous LightGBM model"
+    if (now_utc().date() - pd.Timestamp(prev.full_retrain_at).tz_convert("UTC").date()).days >= CFG.FULL_RETRAIN_EVERY_DAYS:
+        return f"scheduled (every {CFG.FULL_RETRAIN_EVERY_DAYS} days)"
+    return None
 
-    lag_cols = _sort_lag_cols([c for c in Xy.columns if c.startswith("obs_lag_")])
-    feat = vendor_cols + lag_cols + ["hour", "dow"]
+def _continue_lgbm(old: BoosterRegressor, prep, n_jobs: int | None = None) -> BoosterRegressor:
+    """Boost WARM_START_TREES more trees from the previous booster on the newly labelled rows in `prep`."""
+    model = BoosterRegressor(WARM_START_TREES, n_jobs, init_model=old.booster_)
+    return model.fit(prep.frame(), prep.y)
 
-    # --- keep rows: must have target and at least ONE vendor signal ---
-    Xy = Xy[Xy["y"].notna()]
+def _training_rows(Xy: pd.DataFrame | None, variable: str, horizon: int, feat: list[str] | None = None):
+    """
+    Labelled rows with at least one vendor value as a prepared matrix, or None if there are none.
+    `feat` defaults to the vendor, observation and calendar columns present in Xy.
+    """
+    if Xy is None or Xy.empty:
+        return None
+    if feat is None:
+        feat = [c for c in VENDORS if c in Xy.columns] + obs_feature_columns(Xy.columns) + ["hour", "dow"]
+    vendor_cols = [c for c in feat if c in VENDORS]
     if not vendor_cols:
         logger.warning("No vendor columns present for %s H+%d", variable, horizon)
         return None
 
+    # --- keep rows: must have target and at least ONE vendor signal ---
+    Xy = Xy[Xy["y"].notna()]
     Xy = Xy.dropna(subset=vendor_cols, how="all")  # >= 1 vendor value
     if Xy.empty:
-        logger.warning("After vendor filter, no rows for %s H+%d", variable, horizon)
         return None
 
-    # Fill lag features if missing; rebuild calendar features if needed
-    for c in lag_cols:
-        if c in Xy.columns:
-             Xy[c] = Xy[c].fillna(Xy[c].median())
-
+    # Calendar features; gaps in lag features are left to each fold's imputer (no global medians)
     if "hour" not in Xy.columns or Xy["hour"].isna().any():
         Xy["hour"] = pd.to_datetime(Xy["valid_time"]).dt.hour
     if "dow" not in Xy.columns or Xy["dow"].isna().any():
         Xy["dow"] = pd.to_datetime(Xy["valid_time"]).dt.dayofweek
 
-    # --- build folds ---
-    folds = weekly_folds(Xy)
-    if not folds:
-        # time-based 80/20 fallback so we can train at least once
-        Xy = Xy.sort_values("valid_time")
-        split_idx = int(0.8 * len(Xy))
-        tr, va = Xy.iloc[:split_idx], Xy.iloc[split_idx:]
-        if len(tr) and len(va):
-            folds = [(tr, va)]
-        else:
-            logger.warning("No folds for %s H+%d", variable, horizon)
-            return None
-
-    # # features
-    # vendor_cols = [c for c in ("open_meteo","met_no","openweather","visual_crossing","weather_gov") if c in Xy.columns]
-    # lag_cols = [c for c in Xy.columns if c.startswith("obs_lag_")]
-    # feat = vendor_cols + lag_cols + ["hour","dow"]
-
-    # # Keep rows that have a target and at least ONE vendor signal
-    # Xy = Xy[Xy["y"].notna()]
-    # if not vendor_cols:
-    #     logger.warning("No vendor columns present for %s H+%d", variable, horizon)
-    #     return None
-    # Xy = Xy.dropna(subset=vendor_cols, how="all")  # require >=1 vendor column non-null
-    # if Xy.empty:
-    #     logger.warning("After vendor filter, no rows for %s H+%d", variable, horizon)
-    #     return None
-
-    # # Fill lag features (if missing) with median; rebuild hour/dow if missing
-    # for c in lag_cols:
-    #     if c in Xy.columns:
-    #         Xy[c] = Xy[c].fillna(Xy[c].median())
-
-    # if "hour" not in Xy.columns or Xy["hour"].isna().any():
-    #     Xy["hour"] = pd.to_datetime(Xy["valid_time"]).dt.hour
-    # if "dow" not in Xy.columns or Xy["dow"].isna().any():
-    #     Xy["dow"] = pd.to_datetime(Xy["valid_time"]).dt.dayofweek
-
-    # # Now build folds
-    # folds = weekly_folds(Xy)
-    # if not folds:
-    #     logger.warning("No folds for %s H+%d", variable, horizon)
-    #     return None
-
-    _setup_mlflow()
-    with mlflow.start_run(run_name=f"{variable}_H{horizon}"):
-        # Baseline
-        tr = pd.concat([f[0] for f in folds], ignore_index=True)
+    # --- one sorted float32 matrix; folds are row offsets into it ---
+    return prepare(Xy, feat)
 
-        from sklearn.impute import SimpleImputer
+def train_workers(n_tasks: int) -> int:
+    """Process count for the (variable, horizon) grid: TRAIN_WORKERS, or one per core when 0."""
+    workers = CFG.TRAIN_WORKERS or (os.cpu_count() or 1)
+    return max(1, min(workers, n_tasks))
 
-        imp = SimpleImputer(strategy="median").set_output(transform="pandas")
-        base = Pipeline([
-            ("imp", imp),
-            ("lr", LinearRegression())
-        ]).fit(tr[feat], tr["y"])
+def train_one(variable: str, horizon: int, Xy: pd.DataFrame | None = None, n_jobs: int | None = None,
+              register: bool = True, experiment_id: str | None = None):
+    # Rows labelled after this instant are left for the next run's warm start
+    data_until = now_utc()
+    _setup_mlflow(experiment_id)
+    prev = _previous_model(variable, horizon)
+    reason = _full_retrain_reason(prev)
+    if reason is None:
+        old = mlflow.sklearn.load_model(f"runs:/{prev.mlflow_run_id}/model")
+        if not isinstance(old, BoosterRegressor):
+            reason = "previous model is not a native LightGBM booster"
+        else:
+            # Rows whose label first arrived since the previous run, whatever their valid_time. Not
+            # updated_at: refresh() rebuilds (and re-stamps) rows the previous booster already fit
+            feat = list(old.feature_names_in_)
+            new = feature_store.load_features(variable, horizon, labelled_since=prev.trained_until)
+            if not new.empty and not set(feat) <= set(new.columns):
+                reason = "feature set changed"
+            else:
+                prep = _training_rows(new, variable, horizon, feat)
+                del new
+                if prep is None:
+                    logger.info("No newly labelled rows for %s H+%d; keeping run %s", variable, horizon, prev.mlflow_run_id)
+                    return None
+                # The current model's error on the new rows is out-of-sample; it doubles as the drift check
+                pred = old.predict(prep.frame())
+                rmse, mae = mean_squared_error(prep.y, pred) ** 0.5, mean_absolute_error(prep.y, pred)
+                if rmse > (1 + CFG.DRIFT_TOLERANCE) * prev.backtest_rmse:
+                    reason = f"drift (RMSE {rmse:.3f} on new rows vs backtest {prev.backtest_rmse:.3f})"
 
+    if reason is None:
+        model = _continue_lgbm(old, prep, n_jobs)
+        algo, mode = "lightgbm", "incremental"
+        dfm = pd.DataFrame([{"fold": 1, "mae": mae, "rmse": rmse, "n": len(prep.y)}])
+        backtest_rmse, full_retrain_at = prev.backtest_rmse, prev.full_retrain_at
+        logger.info("Warm-starting %s H+%d on %d newly labelled rows", variable, horizon, len(prep.y))
+    else:
+        prep = feature_store.load_prepared(variable, horizon) if Xy is None else _training_rows(Xy, variable, horizon)
+        Xy = None
+        if prep is None:
+            logger.warning("No labelled rows for %s H+%d", variable, horizon)
+            return None
+        feat = prep.features
+        logger.info("Full retrain for %s H+%d: %s", variable, horizon, reason)
+        folds = rolling_folds(prep.t)
+        if not folds:
+            logger.warning("No folds for %s H+%d", variable, horizon)
+            return None
+        # Out-of-sample backtest (refit per fold) for both models, then fit the served model on all rows
+        base_dfm, base_rmse, base_mae = backtest(prep, folds, _baseline, n_jobs)
         try:
-            ens = Pipeline([
-                ("imp", imp),
-                ("lgbm", LGBMRegressor(n_estimators=300, learning_rate=0.05, max_depth=-1, subsample=0.8)),
-            ])
-            ens.fit(tr[feat], tr["y"])
-            model = ens
+            # Bin once on the rows before the first fold; every fold and the final fit train on subsets of it
+            ds = binned_dataset(prep, folds[0][0])
+            lgbm = lambda n_jobs=None: BoosterRegressor(n_jobs=n_jobs, dataset=ds)
+            dfm, rmse, mae = backtest(prep, folds, lgbm, n_jobs)
+            model = lgbm(n_jobs).fit(prep.frame(), prep.y)
             algo = "lightgbm"
         except Exception:
-            model = base
+            logger.exception("LightGBM training failed for %s H+%d; falling back to the linear baseline", variable, horizon)
+            dfm, rmse, mae = base_dfm.copy(), base_rmse, base_mae
+            model = _baseline().fit(prep.frame(), prep.y)
             algo = "linear"
+        dfm["baseline_mae"] = base_dfm["mae"]
+        dfm["baseline_rmse"] = base_dfm["rmse"]
+        mode, backtest_rmse, full_retrain_at = "full", rmse, now_utc()
 
-        # base = Pipeline([
-        #     ("imp", SimpleImputer(strategy="median")),
-        #     ("lr", LinearRegression())
-        # ]).fit(tr[feat], tr["y"])
-
-        # try:
-        #     ens = Pipeline([
-        #     ("imp", SimpleImputer(strategy="median")),
-        #     ("lgbm", LGBMRegressor(n_estimators=300, learning_rate=0.05, max_depth=-1, subsample=0.8)),
-        # ])
-        #     ens.fit(tr[feat], tr["y"])
-        #     model = ens
-        #     algo = "lightgbm"
-        # except Exception:
-        #     model = base
-        #     algo = "linear"
-
-        dfm, rmse, mae = evaluate_model(model, folds, feat)
-        mlflow.log_params({"variable": variable, "horizon": horizon, "algo": algo})
+    with mlflow.start_run(run_name=f"{variable}_H{horizon}"):
+        mlflow.log_params({"variable": variable, "horizon": horizon, "algo": algo, "mode": mode, "folds": len(dfm)})
         mlflow.log_metric("rmse", rmse)
         mlflow.log_metric("mae", mae)
+        if mode == "full":
+            mlflow.log_metric("baseline_rmse", base_rmse)
+            mlflow.log_metric("baseline_mae", base_mae)
+        else:
+            mlflow.log_param("warm_start_from", prev.mlflow_run_id)
         with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as tmp:
             dfm.to_csv(tmp.name, index=False)
             tmp_path = tmp.name
@@ -176,10 +205,8 @@ def train_one(variable: str, horizon: int):
         run_id = mlflow.active_run().info.run_id
 
         from mlflow.models import infer_signature
-        tr = pd.concat([f[0] for f in folds], ignore_index=True)
-
-        signature = infer_signature(tr[feat], tr["y"])
-        input_example = tr[feat].head(5)
+        input_example = prep.frame(5)
+        signature = infer_signature(input_example, model.predict(input_example))
 
         mlflow.log_params({"features": ",".join(feat)})  # optional for traceability
         
@@ -189,41 +216,90 @@ def train_one(variable: str, horizon: int):
         mlflow.sklearn.log_model(
             sk_model=model,
             artifact_path="model",  # for correct artifact folder
-            registered_model_name=model_name,
             signature=signature,
             input_example=input_example,
         )
         logger.info("Trained %s H+%d: RMSE=%.3f MAE=%.3f (run_id=%s)", variable, horizon, rmse, mae, run_id)
 
-        # Promote to Production (archive previous)
-        client = MlflowClient()
-        latest_none = client.get_latest_versions(model_name, stages=["None"])
-        if latest_none:
-            mv = latest_none[0]
-            client.transition_model_version_stage(
-            name=model_name,
-            version=mv.version,
-            stage="Production",
-            archive_existing_versions=True,
-            )
-            logger.info("Promoted %s version %s to Production", model_name, mv.version)
-        else:
-            logger.warning("No latest 'None' version found to promote for %s", model_name)
-        
-        # Register the run in DB (per variable & horizon)
-        with db_conn() as conn:
-            conn.execute(text("""
-                INSERT INTO models (name, mlflow_run_id, is_champion)
-                VALUES (:n, :r, FALSE)
-            """), {"n": model_name, "r": run_id})
-        return {"variable": variable, "horizon": horizon, "rmse": rmse, "mae": mae, "run_id": run_id, "features": feat}
+    result = {"variable": variable, "horizon": horizon, "rmse": rmse, "mae": mae, "run_id": run_id,
+              "features": feat, "model_name": model_name, "algo": algo, "mode": mode,
+              "trained_until": data_until,
+              "full_retrain_at": full_retrain_at, "backtest_rmse": float(backtest_rmse)}
+    if register:
+        register_result(result)
+    return result
+
+def register_result(result: dict) -> None:
+    """
+    Register a trained run's model, move it to Production (archiving the previous version) and
+    record it in the DB registry. Runs in the parent only, so registry transitions never race.
+    """
+    _setup_mlflow()
+    model_name, run_id = result["model_name"], result["run_id"]
+    mv = mlflow.register_model(f"runs:/{run_id}/model", model_name)
+
+    # Promote to Production (archive previous)
+    client = MlflowClient()
+    client.transition_model_version_stage(
+        name=model_name,
+        version=mv.version,
+        stage="Production",
+        archive_existing_versions=True,
+    )
+    logger.info("Promoted %s version %s to Production", model_name, mv.version)
+
+    # Register the run in DB (per variable & horizon)
+    with db_conn() as conn:
+        conn.execute(text("""
+            INSERT INTO models (name, mlflow_run_id, is_champion, variable, horizon_hours, algo,
+                                trained_until, full_retrain_at, backtest_rmse)
+            VALUES (:n, :r, FALSE, :v, :h, :a, :tu, :fr, :br)
+        """), {"n": model_name, "r": run_id, "v": result["variable"], "h": int(result["horizon"]),
+               "a": result["algo"], "tu": result["trained_until"], "fr": result["full_retrain_at"],
+               "br": result["backtest_rmse"]})
+
+def _init_worker(threads: int, experiment_id: str | None) -> None:
+    # Cap native thread pools (OpenMP/BLAS) so workers x threads stays within the cores
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    _setup_mlflow(experiment_id)
+
+def _train_task(variable: str, horizon: int, threads: int, experiment_id: str | None) -> dict | None:
+    # Each worker reads its own matrix from the feature store and logs its own MLflow run
+    return train_one(variable, horizon, n_jobs=threads, register=False, experiment_id=experiment_id)
 
 def main():
     results = []
-    for var in CFG.VARIABLES:
-        for h in CFG.HORIZONS_HOURS:
+    feature_store.refresh()
+    grid = [(var, h) for var in CFG.VARIABLES for h in CFG.HORIZONS_HOURS]
+    workers = train_workers(len(grid))
+    if workers == 1:
+        for var, h in grid:
             r = train_one(var, h)
             if r: results.append(r)
+    else:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        logger.info("Training %d models on %d processes x %d LightGBM threads", len(grid), workers, threads)
+        # Create/look up the experiment once here; workers only select it by id
+        experiment_id = _setup_mlflow()
+        # spawn: workers must not inherit the parent's DB connections or MLflow state
+        ctx = multiprocessing.get_context("spawn")
+        done = {}
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(threads, experiment_id)) as pool:
+            futures = {pool.submit(_train_task, var, h, threads, experiment_id): (var, h) for var, h in grid}
+            for fut in as_completed(futures):
+                var, h = futures[fut]
+                try:
+                    done[(var, h)] = fut.result()
+                except Exception as e:
+                    logger.warning("Training %s H+%d failed: %s", var, h, e)
+        # Register in grid order so Production ends up the same as a sequential run
+        for key in grid:
+            r = done.get(key)
+            if r:
+                register_result(r)
+                results.append(r)
     if not results:
         logger.warning("No models trained")
 
@@ -1,8 +1,9 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 import pandas as pd
+from src.config import SOURCE_IDS, VARIABLE_IDS
 from src.utils.db_utils import fetch_df
-from src.verify.leaderboard import leaderboard
+from src.verify.leaderboard import error_summary, leaderboard
 
 app = FastAPI(title="Weather Forecast API", version="0.1.0")
 
@@ -18,13 +19,7 @@ def health():
 
 @app.get("/sources")
 def sources():
-    sql = """
-    SELECT source, variable, horizon_hours, avg(rmse) AS rmse, avg(mae) AS mae, avg(mape) AS mape
-    FROM errors
-    WHERE valid_time >= now() - interval '7 days'
-    GROUP BY source, variable, horizon_hours
-    """
-    df = fetch_df(sql)
+    df = error_summary(7)
     return {"data": df.to_dict(orient="records")}
 
 @app.get("/metrics")
@@ -36,12 +31,17 @@ def metrics():
 def predict(req: PredictRequest):
     # Serve our latest 'our_model' forecasts already in DB.
     sql = """
-    SELECT lat, lon, variable, horizon_hours, valid_time, value, unit
-    FROM forecasts
-    WHERE source='our_model' AND lat=:lat AND lon=:lon
-      AND variable = ANY(:variables) AND horizon_hours = ANY(:horizons)
-      AND valid_time >= now() AT TIME ZONE 'utc' - interval '6 hours'
+    SELECT l.lat, l.lon, v.name AS variable, f.horizon_hours, f.valid_time, f.value, v.unit
+    FROM forecasts f
+    JOIN locations l ON l.id = f.location_id
+    JOIN variables v ON v.id = f.variable_id
+    WHERE f.source_id = :source_id AND l.lat = :lat AND l.lon = :lon
+      AND f.variable_id = ANY(:variable_ids) AND f.horizon_hours = ANY(:horizons)
+      AND f.valid_time >= now() AT TIME ZONE 'utc' - interval '6 hours'
        """
-    df = fetch_df(sql, {"lat": req.lat, "lon": req.lon, "variables": req.variables, "horizons": req.horizons})
+    variable_ids = [VARIABLE_IDS[v] for v in req.variables if v in VARIABLE_IDS]
+    df = fetch_df(sql, {"source_id": SOURCE_IDS["our_model"], "lat": req.lat, "lon": req.lon,
+                        "variable_ids": variable_ids, "horizons": req.horizons})
     if df.empty:
         raise HTTPException(status_code=404, detail="No predictions available yet for requested parameters")
+    return {"data": df.to_dict(orient="records")}
@@ -1,22 +1,34 @@
 import gradio as gr
+import numpy as np
 import pandas as pd
 from datetime import timedelta
-from src.verify.leaderboard import leaderboard
-from src.utils.db_utils import fetch_df
+from src.verify.leaderboard import error_summary, leaderboard
+from src.utils.db_utils import iter_df
 
-def load_errors(days=7):
+def iter_daily_errors(days=7):
+    """
+    Per-day pooled RMSE/MAE per source, variable & horizon from the daily error rollup, with the
+    summed statistics (n, sum_sq_err, sum_abs_err) so coarser groupings can be pooled exactly.
+    Streamed in chunks; callers fold them into their own aggregate.
+    """
     sql = """
-    SELECT source, variable, horizon_hours, valid_time, mae, rmse, mape
-    FROM errors
-    WHERE valid_time >= now() - interval '7 days'
+    SELECT s.name AS source, v.name AS variable, d.horizon_hours, d.day,
+           sqrt(sum(d.sum_sq_err) / sum(d.n)) AS rmse, sum(d.sum_abs_err) / sum(d.n) AS mae,
+           sum(d.n) AS n, sum(d.sum_sq_err) AS sum_sq_err, sum(d.sum_abs_err) AS sum_abs_err
+    FROM error_stats_daily d
+    JOIN sources s ON s.id = d.source_id
+    JOIN variables v ON v.id = d.variable_id
+    WHERE d.day > (now() AT TIME ZONE 'UTC')::date - :days
+    GROUP BY s.name, v.name, d.horizon_hours, d.day
+    HAVING sum(d.n) > 0
     """
-    return fetch_df(sql)
+    return iter_df(sql, {"days": int(days)}, dtypes={"horizon_hours": "int16", "rmse": "float32", "mae": "float32"})
 
 def tab_verification():
-    df = load_errors()
+    df = error_summary(7)
     if df.empty:
         return gr.HTML("<p>No data yet. Please check back later.</p>")
-    piv = df.groupby(["variable","horizon_hours","source"]).agg({"rmse":"mean","mae":"mean"}).reset_index()
+    piv = df[["variable","horizon_hours","source","rmse","mae"]].sort_values(["variable","horizon_hours","source"])
     return piv
 
 def tab_leaderboard():
@@ -24,22 +36,28 @@ def tab_leaderboard():
     return lb
 
 def tab_our_vs_best():
-    df = load_errors()
+    df = error_summary(7)
     if df.empty: return df
-    best = leaderboard(7).rename(columns={"source":"best_source"})
-    merged = df.merge(best[["variable","horizon_hours","best_source"]], on=["variable","horizon_hours"], how="left")
-    our = merged[merged["source"]=="our_model"].rename(columns={"rmse":"rmse_our","mae":"mae_our"})
-    bestm = merged.merge(our[["variable","horizon_hours","rmse_our","mae_our"]], on=["variable","horizon_hours"], how="left")
-    bestm = bestm[bestm["source"]==bestm["best_source"]]
+    best = leaderboard(7)
+    our = df[df["source"]=="our_model"].rename(columns={"rmse":"rmse_our","mae":"mae_our"})
+    bestm = best.merge(our[["variable","horizon_hours","rmse_our","mae_our"]], on=["variable","horizon_hours"], how="left")
     bestm["rmse_diff"] = bestm["rmse_our"] - bestm["rmse"]
     bestm["mae_diff"] = bestm["mae_our"] - bestm["mae"]
     return bestm[["variable","horizon_hours","best_source","rmse","rmse_our","rmse_diff","mae","mae_our","mae_diff"]]
 
 def tab_drift():
-    df = load_errors()
-    if df.empty: return df
-    recent = df.groupby(["variable","source"]).resample("12H", on="valid_time").rmse.mean().reset_index()
-    return recent
+    # daily RMSE pooled over horizons from the summed statistics (RMSEs themselves don't average);
+    # sums fold chunk by chunk, so only the per-day totals are held
+    keys = ["variable","source","day"]
+    recent = None
+    for chunk in iter_daily_errors():
+        part = chunk.groupby(keys)[["n","sum_sq_err"]].sum()
+        recent = part if recent is None else recent.add(part, fill_value=0)
+    if recent is None:
+        return pd.DataFrame(columns=keys + ["rmse","n"])
+    recent = recent.reset_index().astype({"n": "int64"})
+    recent["rmse"] = np.sqrt(recent["sum_sq_err"] / recent["n"])
+    return recent[["variable","source","day","rmse","n"]]
 
 def app():
     with gr.Blocks(title="Weather Forecast Verification") as demo:
@@ -1,7 +1,11 @@
+import csv
+import io
 import os
-from typing import Iterable, Mapping, Sequence
+from typing import Iterable, Iterator, Mapping, Sequence
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy import types as sqltypes
 from sqlalchemy.engine import Engine
 from contextlib import contextmanager
 from src.config import CFG
@@ -10,6 +14,22 @@ from src.utils.logging_utils import get_logger
 logger = get_logger(__name__)
 
 _engine: Engine | None = None
+_column_types: dict[str, dict[str, sqltypes.TypeEngine]] = {}
+
+# Natural keys backing the unique indexes in schema.sql; upserts conflict on these
+NATURAL_KEYS = {
+    "forecasts": ("source_id", "location_id", "variable_id", "issue_time", "valid_time", "horizon_hours"),
+    "observations": ("source_id", "location_id", "variable_id", "obs_time"),
+    "errors": ("source_id", "variable_id", "valid_time", "horizon_hours"),
+    "error_stats": ("source_id", "variable_id", "horizon_hours", "location_id", "valid_time"),
+    "feature_store": ("feature_version", "variable_id", "horizon_hours", "location_id", "valid_time"),
+}
+
+# NULL marker for COPY ... CSV, so empty strings stay distinct from NULL
+COPY_NULL = r"\N"
+
+# Rows per chunk for server-side streaming reads
+READ_CHUNK_ROWS = 100_000
 
 def get_engine() -> Engine:
     global _engine
@@ -26,13 +46,186 @@ def db_conn():
     with eng.begin() as conn:
         yield conn
 
+def table_column_types(table: str) -> dict[str, sqltypes.TypeEngine]:
+    """Column name -> reflected SQLAlchemy type for a table (cached per process)."""
+    if table not in _column_types:
+        cols = inspect(get_engine()).get_columns(table)
+        _column_types[table] = {c["name"]: c["type"] for c in cols}
+    return _column_types[table]
+
+def _copy_frame(df: pd.DataFrame, table: str) -> pd.DataFrame:
+    """Coerce columns to text COPY accepts for the target column types."""
+    types = table_column_types(table)
+    out = pd.DataFrame(index=df.index)
+    for col in df.columns:
+        s = df[col]
+        sql_type = types.get(col)
+        if isinstance(sql_type, sqltypes.Integer) and s.dtype.kind == "f":
+            # floats holding integers (NaN-promoted) would render as '1.0'
+            s = s.round().astype("Int64")
+        elif s.dtype.kind == "M":
+            if s.dt.tz is None and getattr(sql_type, "timezone", False):
+                s = s.dt.tz_localize("UTC")  # naive timestamps are UTC by convention
+            s = s.dt.strftime("%Y-%m-%d %H:%M:%S.%f%z")
+        elif s.dtype.kind == "f":
+            s = s.where(np.isfinite(s), np.nan)
+        out[col] = s
+    return out
+
+def _copy_rows(cur, df: pd.DataFrame, target: str, types_from: str, chunksize: int = 100_000) -> None:
+    """COPY df into `target` (typed after table `types_from`) on an open psycopg2 cursor."""
+    cols = ", ".join(f'"{c}"' for c in df.columns)
+    sql = f"COPY {target} ({cols}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+    for start in range(0, len(df), chunksize):
+        buf = io.StringIO()
+        _copy_frame(df.iloc[start:start + chunksize], types_from).to_csv(
+            buf, index=False, header=False, na_rep=COPY_NULL, quoting=csv.QUOTE_MINIMAL
+        )
+        buf.seek(0)
+        cur.copy_expert(sql, buf)
+
+def copy_dataframe(df: pd.DataFrame, table: str, chunksize: int = 100_000) -> int:
+    """Stream a frame into `table` with COPY FROM STDIN (CSV) over the raw psycopg2 connection."""
+    raw = get_engine().raw_connection()
+    try:
+        with raw.cursor() as cur:
+            _copy_rows(cur, df, table, table, chunksize)
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+    return len(df)
+
 def insert_dataframe(df: pd.DataFrame, table: str, dtype: Mapping | None = None, chunksize: int = 1000):
     if df.empty:
         logger.info("No rows to insert into %s", table)
         return 0
-    df.to_sql(table, get_engine(), if_exists="append", index=False, dtype=dtype, chunksize=chunksize, method="multi")
+    if get_engine().dialect.name == "postgresql" and dtype is None:
+        copy_dataframe(df, table)
+    else:
+        df.to_sql(table, get_engine(), if_exists="append", index=False, dtype=dtype, chunksize=chunksize, method="multi")
     logger.info("Inserted %d rows into %s", len(df), table)
     return len(df)
 
+def _upsert_via_stage(table: str, columns: Sequence[str], load, keys: Sequence[str] | None, update: bool,
+                      merge: Mapping[str, str] | None = None) -> int:
+    """
+    Create a temp staging table shaped like `table`, fill it with load(cur, stage), then INSERT ... ON CONFLICT.
+    `merge` maps columns to SQL expressions used instead of EXCLUDED.<column> when updating.
+    """
+    keys = list(keys or NATURAL_KEYS[table])
+    cols = [f'"{c}"' for c in columns]
+    key_sql = ", ".join(f'"{k}"' for k in keys)
+    updates = [c for c in columns if c not in keys]
+    merge = merge or {}
+    if update and updates:
+        sets = [f'"{c}" = ' + merge.get(c, f'EXCLUDED."{c}"') for c in updates]
+        conflict = "DO UPDATE SET " + ", ".join(sets)
+    else:
+        conflict = "DO NOTHING"
+    stage = f"_stage_{table}"
+    raw = get_engine().raw_connection()
+    try:
+        with raw.cursor() as cur:
+            cur.execute(f"CREATE TEMP TABLE {stage} ON COMMIT DROP AS SELECT {', '.join(cols)} FROM {table} WITH NO DATA")
+            load(cur, stage)
+            cur.execute(
+                f"INSERT INTO {table} ({', '.join(cols)}) "
+                f"SELECT DISTINCT ON ({key_sql}) {', '.join(cols)} FROM {stage} "
+                f"ON CONFLICT ({key_sql}) {conflict}"
+            )
+            n = cur.rowcount
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+    return n
+
+def upsert_dataframe(df: pd.DataFrame, table: str, keys: Sequence[str] | None = None, update: bool = True) -> int:
+    """
+    Idempotent load: COPY into a temp staging table, then INSERT ... ON CONFLICT on the natural key.
+    Duplicate keys within the frame collapse to one row; existing rows are updated (or kept when update=False).
+    """
+    if df.empty:
+        logger.info("No rows to upsert into %s", table)
+        return 0
+    if get_engine().dialect.name != "postgresql":
+        logger.warning("Upsert needs PostgreSQL; appending to %s instead", table)
+        return insert_dataframe(df, table)
+    n = _upsert_via_stage(table, list(df.columns), lambda cur, stage: _copy_rows(cur, df, stage, table), keys, update)
+    logger.info("Upserted %d of %d rows into %s", n, len(df), table)
+    return n
+
+# COPY ... (FORMAT binary) framing: signature, flags, header extension length / end-of-data marker
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + b"\x00\x00\x00\x00" + b"\x00\x00\x00\x00"
+PGCOPY_TRAILER = b"\xff\xff"
+# Timestamps in COPY binary are microseconds since 2000-01-01 UTC
+PG_EPOCH_US = 946_684_800_000_000
+
+def upsert_binary(blocks: Sequence[np.ndarray], columns: Sequence[str], table: str,
+                  keys: Sequence[str] | None = None, update: bool = True, merge: Mapping[str, str] | None = None) -> int:
+    """
+    upsert_dataframe for pre-encoded rows: `blocks` are numpy record arrays laid out as COPY BINARY
+    tuples (field count, then length-prefixed big-endian values in `columns` order). Skips all
+    per-cell text formatting, which matters for wide numeric rows such as feature vectors.
+    """
+    rows = sum(len(b) for b in blocks)
+    if not rows:
+        logger.info("No rows to upsert into %s", table)
+        return 0
+    cols = ", ".join(f'"{c}"' for c in columns)
+
+    def load(cur, stage):
+        buf = io.BytesIO()
+        buf.write(PGCOPY_HEADER)
+        for b in blocks:
+            buf.write(b.tobytes())
+        buf.write(PGCOPY_TRAILER)
+        buf.seek(0)
+        cur.copy_expert(f"COPY {stage} ({cols}) FROM STDIN WITH (FORMAT binary)", buf)
+
+    n = _upsert_via_stage(table, list(columns), load, keys, update, merge)
+    logger.info("Upserted %d of %d rows into %s", n, rows, table)
+    return n
+
+def get_watermark(name: str):
+    """Stored high-water mark for an incremental job, or None on first run."""
+    with db_conn() as conn:
+        row = conn.execute(text("SELECT value FROM etl_watermarks WHERE name = :n"), {"n": name}).fetchone()
+    return row[0] if row else None
+
+def set_watermark(name: str, value) -> None:
+    with db_conn() as conn:
+        conn.execute(text("""
+            INSERT INTO etl_watermarks (name, value) VALUES (:n, :v)
+            ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value, updated_at = now()
+        """), {"n": name, "v": value})
+
 def fetch_df(sql: str, params: Mapping | None = None) -> pd.DataFrame:
     return pd.read_sql(text(sql), con=get_engine(), params=params or {})
+
+def iter_df(sql: str, params: Mapping | None = None, chunksize: int = READ_CHUNK_ROWS,
+            dtypes: Mapping[str, str] | None = None) -> Iterator[pd.DataFrame]:
+    """
+    Stream a query as DataFrame chunks of up to `chunksize` rows over a server-side cursor,
+    so only one chunk is held client-side. `dtypes` (e.g. {"value": "float32"}) is applied
+    to every chunk to keep them compact.
+    """
+    with get_engine().connect() as conn:
+        conn = conn.execution_options(stream_results=True, yield_per=chunksize)
+        for chunk in pd.read_sql(text(sql), con=conn, params=params or {}, chunksize=chunksize):
+            yield chunk.astype(dtypes) if dtypes else chunk
+
+def fetch_df_chunked(sql: str, params: Mapping | None = None, chunksize: int = READ_CHUNK_ROWS,
+                     dtypes: Mapping[str, str] | None = None) -> pd.DataFrame:
+    """
+    fetch_df over iter_df: same result, but typed chunk by chunk instead of via one object-typed buffer.
+    Only the dtypes improve: the whole result is still held (briefly twice, during the concat), so
+    callers that can work per chunk should consume iter_df directly.
+    """
+    chunks = list(iter_df(sql, params, chunksize, dtypes))
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
@@ -0,0 +1,77 @@
+"""
+Dimension keys for the fact tables.
+Locations get stable integer ids from the `locations` table (upserted on (lat, lon));
+sources and variables use the fixed smallint codes in SOURCE_IDS / VARIABLE_IDS.
+"""
+import threading
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from src.config import SOURCE_IDS, VARIABLE_IDS
+from src.utils.db_utils import db_conn
+
+# Text columns of provider/ETL frames that the fact tables store only as dimension ids
+TEXT_COLUMNS = ["source", "variable", "lat", "lon", "unit"]
+
+# (lat, lon) -> locations.id; ids never change once assigned, so this lives for the process
+_location_ids: dict[tuple[float, float], int] = {}
+_lock = threading.Lock()
+
+def resolve_location_ids(locations: list[dict], update_names: bool = False) -> dict[tuple[float, float], int]:
+    """
+    Upsert locations (dicts with lat, lon and optional name) and return (lat, lon) -> id.
+    Unknown coordinates are inserted with a "lat,lon" name unless one is given; update_names
+    overwrites stored names with the given ones (used by the seeding script).
+    """
+    coords = {(float(loc["lat"]), float(loc["lon"])): loc.get("name") for loc in locations}
+    with _lock:
+        missing = {c: n for c, n in coords.items() if update_names or c not in _location_ids}
+    if missing:
+        conflict = "DO UPDATE SET name = EXCLUDED.name" if update_names else "DO NOTHING"
+        lats = [c[0] for c in missing]
+        lons = [c[1] for c in missing]
+        names = [n or f"{c[0]},{c[1]}" for c, n in missing.items()]
+        with db_conn() as conn:
+            conn.execute(text(f"""
+                INSERT INTO locations (name, lat, lon)
+                SELECT * FROM unnest(CAST(:names AS TEXT[]), CAST(:lats AS FLOAT8[]), CAST(:lons AS FLOAT8[]))
+                ON CONFLICT (lat, lon) {conflict}
+            """), {"names": names, "lats": lats, "lons": lons})
+            rows = conn.execute(text("""
+                SELECT l.lat, l.lon, l.id FROM locations l
+                JOIN unnest(CAST(:lats AS FLOAT8[]), CAST(:lons AS FLOAT8[])) AS c(lat, lon)
+                  ON l.lat = c.lat AND l.lon = c.lon
+            """), {"lats": lats, "lons": lons}).fetchall()
+        with _lock:
+            _location_ids.update({(float(lat), float(lon)): int(i) for lat, lon, i in rows})
+    with _lock:
+        return {c: _location_ids[c] for c in coords}
+
+def _codes(values: pd.Series, codes: dict[str, int], what: str) -> np.ndarray:
+    out = values.map(codes)
+    if out.isna().any():
+        unknown = sorted(values[out.isna()].unique())
+        raise ValueError(f"Unknown {what}: {unknown}")
+    return out.to_numpy(dtype=np.int16)
+
+def attach_dimension_ids(df: pd.DataFrame, location_ids: dict[tuple[float, float], int] | None = None) -> pd.DataFrame:
+    """
+    Add source_id / variable_id (and location_id when the frame has lat/lon but no ids yet) to a fact frame
+    and drop the text columns they replace. Coordinates missing from location_ids are resolved (and
+    registered) on the fly.
+    """
+    if df.empty:
+        return df
+    df = df.copy()
+    if "source" in df.columns:
+        df["source_id"] = _codes(df["source"], SOURCE_IDS, "source")
+    if "variable" in df.columns:
+        df["variable_id"] = _codes(df["variable"], VARIABLE_IDS, "variable")
+    if "location_id" not in df.columns and {"lat", "lon"} <= set(df.columns):
+        coords = pd.MultiIndex.from_arrays([df["lat"].astype(float), df["lon"].astype(float)])
+        ids = dict(location_ids or {})
+        new = [c for c in coords.unique() if c not in ids]
+        if new:
+            ids.update(resolve_location_ids([{"lat": lat, "lon": lon} for lat, lon in new]))
+        df["location_id"] = pd.Series(ids).reindex(coords).to_numpy(dtype=np.int64)
+    return df.drop(columns=[c for c in TEXT_COLUMNS if c in df.columns])
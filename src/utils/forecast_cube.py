@@ -0,0 +1,332 @@
+"""
+Dense on-disk forecast cube per variable: float32 memmap of shape (time, location, source, horizon).
+time is hourly from axes["t0"]; locations are locations.id values, sources are SOURCES and horizons
+are HORIZONS_HOURS. A cell holds the forecast whose lead time is closest to the horizon (within ±1h,
+latest issue on ties), the same selection the feature builder uses; a parallel int8 memmap keeps the
+chosen lead-time offset so incremental updates can apply that rule.
+Layout: <FORECAST_CUBE_DIR>/<variable>/axes.json plus values.<gen>.f32 / offsets.<gen>.i1.
+axes.json names the current generation and is replaced last, so readers always see a
+consistent pair. Slicing with scalars/ranges returns zero-copy views.
+axes["synced_until"] is the forecasts.created_at watermark the cube has folded in: sync() catches
+up from there (or rebuilds a missing cube), so a cube restored from an older cache is still exact.
+The feature builder syncs and slices it; workflows persist FORECAST_CUBE_DIR with actions/cache.
+Run `python -m src.utils.forecast_cube [--rebuild]` to sync (or rebuild) every variable.
+"""
+import fcntl
+import json
+import os
+import shutil
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from src.config import CFG, SOURCES, SOURCE_IDS, VARIABLE_IDS
+from src.utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+EMPTY = 127                 # offsets value for an empty cell
+TOLERANCE_HOURS = 1         # lead time may differ from the horizon by this much
+TIME_CHUNK_HOURS = 24 * 32  # time axis grows in chunks to keep resizes rare
+# Re-scan this much before the watermark: rows committed late can carry an earlier created_at
+WATERMARK_OVERLAP = timedelta(hours=1)
+
+def _epoch_hours(values) -> np.ndarray:
+    idx = pd.DatetimeIndex(pd.to_datetime(values, utc=True)).tz_convert("UTC").tz_localize(None)
+    return idx.to_numpy().astype("datetime64[h]").astype(np.int64)
+
+class ForecastCube:
+    def __init__(self, variable: str, root: str | None = None):
+        self.variable = variable
+        self.path = os.path.join(root or CFG.FORECAST_CUBE_DIR, variable)
+        self.axes: dict | None = None
+        self.values: np.memmap | None = None
+        self.offsets: np.memmap | None = None
+        self._open()
+
+    @property
+    def exists(self) -> bool:
+        return self.axes is not None
+
+    @property
+    def shape(self) -> tuple[int, int, int, int]:
+        a = self.axes
+        return (a["n_time"], len(a["locations"]), len(a["sources"]), len(a["horizons"]))
+
+    def _file(self, kind: str, gen: int) -> str:
+        return os.path.join(self.path, f"{kind}.{gen}.{'f32' if kind == 'values' else 'i1'}")
+
+    def _open(self) -> None:
+        try:
+            with open(os.path.join(self.path, "axes.json")) as f:
+                self.axes = json.load(f)
+        except FileNotFoundError:
+            self.axes = self.values = self.offsets = None
+            return
+        gen = self.axes["gen"]
+        self.values = np.memmap(self._file("values", gen), dtype=np.float32, mode="r+", shape=self.shape)
+        self.offsets = np.memmap(self._file("offsets", gen), dtype=np.int8, mode="r+", shape=self.shape)
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._open()  # another process may have resized meanwhile
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # --- layout -------------------------------------------------------------
+
+    def _relayout(self, t0: int, n_time: int, locations: list[int]) -> None:
+        """Write a new generation covering [t0, t0 + n_time) x locations and copy existing cells over."""
+        old = self.axes
+        gen = old["gen"] + 1 if old else 0
+        shape = (n_time, len(locations), len(SOURCES), len(CFG.HORIZONS_HOURS) if not old else len(old["horizons"]))
+        values = np.memmap(self._file("values", gen), dtype=np.float32, mode="w+", shape=shape)
+        offsets = np.memmap(self._file("offsets", gen), dtype=np.int8, mode="w+", shape=shape)
+        values[:] = np.nan
+        offsets[:] = EMPTY
+        if old:
+            dt = old["t0"] - t0
+            n_old_loc = len(old["locations"])  # locations are only ever appended
+            values[dt:dt + old["n_time"], :n_old_loc] = self.values
+            offsets[dt:dt + old["n_time"], :n_old_loc] = self.offsets
+        values.flush()
+        offsets.flush()
+        axes = {
+            "gen": gen,
+            "variable": self.variable,
+            "t0": int(t0),
+            "n_time": int(n_time),
+            "locations": [int(x) for x in locations],
+            "sources": list(old["sources"]) if old else list(SOURCES),
+            "horizons": list(old["horizons"]) if old else sorted(int(h) for h in CFG.HORIZONS_HOURS),
+            "tolerance_hours": TOLERANCE_HOURS,
+            "synced_until": old.get("synced_until") if old else None,
+        }
+        self._write_axes(axes)
+        if old:
+            for kind in ("values", "offsets"):
+                try:
+                    os.remove(self._file(kind, old["gen"]))
+                except OSError:
+                    pass
+        self._open()
+
+    def _write_axes(self, axes: dict) -> None:
+        tmp = os.path.join(self.path, "axes.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(axes, f)
+        os.replace(tmp, os.path.join(self.path, "axes.json"))
+
+    def mark_synced(self, until: datetime) -> None:
+        """Record the forecasts.created_at watermark folded into the cube."""
+        with self._locked():
+            if self.axes is not None:
+                self._write_axes({**self.axes, "synced_until": pd.Timestamp(until).isoformat()})
+                self._open()
+
+    def _ensure(self, h_min: int, h_max: int, locations) -> None:
+        """Grow the time and/or location axes so [h_min, h_max] x locations fits."""
+        new_locs = [int(x) for x in pd.unique(np.asarray(locations))]
+        if self.axes is None:
+            t0 = h_min - h_min % TIME_CHUNK_HOURS
+            n = (h_max - t0) // TIME_CHUNK_HOURS * TIME_CHUNK_HOURS + TIME_CHUNK_HOURS
+            self._relayout(t0, n, sorted(new_locs))
+            return
+        a = self.axes
+        known = set(a["locations"])
+        missing = [x for x in new_locs if x not in known]
+        t0, end = a["t0"], a["t0"] + a["n_time"]
+        if h_min >= t0 and h_max < end and not missing:
+            return
+        if h_min < t0:
+            t0 -= -(-(t0 - h_min) // TIME_CHUNK_HOURS) * TIME_CHUNK_HOURS
+        if h_max >= end:
+            end += -(-(h_max + 1 - end) // TIME_CHUNK_HOURS) * TIME_CHUNK_HOURS
+        self._relayout(t0, end - t0, a["locations"] + sorted(missing))
+
+    # --- writes ------------------------------------------------------------
+
+    def update(self, df: pd.DataFrame) -> int:
+        """
+        Merge long-format forecast rows (location_id, source, valid_time, horizon_hours, value) into
+        the cube, keeping the closest-lead forecast per cell. Returns the number of cells written.
+        """
+        if df.empty:
+            return 0
+        with self._locked():
+            sources = self.axes["sources"] if self.axes else list(SOURCES)
+            horizons = np.array(self.axes["horizons"] if self.axes else sorted(CFG.HORIZONS_HOURS), dtype=np.int64)
+            s_idx = pd.Index(sources).get_indexer(df["source"])
+            keep = s_idx >= 0
+            if not keep.any():
+                return 0
+            df, s_idx = df[keep], s_idx[keep]
+            lead = df["horizon_hours"].to_numpy(dtype=np.int64)
+            # a row can serve every configured horizon within the tolerance
+            rows, hs, offs = [], [], []
+            for off in range(-TOLERANCE_HOURS, TOLERANCE_HOURS + 1):
+                pos = np.searchsorted(horizons, lead - off)
+                pos_c = np.minimum(pos, len(horizons) - 1)
+                hit = horizons[pos_c] == lead - off
+                rows.append(np.flatnonzero(hit))
+                hs.append(pos_c[hit])
+                offs.append(np.full(hit.sum(), off, dtype=np.int64))
+            rows, h_idx, off = np.concatenate(rows), np.concatenate(hs), np.concatenate(offs)
+            if not len(rows):
+                return 0
+            hours = _epoch_hours(df["valid_time"])[rows]
+            locs = df["location_id"].to_numpy(dtype=np.int64)[rows]
+            self._ensure(int(hours.min()), int(hours.max()), locs)
+
+            a = self.axes
+            t_idx = hours - a["t0"]
+            l_idx = pd.Index(a["locations"]).get_indexer(locs)
+            cells = np.ravel_multi_index((t_idx, l_idx, s_idx[rows], h_idx), self.shape)
+            # rank: closest lead first, then the smaller lead (later issue)
+            rank = np.abs(off) * (2 * TOLERANCE_HOURS + 1) + (off + TOLERANCE_HOURS)
+            order = np.lexsort((rank, cells))
+            cells, rank, off = cells[order], rank[order], off[order]
+            vals = df["value"].to_numpy(dtype=np.float32)[rows][order]
+            first = np.concatenate(([True], cells[1:] != cells[:-1]))
+            cells, rank, off, vals = cells[first], rank[first], off[first], vals[first]
+
+            flat_off = self.offsets.reshape(-1)
+            cur = flat_off[cells].astype(np.int64)
+            cur_rank = np.where(cur == EMPTY, np.iinfo(np.int64).max,
+                                np.abs(cur) * (2 * TOLERANCE_HOURS + 1) + (cur + TOLERANCE_HOURS))
+            win = rank <= cur_rank  # equal rank is the same issue: take the newer value
+            self.values.reshape(-1)[cells[win]] = vals[win]
+            flat_off[cells[win]] = off[win].astype(np.int8)
+            self.values.flush()
+            self.offsets.flush()
+            return int(win.sum())
+
+    # --- reads -------------------------------------------------------------
+
+    def times(self, start: int = 0, stop: int | None = None) -> pd.DatetimeIndex:
+        stop = self.axes["n_time"] if stop is None else stop
+        hours = np.arange(self.axes["t0"] + start, self.axes["t0"] + stop).astype("datetime64[h]")
+        # microseconds, the unit read_sql gives timestamptz columns, so frames from both merge
+        return pd.DatetimeIndex(hours).tz_localize("UTC").as_unit("us")
+
+    def _time_slice(self, start, end) -> slice:
+        t0, n = self.axes["t0"], self.axes["n_time"]
+        lo = 0 if start is None else int(np.clip(_epoch_hours([start])[0] - t0, 0, n))
+        hi = n if end is None else int(np.clip(_epoch_hours([end])[0] - t0 + 1, 0, n))
+        return slice(lo, max(lo, hi))
+
+    def slice(self, location: int | None = None, source: str | None = None, horizon: int | None = None,
+              start: datetime | None = None, end: datetime | None = None) -> tuple[np.ndarray, pd.DatetimeIndex]:
+        """
+        View of the cube: scalar location/source/horizon drop that axis, None keeps it whole;
+        start/end (inclusive) bound the time axis. Returns (view, valid_time index of axis 0).
+        E.g. cube.slice(location=durban_id, horizon=24, start=now - 30 days) -> (time, source) view.
+        """
+        if not self.exists:
+            raise FileNotFoundError(f"No forecast cube for {self.variable} under {self.path}")
+        a = self.axes
+        t = self._time_slice(start, end)
+        idx = (
+            t,
+            slice(None) if location is None else a["locations"].index(int(location)),
+            slice(None) if source is None else a["sources"].index(source),
+            slice(None) if horizon is None else a["horizons"].index(int(horizon)),
+        )
+        return self.values[idx], self.times(t.start, t.stop)
+
+    def vendor_frame(self, horizon: int, start: datetime | None = None, end: datetime | None = None,
+                     sources: list[str] | None = None) -> pd.DataFrame:
+        """get_vendor_matrix-shaped frame (location_id, valid_time, <source>...) for one horizon."""
+        view, times = self.slice(horizon=horizon, start=start, end=end)  # (time, location, source)
+        a = self.axes
+        cols = [s for s in (sources or a["sources"]) if s in a["sources"]]
+        sel = view[:, :, [a["sources"].index(s) for s in cols]]
+        nt, nl = sel.shape[:2]
+        df = pd.DataFrame(sel.reshape(nt * nl, len(cols)), columns=cols)
+        df.insert(0, "valid_time", times.repeat(nl))
+        df.insert(0, "location_id", np.tile(np.asarray(a["locations"], dtype=np.int32), nt))
+        df = df[df[cols].notna().any(axis=1)]
+        return df.dropna(axis=1, how="all").reset_index(drop=True)
+
+CUBE_SQL = """
+SELECT f.location_id, s.name AS source, f.valid_time, f.horizon_hours, f.value
+FROM forecasts f
+JOIN sources s ON s.id = f.source_id
+WHERE f.variable_id = :vid AND f.source_id = ANY(:sids)
+  AND f.horizon_hours BETWEEN :hmin AND :hmax
+"""
+CUBE_DTYPES = {"location_id": "int32", "horizon_hours": "int32", "value": "float32"}
+
+def _cube_params(variable: str, horizons: list[int]) -> dict:
+    return {
+        "vid": VARIABLE_IDS[variable],
+        "sids": [SOURCE_IDS[s] for s in SOURCES],
+        "hmin": min(horizons) - TOLERANCE_HOURS,
+        "hmax": max(horizons) + TOLERANCE_HOURS,
+    }
+
+def rebuild(variable: str, root: str | None = None) -> ForecastCube:
+    """Recreate a variable's cube from the forecasts table, streaming rows within the horizon tolerance."""
+    from src.utils.db_utils import fetch_df, iter_df  # keeps the module importable without a database
+    path = os.path.join(root or CFG.FORECAST_CUBE_DIR, variable)
+    shutil.rmtree(path, ignore_errors=True)
+    cube = ForecastCube(variable, root)
+    params = _cube_params(variable, CFG.HORIZONS_HOURS)
+    # Size the axes up front so streaming chunks never trigger a relayout
+    bounds = fetch_df(
+        "SELECT min(valid_time) AS lo, max(valid_time) AS hi, max(created_at) AS until FROM forecasts WHERE variable_id = :vid",
+        {"vid": params["vid"]},
+    )
+    if bounds.empty or pd.isna(bounds.loc[0, "lo"]):
+        logger.info("No %s forecasts; nothing to rebuild", variable)
+        return cube
+    locations = fetch_df("SELECT id FROM locations ORDER BY id")["id"].to_numpy()
+    with cube._locked():
+        cube._ensure(int(_epoch_hours([bounds.loc[0, "lo"]])[0]), int(_epoch_hours([bounds.loc[0, "hi"]])[0]), locations)
+    cells = 0
+    for chunk in iter_df(CUBE_SQL, params, dtypes=CUBE_DTYPES):
+        cells += cube.update(chunk)
+    cube.mark_synced(bounds.loc[0, "until"])
+    logger.info("Rebuilt forecast cube %s: %d cells, shape %s", variable, cells, cube.shape if cube.exists else None)
+    return cube
+
+def sync(variable: str, root: str | None = None) -> ForecastCube:
+    """
+    Bring a variable's cube up to date with the forecasts table: fold in rows created since its
+    synced_until watermark, or rebuild when it is missing or laid out for other horizons.
+    """
+    from src.utils.db_utils import fetch_df, iter_df
+    cube = ForecastCube(variable, root)
+    if not cube.exists or cube.axes.get("synced_until") is None \
+            or sorted(cube.axes["horizons"]) != sorted(int(h) for h in CFG.HORIZONS_HOURS):
+        return rebuild(variable, root)
+    since = pd.Timestamp(cube.axes["synced_until"])
+    until = fetch_df("SELECT max(created_at) AS until FROM forecasts WHERE variable_id = :vid",
+                     {"vid": VARIABLE_IDS[variable]}).loc[0, "until"]
+    if pd.isna(until) or pd.Timestamp(until) <= since:
+        return cube
+    sql = CUBE_SQL + "  AND f.created_at > :since AND f.created_at <= :until\n"
+    params = {**_cube_params(variable, cube.axes["horizons"]), "since": (since - WATERMARK_OVERLAP).to_pydatetime(),
+              "until": pd.Timestamp(until).to_pydatetime()}
+    cells = 0
+    for chunk in iter_df(sql, params, dtypes=CUBE_DTYPES):
+        cells += cube.update(chunk)
+    cube.mark_synced(until)
+    logger.info("Synced forecast cube %s: %d cells since %s", variable, cells, since)
+    return cube
+
+def main():
+    for variable in CFG.VARIABLES:
+        if "--rebuild" in sys.argv[1:]:
+            rebuild(variable)
+        else:
+            sync(variable)
+
+if __name__ == "__main__":
+    main()
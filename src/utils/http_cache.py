@@ -0,0 +1,181 @@
+"""
+On-disk HTTP response cache.
+Bodies are stored compressed (zstd when installed, else zlib) next to a small SQLite index of
+key -> (expiry, size, validators, last access). The store is bounded by a byte budget and
+evicts least-recently-used entries once it is exceeded; a running byte total (seeded from the
+index on open) decides when, so a put does not re-sum the index.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from glob import glob
+from typing import Any, Optional
+from src.utils.logging_utils import get_logger
+
+try:
+    import zstandard
+except ImportError:  # listed in requirements.txt; zlib keeps the cache working without it
+    zstandard = None
+
+logger = get_logger(__name__)
+
+# Params/headers that carry credentials or do not change the response body are left out of the key
+SECRET_PARAMS = {"appid", "key", "apikey", "api_key", "token", "access_token"}
+VARY_HEADERS = {"accept", "accept-language"}
+# Eviction trims the store to this fraction of the budget, so it runs once per ~10% of writes, not per put
+EVICT_TO = 0.9
+
+def cache_key(url: str, params: Optional[dict], headers: Optional[dict]) -> str:
+    """Stable key for a request with secrets and non-varying headers removed."""
+    p = {k: str(v) for k, v in (params or {}).items() if k.lower() not in SECRET_PARAMS}
+    h = {k.lower(): str(v) for k, v in (headers or {}).items() if k.lower() in VARY_HEADERS}
+    s = url + "|" + json.dumps(p, sort_keys=True) + "|" + json.dumps(h, sort_keys=True)
+    return hashlib.sha256(s.encode()).hexdigest()
+
+@dataclass
+class CacheEntry:
+    key: str
+    expires: float
+    size: int
+    etag: Optional[str]
+    last_modified: Optional[str]
+    codec: str
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() < self.expires
+
+class HttpCache:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite"), timeout=30, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+              key TEXT PRIMARY KEY,
+              expires REAL NOT NULL,
+              size INTEGER NOT NULL,
+              etag TEXT,
+              last_modified TEXT,
+              codec TEXT NOT NULL,
+              last_access REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self._db.commit()
+        self._total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        self._purge_legacy()
+
+    def _purge_legacy(self) -> None:
+        # Uncompressed one-file-per-key entries from the previous cache layout
+        for path in glob(os.path.join(self.root, "*.json")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _body_path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.z")
+
+    def lookup(self, key: str) -> Optional[CacheEntry]:
+        """Index-only lookup; the body is read separately via load()."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT key, expires, size, etag, last_modified, codec FROM entries WHERE key=?", (key,)
+            ).fetchone()
+        return CacheEntry(*row) if row else None
+
+    def load(self, entry: CacheEntry) -> Optional[Any]:
+        try:
+            with open(self._body_path(entry.key), "rb") as f:
+                raw = f.read()
+            if entry.codec == "zstd":
+                if zstandard is None:
+                    return None
+                raw = zstandard.ZstdDecompressor().decompress(raw)
+            else:
+                raw = zlib.decompress(raw)
+            body = json.loads(raw)
+        except Exception:
+            self.delete(entry.key)
+            return None
+        with self._lock:
+            self._db.execute("UPDATE entries SET last_access=? WHERE key=?", (time.time(), entry.key))
+            self._db.commit()
+        return body
+
+    def put(self, key: str, body: Any, expires: float, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        raw = json.dumps(body, separators=(",", ":")).encode()
+        if zstandard is not None:
+            codec, blob = "zstd", zstandard.ZstdCompressor(level=3).compress(raw)
+        else:
+            codec, blob = "zlib", zlib.compress(raw, 6)
+        path = self._body_path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
+        with self._lock:
+            old = self._db.execute("SELECT size FROM entries WHERE key=?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, expires, size, etag, last_modified, codec, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, expires, len(blob), etag, last_modified, codec, time.time()),
+            )
+            self._db.commit()
+            self._total += len(blob) - (old[0] if old else 0)
+            over = self._total > self.max_bytes
+        if over:
+            self._evict()
+
+    def touch(self, key: str, expires: float) -> None:
+        """Extend an entry's expiry after a successful revalidation (304)."""
+        with self._lock:
+            self._db.execute("UPDATE entries SET expires=?, last_access=? WHERE key=?", (expires, time.time(), key))
+            self._db.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            row = self._db.execute("SELECT size FROM entries WHERE key=?", (key,)).fetchone()
+            self._db.execute("DELETE FROM entries WHERE key=?", (key,))
+            self._db.commit()
+            if row:
+                self._total -= row[0]
+        try:
+            os.remove(self._body_path(key))
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        """
+        Drop least-recently-used entries until the store is under EVICT_TO of the byte budget.
+        Re-sums the index first, which also corrects the running total for entries written by
+        other processes.
+        """
+        with self._lock:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            self._total = total
+            if total <= self.max_bytes:
+                return
+            victims = []
+            for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY last_access"):
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+                victims.append(key)
+                total -= size
+            self._db.executemany("DELETE FROM entries WHERE key=?", [(k,) for k in victims])
+            self._db.commit()
+            self._total = total
+        for key in victims:
+            try:
+                os.remove(self._body_path(key))
+            except OSError:
+                pass
+        logger.info("Evicted %d HTTP cache entries to stay under %d bytes", len(victims), self.max_bytes)
@@ -1,45 +1,96 @@
-import hashlib
-import json
-import os
+import threading
 import time
-from typing import Any, Dict, Optional
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
 import requests
+from requests.adapters import HTTPAdapter
 from src.config import CFG
+from src.utils.http_cache import HttpCache, cache_key
 from src.utils.logging_utils import get_logger
 
 logger = get_logger(__name__)
-CACHE_DIR = os.path.join(".cache", "http")
-os.makedirs(CACHE_DIR, exist_ok=True)
 
-def _cache_path(key: str) -> str:
-    return os.path.join(CACHE_DIR, f"{key}.json")
+# One keep-alive session per host; requests.Session is safe to share across worker threads
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+_cache: HttpCache | None = None
+_cache_lock = threading.Lock()
 
-def _key_from(url: str, params: Optional[dict], headers: Optional[dict]) -> str:
-    s = url + "|" + json.dumps(params or {}, sort_keys=True) + "|" + json.dumps(headers or {}, sort_keys=True)
-    return hashlib.sha256(s.encode()).hexdigest()
+class RateLimited(RuntimeError):
+    """Raised instead of retrying when a caller opts out of 429 retries (e.g. daily quota exhausted)."""
 
-def get_json(url: str, params: Optional[dict] = None, headers: Optional[dict] = None, ttl: int | None = None, timeout: int | None = None) -> Dict[str, Any]:
+def get_session(url: str) -> requests.Session:
+    """Return the pooled session for the URL's host, creating it on first use."""
+    host = urlsplit(url).netloc
+    with _sessions_lock:
+        sess = _sessions.get(host)
+        if sess is None:
+            sess = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(CFG.REQUESTS_CONCURRENCY, 1))
+            sess.mount("https://", adapter)
+            sess.mount("http://", adapter)
+            _sessions[host] = sess
+        return sess
+
+def get_cache() -> HttpCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = HttpCache(CFG.HTTP_CACHE_DIR, CFG.HTTP_CACHE_MAX_BYTES)
+        return _cache
+
+def _expires_at(resp: requests.Response, ttl: int) -> float:
+    """Honour the server's Expires header when present, else fall back to our TTL."""
+    raw = resp.headers.get("Expires")
+    if raw:
+        try:
+            return parsedate_to_datetime(raw).timestamp()
+        except Exception:
+            pass
+    return time.time() + ttl
+
+def get_json(url: str, params: Optional[dict] = None, headers: Optional[dict] = None, ttl: int | None = None, timeout: int | None = None, retry_429: bool = True) -> Dict[str, Any]:
+    return fetch_json(url, params=params, headers=headers, ttl=ttl, timeout=timeout, retry_429=retry_429)[0]
+
+def fetch_json(url: str, params: Optional[dict] = None, headers: Optional[dict] = None, ttl: int | None = None, timeout: int | None = None, retry_429: bool = True) -> Tuple[Dict[str, Any], bool]:
+    """
+    get_json returning (body, from_cache). from_cache is True only when the body was served from the
+    local cache without a request; a 304 revalidation went over the network, so it reports False.
+    """
     ttl = ttl or CFG.REQUESTS_CACHE_TTL_SECONDS
     timeout = timeout or CFG.REQUESTS_TIMEOUT
-    key = _key_from(url, params, headers)
-    path = _cache_path(key)
+    cache = get_cache()
+    key = cache_key(url, params, headers)
 
-    # serve from cache
-    if os.path.exists(path):
-        age = time.time() - os.path.getmtime(path)
-        if age <= ttl:
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            except Exception:
-                pass
+    # serve from cache while fresh
+    entry = cache.lookup(key)
+    body = None
+    if entry is not None and (entry.fresh or entry.etag or entry.last_modified):
+        body = cache.load(entry)
+        if body is not None and entry.fresh:
+            return body, True
 
+    # stale entry: revalidate with the stored validators instead of refetching
+    req_headers = dict(headers or {})
+    if body is not None:
+        if entry.etag:
+            req_headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            req_headers["If-Modified-Since"] = entry.last_modified
+
+    session = get_session(url)
     # backoff loop
     # Exponential backoff (1.5^attempt seconds)
     backoff = 1.5
     for attempt in range(6):
         try:
-            resp = requests.get(url, params=params, headers=headers, timeout=timeout)
+            resp = session.get(url, params=params, headers=req_headers, timeout=timeout)
+            if resp.status_code == 304 and body is not None:
+                cache.touch(key, _expires_at(resp, ttl))
+                return body, False
+            if resp.status_code == 429 and not retry_429:
+                raise RateLimited(f"HTTP 429 from {urlsplit(url).netloc}: {resp.text[:200]}")
             # Retry on 429 or 5xx
             if resp.status_code == 429 or 500 <= resp.status_code < 600:
                 raise requests.HTTPError(f"HTTP {resp.status_code}: {resp.text[:200]}")
@@ -48,14 +99,18 @@ def get_json(url: str, params: Optional[dict] = None, headers: Optional[dict] =
 
             # Write to cache (best-effort)
             try:
-                with open(path, "w", encoding="utf-8") as f:
-                    json.dump(data, f)
-            except Exception:
-                pass
-
-            return data
+                cache.put(key, data, _expires_at(resp, ttl),
+                          etag=resp.headers.get("ETag"), last_modified=resp.headers.get("Last-Modified"))
+            except Exception as e:
+                logger.warning("HTTP cache write failed for %s: %s", url, e)
+            return data, False
 
+        except RateLimited:
+            raise
         except Exception as e:
+            if isinstance(e, requests.HTTPError) and e.response is not None:
+                # 4xx from raise_for_status (429 and 5xx are raised above without a response): retrying won't help
+                raise
             sleep = backoff ** attempt
             logger.warning(
                 "GET %s failed (attempt %d): %s; sleeping %.1fs",
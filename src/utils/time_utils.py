@@ -1,4 +1,6 @@
 from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
 from dateutil import parser
 
 def now_utc() -> datetime:
@@ -20,3 +22,29 @@ def floor_hour(dt: datetime) -> datetime:
 def horizon_hours(issue_time: datetime, valid_time: datetime) -> int:
     delta = to_utc(valid_time) - to_utc(issue_time)
     return int(round(delta.total_seconds() / 3600))
+
+def to_utc_index(values) -> pd.DatetimeIndex:
+    """
+    Vectorized to_utc for a whole column: ISO-8601 strings, epoch seconds or datetimes.
+    Naive values are taken as UTC, offset-aware values are converted to UTC.
+    """
+    # Datetime-typed input (DatetimeIndex/Series, datetime64 arrays) needs no parsing; np.asarray
+    # would turn tz-aware values into an object array of Timestamps parsed one by one
+    dtype = getattr(values, "dtype", None)
+    if dtype is not None and (isinstance(dtype, pd.DatetimeTZDtype) or dtype.kind == "M"):
+        idx = pd.DatetimeIndex(values)
+        return idx.tz_localize("UTC") if idx.tz is None else idx.tz_convert("UTC")
+    arr = np.asarray(values)
+    if arr.dtype.kind == "O" and pd.api.types.infer_dtype(arr, skipna=True) in ("integer", "floating", "mixed-integer-float"):
+        # epoch seconds with gaps (None) arrive as objects; without unit="s" they'd be read as nanoseconds
+        arr = pd.to_numeric(arr, errors="coerce")
+    if arr.dtype.kind in "iuf":
+        return pd.DatetimeIndex(pd.to_datetime(arr, unit="s", utc=True))
+    if arr.dtype.kind in "OUS" and arr.size and isinstance(arr.flat[0], str):
+        return pd.DatetimeIndex(pd.to_datetime(arr, utc=True, format="ISO8601"))
+    return pd.DatetimeIndex(pd.to_datetime(arr, utc=True))
+
+def horizon_hours_array(issue_time: datetime, valid_times) -> np.ndarray:
+    """Vectorized horizon_hours: whole hours from issue_time to each valid time."""
+    delta = to_utc_index(valid_times) - pd.Timestamp(to_utc(issue_time))
+    return np.rint((delta / pd.Timedelta(hours=1)).to_numpy()).astype("int64")
@@ -1,37 +1,52 @@
 from typing import Literal, Optional
+import numpy as np
 
 Variable = Literal["temp_2m", "wind_speed_10m", "precipitation"]
 
+# Affine conversions to canonical units: value_SI = value * scale + offset
+TEMP_UNITS = {
+    "C": (1.0, 0.0), "°C": (1.0, 0.0), "celsius": (1.0, 0.0),
+    "K": (1.0, -273.15), "kelvin": (1.0, -273.15),
+    "F": (5.0 / 9.0, -32.0 * 5.0 / 9.0), "°F": (5.0 / 9.0, -32.0 * 5.0 / 9.0), "fahrenheit": (5.0 / 9.0, -32.0 * 5.0 / 9.0),
+}
+WIND_UNITS = {
+    "m/s": (1.0, 0.0), "mps": (1.0, 0.0),
+    "km/h": (1.0 / 3.6, 0.0), "kmh": (1.0 / 3.6, 0.0), "kph": (1.0 / 3.6, 0.0),
+    "mph": (0.44704, 0.0),
+    "kt": (0.514444, 0.0), "knot": (0.514444, 0.0), "knots": (0.514444, 0.0),
+}
+PRECIP_UNITS = {
+    "mm": (1.0, 0.0),
+    "cm": (10.0, 0.0),
+    "m": (1000.0, 0.0),
+    "in": (25.4, 0.0), "inch": (25.4, 0.0), "inches": (25.4, 0.0),
+}
+# variable -> (unit table, canonical unit, label used in errors)
+UNIT_TABLES = {
+    "temp_2m": (TEMP_UNITS, "C", "temp"),
+    "wind_speed_10m": (WIND_UNITS, "m/s", "wind"),
+    "precipitation": (PRECIP_UNITS, "mm", "precip"),
+}
+
+def _factors(variable: str, unit: Optional[str]) -> tuple[float, float, str]:
+    table, si, label = UNIT_TABLES[variable]
+    unit = unit or si
+    if unit not in table:
+        raise ValueError(f"Unsupported {label} unit: {unit}")
+    scale, offset = table[unit]
+    return scale, offset, si
+
 def to_celsius(x: float, unit: str) -> float:
-    if unit in ("C", "°C", "celsius"):
-               return x
-    if unit in ("K", "kelvin"):
-        return x - 273.15
-    if unit in ("F", "°F", "fahrenheit"):
-        return (x - 32.0) * 5.0 / 9.0
-    raise ValueError(f"Unsupported temp unit: {unit}")
+    scale, offset, _ = _factors("temp_2m", unit)
+    return x * scale + offset
 
 def to_mps(x: float, unit: str) -> float:
-    if unit in ("m/s", "mps"):
-        return x
-    if unit in ("km/h", "kmh", "kph"):
-        return x / 3.6
-    if unit in ("mph",):
-        return x * 0.44704
-    if unit in ("kt", "knot", "knots"):
-        return x * 0.514444
-    raise ValueError(f"Unsupported wind unit: {unit}")
+    scale, offset, _ = _factors("wind_speed_10m", unit)
+    return x * scale + offset
 
 def to_mm(x: float, unit: str) -> float:
-    if unit in ("mm",):
-        return x
-    if unit in ("cm",):
-        return x * 10.0
-    if unit in ("m",):
-        return x * 1000.0
-    if unit in ("in", "inch", "inches"):
-        return x * 25.4
-    raise ValueError(f"Unsupported precip unit: {unit}")
+    scale, offset, _ = _factors("precipitation", unit)
+    return x * scale + offset
 
 def normalize_value(variable: Variable, value: float, src_unit: Optional[str]) -> tuple[float, str]:
     """Return (value_SI, unit_SI) for variable."""
@@ -41,3 +56,16 @@ def normalize_value(variable: Variable, value: float, src_unit: Optional[str]) -
         return to_mps(value, src_unit or "m/s"), "m/s"
     if variable == "precipitation":
         return to_mm(value, src_unit or "mm"), "mm"
+
+def normalize_array(variable: Variable, values, src_unit: Optional[str]) -> tuple[np.ndarray, str]:
+    """
+    Vectorized normalize_value: convert a whole column (list/ndarray/Series) to float64 SI values.
+    The unit is validated once per batch; missing values (None) become NaN.
+    """
+    scale, offset, si = _factors(variable, src_unit)
+    arr = np.asarray(values, dtype="float64")
+    if scale != 1.0:
+        arr = arr * scale
+    if offset != 0.0:
+        arr = arr + offset
+    return arr, si
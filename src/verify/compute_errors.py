@@ -1,46 +1,120 @@
 """
-Join forecasts with observations by (lat, lon, variable, valid_time == obs_time).
-Compute MAE, RMSE, MAPE per source/horizon/variable per valid hour.
+Join forecasts with observations by (location_id, variable_id, valid_time == obs_time).
+Store error sufficient statistics (n, sum err, sum |err|, sum err^2, sum APE) per
+source/variable/horizon/location/valid hour in `error_stats`, then refresh the daily rollup
+`error_stats_daily`. MAE/RMSE/MAPE for any window are derived from summed statistics.
+Incremental by default: only (variable, valid_time) groups that received observations since the
+last watermark (observations.created_at) are recomputed, with the aggregation done in SQL.
+`--full` recomputes everything, streaming the aggregated result in chunks.
 """
+import sys
+from datetime import timedelta
 import pandas as pd
 from sqlalchemy import text
-from src.utils.db_utils import fetch_df, insert_dataframe
+from src.utils.db_utils import db_conn, get_watermark, iter_df, set_watermark, upsert_dataframe
 from src.utils.logging_utils import get_logger
 
 logger = get_logger(__name__)
 
-SQL_JOIN = """
-WITH f AS (
-  SELECT source, lat, lon, variable, valid_time, horizon_hours, value AS f_value
-  FROM forecasts
-),
-o AS (
-  SELECT lat, lon, variable, obs_time AS valid_time, value AS o_value
+WATERMARK = "error_stats.observations"
+# Re-scan this much before the watermark: rows committed late can carry an earlier created_at
+WATERMARK_OVERLAP = timedelta(hours=1)
+
+STATS_SELECT = """
+SELECT f.source_id, f.variable_id, f.horizon_hours, f.location_id, f.valid_time,
+       count(*) AS n,
+       sum(f.value - o.value) AS sum_err,
+       sum(abs(f.value - o.value)) AS sum_abs_err,
+       sum((f.value - o.value) ^ 2) AS sum_sq_err,
+       sum(abs(f.value - o.value) / (abs(o.value) + 1e-6)) AS sum_ape
+"""
+STATS_GROUP = "GROUP BY f.source_id, f.variable_id, f.horizon_hours, f.location_id, f.valid_time"
+
+SQL_FULL = STATS_SELECT + """
+FROM forecasts f
+JOIN observations o ON f.location_id = o.location_id AND f.variable_id = o.variable_id AND f.valid_time = o.obs_time
+""" + STATS_GROUP
+
+SQL_INCREMENTAL = """
+WITH k AS (
+  SELECT DISTINCT variable_id, obs_time
   FROM observations
+  WHERE created_at > :since AND created_at <= :until
 )
-SELECT f.source, f.variable, f.valid_time, f.horizon_hours, f.f_value, o.o_value
-FROM f JOIN o
-ON f.lat=o.lat AND f.lon=o.lon AND f.variable=o.variable AND f.valid_time=o.valid_time
+""" + STATS_SELECT + """
+FROM k
+JOIN observations o ON o.variable_id = k.variable_id AND o.obs_time = k.obs_time
+JOIN forecasts f ON f.location_id = o.location_id AND f.variable_id = o.variable_id AND f.valid_time = o.obs_time
+""" + STATS_GROUP
+
+# Rebuild daily rows for [lo, hi) from the hourly statistics; idempotent, so re-runs are exact
+SQL_ROLLUP = """
+INSERT INTO error_stats_daily (source_id, variable_id, horizon_hours, location_id, day,
+                               n, sum_err, sum_abs_err, sum_sq_err, sum_ape)
+SELECT source_id, variable_id, horizon_hours, location_id, (valid_time AT TIME ZONE 'UTC')::date,
+       sum(n), sum(sum_err), sum(sum_abs_err), sum(sum_sq_err), sum(sum_ape)
+FROM error_stats
+WHERE valid_time >= :lo AND valid_time < :hi
+GROUP BY 1, 2, 3, 4, 5
+ON CONFLICT (source_id, variable_id, horizon_hours, location_id, day) DO UPDATE SET
+  n = EXCLUDED.n, sum_err = EXCLUDED.sum_err, sum_abs_err = EXCLUDED.sum_abs_err,
+  sum_sq_err = EXCLUDED.sum_sq_err, sum_ape = EXCLUDED.sum_ape
 """
 
-def compute():
-    df = fetch_df(SQL_JOIN)
-    if df.empty:
+STATS_DTYPES = {"source_id": "int16", "variable_id": "int16", "horizon_hours": "int32", "location_id": "int32", "n": "int32"}
+
+def _store(sql: str, params: dict | None = None) -> tuple[int, pd.Timestamp | None, pd.Timestamp | None]:
+    """Upsert streamed statistic chunks; returns (rows, min valid_time, max valid_time)."""
+    rows, lo, hi = 0, None, None
+    for chunk in iter_df(sql, params, dtypes=STATS_DTYPES):
+        if chunk.empty:
+            continue
+        rows += upsert_dataframe(chunk, "error_stats")
+        t = pd.to_datetime(chunk["valid_time"], utc=True)
+        lo = t.min() if lo is None else min(lo, t.min())
+        hi = t.max() if hi is None else max(hi, t.max())
+    return rows, lo, hi
+
+def refresh_daily(lo: pd.Timestamp, hi: pd.Timestamp) -> None:
+    """Recompute the daily rollup for every UTC day touching [lo, hi]."""
+    lo = lo.tz_convert("UTC").floor("D")
+    hi = hi.tz_convert("UTC").floor("D") + pd.Timedelta(days=1)
+    with db_conn() as conn:
+        conn.execute(text(SQL_ROLLUP), {"lo": lo.to_pydatetime(), "hi": hi.to_pydatetime()})
+    logger.info("Refreshed daily error rollup for %s .. %s", lo.date(), (hi - pd.Timedelta(days=1)).date())
+
+def compute_full() -> int:
+    rows, lo, hi = _store(SQL_FULL)
+    if rows:
+        refresh_daily(lo, hi)
+    else:
         logger.info("No forecast-observation pairs yet")
-        return pd.DataFrame()
-    grp = df.groupby(["source","variable","valid_time","horizon_hours"])
-    out = grp.apply(lambda g: pd.Series({
-        "mae": (g["f_value"] - g["o_value"]).abs().mean(),
-        "rmse": ((g["f_value"] - g["o_value"])**2).mean() ** 0.5,
-        "mape": ( (g["f_value"] - g["o_value"]).abs() / (g["o_value"].abs() + 1e-6) ).mean(),
-        "n": len(g),
-    })).reset_index()
-    return out
-
-def main():
-    df = compute()
-    if not df.empty:
-               insert_dataframe(df, "errors")
+    return rows
+
+def compute_incremental() -> int:
+    """Recompute statistics for observation hours that arrived since the watermark; returns rows upserted."""
+    with db_conn() as conn:
+        until = conn.execute(text("SELECT max(created_at) FROM observations")).scalar()
+    if until is None:
+        logger.info("No observations yet")
+        return 0
+    last = get_watermark(WATERMARK)
+    if last is None:
+        logger.info("No error watermark yet; computing full history")
+        rows = compute_full()
+    else:
+        rows, lo, hi = _store(SQL_INCREMENTAL, {"since": last - WATERMARK_OVERLAP, "until": until})
+        logger.info("Recomputed %d error cells for observations since %s", rows, last)
+        if rows:
+            refresh_daily(lo, hi)
+    set_watermark(WATERMARK, until)
+    return rows
+
+def main(full: bool = False):
+    if full:
+        compute_full()
+    else:
+        compute_incremental()
 
 if __name__ == "__main__":
-    main()
+    main(full="--full" in sys.argv[1:])
@@ -1,44 +1,49 @@
 # src/verify/leaderboard.py
 
 import pandas as pd
-from sqlalchemy import text
 from src.utils.db_utils import fetch_df
 from src.utils.logging_utils import get_logger
 
 logger = get_logger(__name__)
 
-def leaderboard(days: int = 7) -> pd.DataFrame:
+SUMMARY_COLUMNS = ["source", "variable", "horizon_hours", "rmse", "mae", "mape", "bias", "n"]
+
+def error_summary(days: int = 7) -> pd.DataFrame:
     """
-    Return a leaderboard of the best-performing sources per variable & horizon
-    over the last `days` days, based on RMSE (lower is better).
+    Pooled error metrics per source, variable & horizon over the last `days` UTC days,
+    from the daily sufficient-statistics rollup (RMSE = sqrt(sum of squared errors / n)).
     """
     sql = """
     SELECT
-        source,
-        variable,
-        horizon_hours,
-        valid_time,
-        rmse,
-        mae,
-        mape
-    FROM errors
-    WHERE valid_time >= now() - (interval '1 day' * :days)
+        s.name AS source,
+        v.name AS variable,
+        d.horizon_hours,
+        sqrt(sum(d.sum_sq_err) / sum(d.n)) AS rmse,
+        sum(d.sum_abs_err) / sum(d.n) AS mae,
+        sum(d.sum_ape) / sum(d.n) AS mape,
+        sum(d.sum_err) / sum(d.n) AS bias,
+        sum(d.n) AS n
+    FROM error_stats_daily d
+    JOIN sources s ON s.id = d.source_id
+    JOIN variables v ON v.id = d.variable_id
+    WHERE d.day > (now() AT TIME ZONE 'UTC')::date - :days
+    GROUP BY s.name, v.name, d.horizon_hours
+    HAVING sum(d.n) > 0
     """
     df = fetch_df(sql, {"days": int(days)})
     if df.empty:
-        logger.info("No error rows found in the last %s days", days)
-        return pd.DataFrame(columns=["variable", "horizon_hours", "best_source", "rmse", "mae", "mape", "n"])
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+    return df[SUMMARY_COLUMNS]
 
-    # Aggregate by source, variable, horizon: mean metrics + count
-    agg = (
-        df.groupby(["source", "variable", "horizon_hours"], as_index=False)
-          .agg(
-              rmse=("rmse", "mean"),
-              mae=("mae", "mean"),
-              mape=("mape", "mean"),
-              n=("rmse", "size"),
-          )
-    )
+def leaderboard(days: int = 7) -> pd.DataFrame:
+    """
+    Return a leaderboard of the best-performing sources per variable & horizon
+    over the last `days` days, based on RMSE (lower is better).
+    """
+    agg = error_summary(days)
+    if agg.empty:
+        logger.info("No error statistics found in the last %s days", days)
+        return pd.DataFrame(columns=["variable", "horizon_hours", "best_source", "rmse", "mae", "mape", "n"])
 
     # For each (variable, horizon), pick the source with the lowest RMSE
     idx = agg.groupby(["variable", "horizon_hours"])["rmse"].idxmin()
@@ -48,4 +53,4 @@ def leaderboard(days: int = 7) -> pd.DataFrame:
     best = best.rename(columns={"source": "best_source"})
     best = best[["variable", "horizon_hours", "best_source", "rmse", "mae", "mape", "n"]]
     best = best.sort_values(["variable", "horizon_hours"]).reset_index(drop=True)
-
+    return best
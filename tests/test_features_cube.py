@@ -0,0 +1,26 @@
+"""Features assembled from the forecast cube path must merge with observations read via read_sql."""
+import numpy as np
+import pandas as pd
+import src.model.features as features
+from src.utils.forecast_cube import ForecastCube
+
+def test_iter_features_all_from_cube(tmp_path, monkeypatch):
+    horizon = 24
+    valid = pd.date_range("2026-01-02", periods=48, freq="h", tz="UTC")
+    cube = ForecastCube("temp_2m", str(tmp_path))
+    cube.update(pd.DataFrame({"location_id": 1, "source": "open_meteo", "valid_time": valid,
+                              "horizon_hours": horizon, "value": np.arange(48.0)}))
+    # read_sql returns timestamptz columns in microseconds
+    obs = pd.DataFrame({"location_id": np.int32(1), "valid_time": valid.as_unit("us"),
+                        "value": np.arange(48, dtype=np.float32)})
+
+    monkeypatch.setattr(features, "_cube_vendor_frames",
+                        lambda variable, horizons, since=None: iter([(horizon, cube.vendor_frame(horizon))]))
+    monkeypatch.setattr(features, "get_observations", lambda variable, since=None: obs.copy())
+    monkeypatch.setattr(features, "fetch_df",
+                        lambda sql, params=None: pd.DataFrame({"location_id": [1], "lat": [40.0], "lon": [-74.0]}))
+
+    Xy = dict(features.iter_features_all("temp_2m", [horizon]))[horizon]
+    assert len(Xy) == 48
+    assert Xy["y"].notna().all()
+    assert (Xy["open_meteo"].to_numpy() == Xy["y"].to_numpy()).all()